@@ -3,3 +3,6 @@
 
 # Every day at 7am UTC, kick off the DB->RabbitMQ refresh
 0 7 * * * docker service update --replicas 1 --force pypi_scraper_unprocessed_record_loader
+
+# Every hour, create upcoming cdc.event_log partitions and drop the ones every consumer has read
+0 * * * * docker service update --replicas 1 --force pypi_scraper_event_log_maintenance
@@ -0,0 +1,7 @@
+-- Supports the loose index scan in RequirementsRepository.get_distinct_version_constraints,
+-- which lets the candidate correlation service visit each distinct constraint on a
+-- dependency once, instead of every requirement on that dependency.
+create index if not exists requirements_dependency_name_version_constraint_idx
+    on pypi_packages.requirements
+    using btree
+    (dependency_name, version_constraint);
@@ -0,0 +1,53 @@
+--
+-- pypi_packages.constraint_candidates
+--
+
+-- Millions of requirements share the same (dependency_name, version_constraint) pair, and
+-- every one of them resolves to the exact same list of candidate versions. This table
+-- stores that list once per distinct pair. Requirements point at their shared record via
+-- their own (dependency_name, version_constraint) columns, see the "requirement_candidates"
+-- view below.
+--
+-- The "candidates" table (one row per requirement_id) is superseded by this table. It's left
+-- in place so that it can be dropped by hand once nothing reads from it anymore.
+
+create table if not exists pypi_packages.constraint_candidates (
+    dependency_name text not null,
+    version_constraint text not null,
+    candidate_versions text[] not null,
+    candidate_version_ids uuid[] not null,
+    date_last_correlated timestamp not null default now(),
+    primary key (dependency_name, version_constraint)
+);
+
+-- Carry over the work that has already been done for the per-requirement table.
+insert into pypi_packages.constraint_candidates (
+    dependency_name,
+    version_constraint,
+    candidate_versions,
+    candidate_version_ids
+)
+select distinct on (req.dependency_name, req.version_constraint)
+    req.dependency_name,
+    req.version_constraint,
+    cand.candidate_versions,
+    cand.candidate_version_ids
+from pypi_packages.candidates cand
+join pypi_packages.requirements req on req.requirement_id = cand.requirement_id
+where
+    cand.candidate_versions is not null
+    and cand.candidate_version_ids is not null
+order by req.dependency_name, req.version_constraint
+on conflict do nothing;
+
+create or replace view pypi_packages.requirement_candidates as
+select
+    req.requirement_id,
+    req.dependency_name,
+    req.version_constraint,
+    cc.candidate_versions,
+    cc.candidate_version_ids
+from pypi_packages.requirements req
+join pypi_packages.constraint_candidates cc
+    on cc.dependency_name = req.dependency_name
+    and cc.version_constraint = req.version_constraint;
@@ -0,0 +1,30 @@
+--
+-- pypi_packages.version_orders
+--
+
+-- An append-only ordering of each package's versions. When a package is first seen,
+-- its versions are sorted oldest to newest. Versions discovered later are appended to
+-- the end, so that a version's ordinal (its index into these arrays) never changes.
+
+create table if not exists pypi_packages.version_orders (
+    package_name text not null primary key,
+    version_ids uuid[] not null,
+    package_versions text[] not null
+);
+
+--
+-- pypi_packages.constraint_candidates
+--
+
+-- Alternate encoding of the candidate lists, as ranges of ordinals into the dependency's
+-- version order. A lax constraint like "requests>=2" compresses down to a single range.
+-- Records encoded this way leave the candidate arrays null.
+
+alter table pypi_packages.constraint_candidates
+    add column if not exists candidate_ranges int4multirange null;
+
+alter table pypi_packages.constraint_candidates
+    alter column candidate_versions drop not null;
+
+alter table pypi_packages.constraint_candidates
+    alter column candidate_version_ids drop not null;
@@ -0,0 +1,211 @@
+--
+-- Compact keys
+--
+
+-- Every foreign key in the schema is either a uuid (16 bytes) or a package name (text,
+-- usually 10-30 bytes), and requirements repeat both for every row. This migration adds a
+-- compact variant of each key alongside the existing ones:
+--
+-- - package_names.package_id: an interned bigint id for each package name.
+-- - versions.version_key, distributions.distribution_key: bigint surrogate keys.
+-- - versions.package_id, distributions.version_key, requirements.distribution_key and
+--   requirements.dependency_id: bigint references to the above.
+--
+-- New rows are assigned their compact keys by the "assign_compact_keys" triggers below.
+-- Existing rows are backfilled by the "migrate_compact_keys" entrypoint, which must be run
+-- once after this migration. The columns are added without defaults so that this
+-- migration doesn't rewrite any tables.
+--
+-- The uuid and text keys are left in place, as they're still the identifiers used
+-- everywhere else, so this migration grows every table it touches. See "notes/Database
+-- Size.md" for switching joins over to the compact keys, and the net size effect.
+
+create sequence if not exists pypi_packages.package_id_seq as bigint;
+create sequence if not exists pypi_packages.version_key_seq as bigint;
+create sequence if not exists pypi_packages.distribution_key_seq as bigint;
+
+alter table pypi_packages.package_names
+    add column if not exists package_id bigint null;
+
+alter table pypi_packages.versions
+    add column if not exists version_key bigint null,
+    add column if not exists package_id bigint null;
+
+alter table pypi_packages.distributions
+    add column if not exists distribution_key bigint null,
+    add column if not exists version_key bigint null;
+
+alter table pypi_packages.requirements
+    add column if not exists distribution_key bigint null,
+    add column if not exists dependency_id bigint null;
+
+create unique index if not exists package_names_package_id_idx
+    on pypi_packages.package_names
+    using btree
+    (package_id);
+
+create unique index if not exists versions_version_key_idx
+    on pypi_packages.versions
+    using btree
+    (version_key);
+
+create index if not exists versions_package_id_idx
+    on pypi_packages.versions
+    using btree
+    (package_id);
+
+create unique index if not exists distributions_distribution_key_idx
+    on pypi_packages.distributions
+    using btree
+    (distribution_key);
+
+create index if not exists distributions_version_key_idx
+    on pypi_packages.distributions
+    using btree
+    (version_key);
+
+create index if not exists requirements_distribution_key_idx
+    on pypi_packages.requirements
+    using btree
+    (distribution_key);
+
+create index if not exists requirements_dependency_id_idx
+    on pypi_packages.requirements
+    using btree
+    (dependency_id);
+
+--
+-- Assigning compact keys to new rows
+--
+
+-- These triggers are named so that they fire before the "canonicalize_*" and "cdc_*"
+-- triggers, so that CDC events include the compact keys. As a result, they canonicalize
+-- package names themselves before looking them up.
+
+create or replace function pypi_packages.package_names_assign_compact_keys_tr()
+    returns trigger as
+    $body$
+    begin
+        if new.package_id is null then
+            new.package_id = nextval('pypi_packages.package_id_seq');
+        end if;
+        return new;
+    end;
+    $body$
+language plpgsql;
+
+create or replace function pypi_packages.versions_assign_compact_keys_tr()
+    returns trigger as
+    $body$
+    begin
+        if new.version_key is null then
+            new.version_key = nextval('pypi_packages.version_key_seq');
+        end if;
+        if new.package_id is null then
+            select pn.package_id into new.package_id
+            from pypi_packages.package_names pn
+            where pn.package_name = pypi_packages.canonicalize_package_name(new.package_name);
+        end if;
+        return new;
+    end;
+    $body$
+language plpgsql;
+
+create or replace function pypi_packages.distributions_assign_compact_keys_tr()
+    returns trigger as
+    $body$
+    begin
+        if new.distribution_key is null then
+            new.distribution_key = nextval('pypi_packages.distribution_key_seq');
+        end if;
+        if new.version_key is null then
+            select v.version_key into new.version_key
+            from pypi_packages.versions v
+            where v.version_id = new.version_id;
+        end if;
+        return new;
+    end;
+    $body$
+language plpgsql;
+
+-- Dependencies aren't guaranteed to exist in package_names when a requirement is
+-- inserted, in which case dependency_id is left null, and filled in by the next run of
+-- "migrate_compact_keys".
+create or replace function pypi_packages.requirements_assign_compact_keys_tr()
+    returns trigger as
+    $body$
+    begin
+        if new.distribution_key is null then
+            select d.distribution_key into new.distribution_key
+            from pypi_packages.distributions d
+            where d.distribution_id = new.distribution_id;
+        end if;
+        if new.dependency_id is null then
+            select pn.package_id into new.dependency_id
+            from pypi_packages.package_names pn
+            where pn.package_name = pypi_packages.canonicalize_package_name(new.dependency_name);
+        end if;
+        return new;
+    end;
+    $body$
+language plpgsql;
+
+create or replace trigger assign_compact_keys
+    before insert
+    on pypi_packages.package_names
+    for each row
+    execute function pypi_packages.package_names_assign_compact_keys_tr();
+
+create or replace trigger assign_compact_keys
+    before insert
+    on pypi_packages.versions
+    for each row
+    execute function pypi_packages.versions_assign_compact_keys_tr();
+
+create or replace trigger assign_compact_keys
+    before insert
+    on pypi_packages.distributions
+    for each row
+    execute function pypi_packages.distributions_assign_compact_keys_tr();
+
+create or replace trigger assign_compact_keys
+    before insert
+    on pypi_packages.requirements
+    for each row
+    execute function pypi_packages.requirements_assign_compact_keys_tr();
+
+--
+-- Backfills
+--
+
+-- Backfilling compact keys updates every row of the largest tables, and none of those
+-- updates are meaningful to CDC subscribers. Sessions can opt out of CDC for the rest of
+-- the transaction with "set local cdc.skip_events = 'on'".
+create or replace function cdc.event_log_insert_tr()
+    returns trigger as $body$
+    begin
+        if (tg_op <> 'UPDATE' or old <> new)
+            and current_setting('cdc.skip_events', true) is distinct from 'on'
+        then
+            insert into cdc.event_log (
+                "operation",
+                "schema",
+                "table",
+                "before",
+                "after"
+            ) values (
+                tg_op::text,
+                tg_table_schema::text,
+                tg_table_name::text,
+                row_to_json(old),
+                row_to_json(new)
+            );
+        end if;
+
+        if tg_op = 'DELETE' then
+            return old;
+        else
+            return new;
+        end if;
+    end;
+$body$ language plpgsql;
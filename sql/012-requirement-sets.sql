@@ -0,0 +1,93 @@
+--
+-- pypi_packages.requirement_sets
+--
+
+-- Most distributions of a version, and often consecutive versions of a package, have the
+-- exact same "Requires-Dist" lines. Rather than storing one requirements row per line per
+-- distribution, a distribution can reference a shared, content-addressed set of
+-- requirements. A set is identified by the sha256 hash of its (sorted) contents, and is
+-- only written the first time that hash is seen.
+--
+-- Which storage model the distribution processor writes to is controlled by the
+-- REQUIREMENTS_STORAGE setting. Existing rows in "requirements" are left in place, and
+-- the "distribution_requirements" view below reads from both models.
+
+create table if not exists pypi_packages.requirement_sets (
+    requirement_set_hash bytea not null primary key,
+    num_requirements int not null,
+    date_discovered timestamp not null default now()
+);
+
+create table if not exists pypi_packages.requirement_set_members (
+    requirement_set_hash bytea not null,
+    requirement_id uuid not null default gen_random_uuid(),
+    extras text not null,
+    dependency_name text not null,
+    dependency_extras text not null,
+    version_constraint text not null,
+    dependency_extras_arr text[] not null,
+    parsable boolean not null default true,
+    specifier_set "specifier"[] null
+);
+
+alter table pypi_packages.requirement_set_members
+    add foreign key (requirement_set_hash)
+    references pypi_packages.requirement_sets (requirement_set_hash)
+    on delete cascade;
+
+create index if not exists requirement_set_members_requirement_set_hash_idx
+    on pypi_packages.requirement_set_members
+    using btree
+    (requirement_set_hash);
+
+-- Same purpose as requirements_dependency_name_version_constraint_idx.
+create index if not exists requirement_set_members_dependency_name_version_constraint_idx
+    on pypi_packages.requirement_set_members
+    using btree
+    (dependency_name, version_constraint);
+
+alter table pypi_packages.distributions
+    add column if not exists requirement_set_hash bytea null;
+
+create index if not exists distributions_requirement_set_hash_idx
+    on pypi_packages.distributions
+    using btree
+    (requirement_set_hash);
+
+create or replace trigger canonicalize_dependency_name
+    before insert or update
+    on pypi_packages.requirement_set_members
+    for each row
+    execute function pypi_packages.canonicalize_dependency_name_tr();
+
+-- Newly discovered sets flow into candidate correlation, the same as new requirements.
+create or replace trigger cdc_event_log_insert
+    before insert or update or delete
+    on pypi_packages.requirement_set_members
+    for each row
+    execute function cdc.event_log_insert_tr();
+
+create or replace view pypi_packages.distribution_requirements as
+select
+    req.requirement_id,
+    req.distribution_id,
+    req.extras,
+    req.dependency_name,
+    req.dependency_extras,
+    req.version_constraint,
+    req.dependency_extras_arr,
+    req.parsable
+from pypi_packages.requirements req
+union all
+select
+    rsm.requirement_id,
+    dist.distribution_id,
+    rsm.extras,
+    rsm.dependency_name,
+    rsm.dependency_extras,
+    rsm.version_constraint,
+    rsm.dependency_extras_arr,
+    rsm.parsable
+from pypi_packages.distributions dist
+join pypi_packages.requirement_set_members rsm
+    on rsm.requirement_set_hash = dist.requirement_set_hash;
@@ -0,0 +1,252 @@
+--
+-- pypi_packages.requirements_partitioned
+--
+
+-- A hash-partitioned replacement for the "requirements" table, partitioned on
+-- distribution_id. All of a distribution's requirements land in the same partition, so
+-- deleting/reprocessing a distribution only touches one partition, and vacuums, index
+-- rebuilds and scans can run one (much smaller) partition at a time.
+--
+-- Distributions are left unpartitioned: inserts rely on the table-wide unique constraint on
+-- package_url, which postgres can't enforce across partitions keyed on anything else.
+--
+-- Migrating is done online by the "migrate_partitioned_requirements" entrypoint:
+--
+-- 1. While this migration is installed, writes to "requirements" are mirrored into
+--    "requirements_partitioned" by the "mirror_to_partitioned" trigger.
+-- 2. The entrypoint copies existing rows over, one key range at a time. Rows that were
+--    already mirrored are skipped by the primary key.
+-- 3. The entrypoint calls pypi_packages.swap_partitioned_requirements(), which swaps the
+--    tables in a single short transaction. The old table is kept as
+--    "requirements_unpartitioned" until it's dropped by hand.
+--
+-- The number of partitions must match the REQUIREMENTS_PARTITION_COUNT setting.
+
+create table if not exists pypi_packages.requirements_partitioned (
+    requirement_id uuid not null,
+    distribution_id uuid not null,
+    extras text not null,
+    dependency_name text not null,
+    dependency_extras text not null,
+    version_constraint text not null,
+    dependency_extras_arr text[] not null,
+    parsable boolean not null default true,
+    specifier_set "specifier"[] null,
+    distribution_key bigint null,
+    dependency_id bigint null,
+    primary key (distribution_id, requirement_id)
+) partition by hash (distribution_id);
+
+do $body$
+begin
+    for i in 0..15 loop
+        execute format(
+            'create table if not exists pypi_packages.requirements_p%s
+            partition of pypi_packages.requirements_partitioned
+            for values with (modulus 16, remainder %s);',
+            lpad(i::text, 2, '0'),
+            i
+        );
+    end loop;
+end;
+$body$;
+
+create index if not exists requirements_partitioned_dependency_name_idx
+    on pypi_packages.requirements_partitioned
+    using btree
+    (dependency_name);
+
+create index if not exists requirements_partitioned_requirement_id_idx
+    on pypi_packages.requirements_partitioned
+    using btree
+    (requirement_id);
+
+create index if not exists requirements_partitioned_dependency_name_version_constraint_idx
+    on pypi_packages.requirements_partitioned
+    using btree
+    (dependency_name, version_constraint);
+
+create index if not exists requirements_partitioned_distribution_key_idx
+    on pypi_packages.requirements_partitioned
+    using btree
+    (distribution_key);
+
+create index if not exists requirements_partitioned_dependency_id_idx
+    on pypi_packages.requirements_partitioned
+    using btree
+    (dependency_id);
+
+alter table pypi_packages.requirements_partitioned
+    add foreign key (distribution_id)
+    references pypi_packages.distributions (distribution_id)
+    on delete cascade;
+
+create or replace trigger assign_compact_keys
+    before insert
+    on pypi_packages.requirements_partitioned
+    for each row
+    execute function pypi_packages.requirements_assign_compact_keys_tr();
+
+create or replace trigger canonicalize_dependency_name
+    before insert or update
+    on pypi_packages.requirements_partitioned
+    for each row
+    execute function pypi_packages.canonicalize_dependency_name_tr();
+
+--
+-- CDC
+--
+
+-- Triggers on a partitioned table fire with the name of the partition as tg_table_name.
+-- The table name recorded in the event log can now be overridden with a trigger argument,
+-- so that events keep being routed by the parent table's name.
+create or replace function cdc.event_log_insert_tr()
+    returns trigger as $body$
+    begin
+        if (tg_op <> 'UPDATE' or old <> new)
+            and current_setting('cdc.skip_events', true) is distinct from 'on'
+        then
+            insert into cdc.event_log (
+                "operation",
+                "schema",
+                "table",
+                "before",
+                "after"
+            ) values (
+                tg_op::text,
+                tg_table_schema::text,
+                coalesce(tg_argv[0], tg_table_name)::text,
+                row_to_json(old),
+                row_to_json(new)
+            );
+        end if;
+
+        if tg_op = 'DELETE' then
+            return old;
+        else
+            return new;
+        end if;
+    end;
+$body$ language plpgsql;
+
+--
+-- Mirroring writes during the migration
+--
+
+create or replace function pypi_packages.requirements_mirror_to_partitioned_tr()
+    returns trigger as
+    $body$
+    begin
+        if tg_op in ('UPDATE', 'DELETE') then
+            delete from pypi_packages.requirements_partitioned
+            where
+                distribution_id = old.distribution_id
+                and requirement_id = old.requirement_id;
+        end if;
+
+        if tg_op in ('INSERT', 'UPDATE') then
+            insert into pypi_packages.requirements_partitioned (
+                requirement_id,
+                distribution_id,
+                extras,
+                dependency_name,
+                dependency_extras,
+                version_constraint,
+                dependency_extras_arr,
+                parsable,
+                specifier_set,
+                distribution_key,
+                dependency_id
+            ) values (
+                new.requirement_id,
+                new.distribution_id,
+                new.extras,
+                new.dependency_name,
+                new.dependency_extras,
+                new.version_constraint,
+                new.dependency_extras_arr,
+                new.parsable,
+                new.specifier_set,
+                new.distribution_key,
+                new.dependency_id
+            )
+            on conflict do nothing;
+        end if;
+
+        return null;
+    end;
+    $body$
+language plpgsql;
+
+create or replace trigger mirror_to_partitioned
+    after insert or update or delete
+    on pypi_packages.requirements
+    for each row
+    execute function pypi_packages.requirements_mirror_to_partitioned_tr();
+
+--
+-- Swapping the tables
+--
+
+create or replace function pypi_packages.swap_partitioned_requirements()
+    returns void as
+    $body$
+    begin
+        lock table pypi_packages.requirements in access exclusive mode;
+
+        drop trigger mirror_to_partitioned on pypi_packages.requirements;
+        drop trigger cdc_event_log_insert on pypi_packages.requirements;
+
+        -- The legacy per-requirement candidates table references the old table.
+        alter table pypi_packages.candidates
+            drop constraint if exists candidates_requirement_id_fkey;
+
+        alter table pypi_packages.requirements rename to requirements_unpartitioned;
+        alter table pypi_packages.requirements_partitioned rename to requirements;
+
+        create trigger cdc_event_log_insert
+            before insert or update or delete
+            on pypi_packages.requirements
+            for each row
+            execute function cdc.event_log_insert_tr('requirements');
+
+        -- Views are bound to the old table, so they're recreated on top of the new one.
+        create or replace view pypi_packages.requirement_candidates as
+        select
+            req.requirement_id,
+            req.dependency_name,
+            req.version_constraint,
+            cc.candidate_versions,
+            cc.candidate_version_ids
+        from pypi_packages.requirements req
+        join pypi_packages.constraint_candidates cc
+            on cc.dependency_name = req.dependency_name
+            and cc.version_constraint = req.version_constraint;
+
+        create or replace view pypi_packages.distribution_requirements as
+        select
+            req.requirement_id,
+            req.distribution_id,
+            req.extras,
+            req.dependency_name,
+            req.dependency_extras,
+            req.version_constraint,
+            req.dependency_extras_arr,
+            req.parsable
+        from pypi_packages.requirements req
+        union all
+        select
+            rsm.requirement_id,
+            dist.distribution_id,
+            rsm.extras,
+            rsm.dependency_name,
+            rsm.dependency_extras,
+            rsm.version_constraint,
+            rsm.dependency_extras_arr,
+            rsm.parsable
+        from pypi_packages.distributions dist
+        join pypi_packages.requirement_set_members rsm
+            on rsm.requirement_set_hash = dist.requirement_set_hash;
+    end;
+    $body$
+language plpgsql;
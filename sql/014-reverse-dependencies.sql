@@ -0,0 +1,27 @@
+--
+-- pypi_packages.reverse_dependencies
+--
+
+-- Answers "which package versions depend on X" with a single index range scan, instead of
+-- scanning requirements joined through distributions and versions. One row per
+-- (dependency, dependent version), regardless of how many of the version's distributions
+-- or requirement lines name the dependency.
+--
+-- Maintained incrementally:
+-- - From the CDC requirements stream, by the requirements subscriber.
+-- - By the distribution processor, for distributions stored as shared requirement sets
+--   (whose links to distributions don't produce CDC events).
+--
+-- Existing data is loaded by the "rebuild_reverse_dependencies" entrypoint.
+
+create table if not exists pypi_packages.reverse_dependencies (
+    dependency_name text not null,
+    dependent_package_name text not null,
+    dependent_version_id uuid not null,
+    primary key (dependency_name, dependent_package_name, dependent_version_id)
+);
+
+create index if not exists reverse_dependencies_dependent_version_id_idx
+    on pypi_packages.reverse_dependencies
+    using btree
+    (dependent_version_id);
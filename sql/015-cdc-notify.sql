@@ -0,0 +1,26 @@
+--
+-- cdc.event_log notifications
+--
+
+-- Notifies listeners on the "cdc_event_log" channel whenever events are written to the
+-- event log, so that the CDC publisher can wake up as soon as a transaction commits,
+-- rather than polling. The trigger fires once per statement rather than once per row,
+-- and postgres delivers identical notifications from the same transaction only once, so
+-- a transaction that writes any number of events sends a single notification.
+--
+-- Notifications are only delivered when the transaction commits, so listeners never
+-- wake up for events they can't see yet.
+
+create or replace function cdc.event_log_notify_tr()
+    returns trigger as $body$
+    begin
+        perform pg_notify('cdc_event_log', '');
+        return null;
+    end;
+$body$ language plpgsql;
+
+create or replace trigger cdc_event_log_notify
+    after insert
+    on cdc.event_log
+    for each statement
+    execute function cdc.event_log_notify_tr();
@@ -0,0 +1,59 @@
+--
+-- Logical decoding CDC source
+--
+
+-- With CDC_SOURCE=logical_decoding, the CDC publisher reads changes from a logical
+-- replication slot (using the built-in "test_decoding" plugin) rather than from
+-- cdc.event_log, so that changes no longer have to be written twice. This requires
+-- "wal_level = logical". The slot is created by the publisher on startup.
+--
+-- UPDATE and DELETE changes only carry the old row in full for tables with
+-- "replica identity full"; otherwise they carry the primary key at most. Consumers rely
+-- on "before" the same way they do with the event log, so it's set on every table that
+-- has a cdc_event_log_insert trigger. Partitions don't inherit their parent's setting.
+
+do $body$
+declare
+    rel regclass;
+begin
+    for rel in
+        select t.tgrelid::regclass
+        from pg_trigger t
+        where t.tgname = 'cdc_event_log_insert'
+        union
+        select i.inhrelid::regclass
+        from pg_trigger t
+        join pg_inherits i on i.inhparent = t.tgrelid
+        where t.tgname = 'cdc_event_log_insert'
+    loop
+        execute format('alter table %s replica identity full;', rel);
+    end loop;
+end;
+$body$;
+
+-- Once the publisher has drained cdc.event_log and switched to logical decoding, the
+-- triggers can be disabled with:
+--
+--   select cdc.set_event_log_triggers_enabled(false);
+--
+-- Set it back to true before switching back to CDC_SOURCE=event_log.
+create or replace function cdc.set_event_log_triggers_enabled(enabled boolean)
+    returns void as
+    $body$
+    declare
+        rel regclass;
+    begin
+        for rel in
+            select t.tgrelid::regclass
+            from pg_trigger t
+            where t.tgname = 'cdc_event_log_insert' and not t.tgisinternal
+        loop
+            execute format(
+                'alter table %s %s trigger cdc_event_log_insert;',
+                rel,
+                case when enabled then 'enable' else 'disable' end
+            );
+        end loop;
+    end;
+    $body$
+language plpgsql;
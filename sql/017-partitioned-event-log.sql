@@ -0,0 +1,172 @@
+--
+-- cdc.event_log partitioning
+--
+
+-- The event log is range-partitioned on event_id, so that events can be pruned by
+-- dropping whole partitions once every consumer in cdc.offsets has read past them, rather
+-- than with mass deletes. Reads past an offset only touch the newest partitions.
+--
+-- Partitions are created ahead of the event_id sequence, and consumed partitions are
+-- dropped, by the "maintain_event_log_partitions" entrypoint, which should be run
+-- periodically. Events that get ahead of the created partitions land in the default
+-- partition, and are moved into the right partition once it's created.
+--
+-- The existing table becomes the first partition, covering every event_id written so
+-- far. Attaching it scans the table once, while holding a lock on it.
+
+alter table cdc.event_log rename to event_log_unpartitioned;
+alter index cdc.event_log_pkey rename to event_log_unpartitioned_pkey;
+drop trigger if exists cdc_event_log_notify on cdc.event_log_unpartitioned;
+
+create table if not exists cdc.event_log (
+    "event_id" bigint not null default nextval('cdc.event_log_event_id_seq'),
+    "operation" text not null,
+    "schema" text not null,
+    "table" text not null,
+    "before" json,
+    "after" json,
+    "timestamp" timestamp not null default now(),
+    primary key ("event_id")
+) partition by range ("event_id");
+
+alter sequence cdc.event_log_event_id_seq owned by cdc.event_log."event_id";
+
+do $body$
+declare
+    upper_bound bigint;
+begin
+    select coalesce(max(el.event_id), 0) + 1
+    into upper_bound
+    from cdc.event_log_unpartitioned el;
+
+    -- Lets the attach skip its own validation scan.
+    execute format(
+        'alter table cdc.event_log_unpartitioned
+        add constraint event_log_unpartitioned_range check ("event_id" < %s);',
+        upper_bound
+    );
+
+    execute format(
+        'alter table cdc.event_log
+        attach partition cdc.event_log_unpartitioned
+        for values from (minvalue) to (%s);',
+        upper_bound
+    );
+end;
+$body$;
+
+create table if not exists cdc.event_log_default
+    partition of cdc.event_log default;
+
+create or replace trigger cdc_event_log_notify
+    after insert
+    on cdc.event_log
+    for each statement
+    execute function cdc.event_log_notify_tr();
+
+--
+-- Partition maintenance
+--
+
+-- The upper bound of a range partition of cdc.event_log, or null for the default partition.
+create or replace function cdc.event_log_partition_upper_bound(partition_oid oid)
+    returns bigint as
+    $body$
+        select substring(
+            pg_get_expr(c.relpartbound, c.oid)
+            from 'TO \(''?(-?[0-9]+)''?\)'
+        )::bigint
+        from pg_class c
+        where c.oid = partition_oid;
+    $body$
+language sql stable;
+
+-- Creates partitions of "partition_size" events each, until there are partitions for at
+-- least the next "num_ahead" * "partition_size" events. Returns the names of the
+-- partitions created.
+create or replace function cdc.create_event_log_partitions(partition_size bigint, num_ahead int)
+    returns setof text as
+    $body$
+    declare
+        lower_bound bigint;
+        last_event_id bigint;
+        partition_name text;
+    begin
+        select max(cdc.event_log_partition_upper_bound(i.inhrelid))
+        into lower_bound
+        from pg_inherits i
+        where i.inhparent = 'cdc.event_log'::regclass;
+
+        last_event_id := coalesce(pg_sequence_last_value('cdc.event_log_event_id_seq'), 0);
+        lower_bound := coalesce(lower_bound, last_event_id + 1);
+
+        while lower_bound <= last_event_id + partition_size * num_ahead loop
+            partition_name := format('event_log_p%s', lpad(lower_bound::text, 19, '0'));
+
+            -- A new range partition can't be created while the default partition has
+            -- rows in its range, so they're moved out of the way first.
+            create temporary table if not exists event_log_moved
+                (like cdc.event_log)
+                on commit drop;
+
+            with moved as (
+                delete from cdc.event_log_default el
+                where el.event_id >= lower_bound and el.event_id < lower_bound + partition_size
+                returning el.*
+            )
+            insert into event_log_moved
+            select * from moved;
+
+            execute format(
+                'create table cdc.%I partition of cdc.event_log for values from (%s) to (%s);',
+                partition_name,
+                lower_bound,
+                lower_bound + partition_size
+            );
+
+            insert into cdc.event_log
+            select * from event_log_moved;
+
+            truncate event_log_moved;
+
+            return next partition_name;
+            lower_bound := lower_bound + partition_size;
+        end loop;
+    end;
+    $body$
+language plpgsql;
+
+-- Drops every partition whose events have all been read by every consumer in
+-- cdc.offsets. Returns the names of the partitions dropped.
+create or replace function cdc.drop_consumed_event_log_partitions()
+    returns setof text as
+    $body$
+    declare
+        min_offset bigint;
+        consumed record;
+    begin
+        select min(o.event_id) into min_offset from cdc.offsets o;
+        if min_offset is null then
+            return;
+        end if;
+
+        for consumed in
+            select i.inhrelid::regclass::text as partition_name
+            from pg_inherits i
+            where
+                i.inhparent = 'cdc.event_log'::regclass
+                and cdc.event_log_partition_upper_bound(i.inhrelid) <= min_offset + 1
+        loop
+            execute format('drop table %s;', consumed.partition_name);
+            return next consumed.partition_name;
+        end loop;
+    end;
+    $body$
+language plpgsql;
+
+-- From here on, partitions are created by the "maintain_event_log_partitions" entrypoint,
+-- sized by the CDC_EVENT_LOG_PARTITION_SIZE setting.
+select cdc.create_event_log_partitions(1000000, 4);
+
+-- Partitions are only accessed through the parent table, which checks its own privileges.
+grant select, insert, update on cdc.event_log to cdc_user;
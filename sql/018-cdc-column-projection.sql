@@ -0,0 +1,109 @@
+--
+-- cdc.event_log column projection
+--
+
+-- Limits the columns of the rows recorded in the event log, per table. Tables without an
+-- entry are recorded in full. Consumers of the CDC events of a table must only rely on
+-- the columns listed here, and the CDC_ROW_KEYS columns of the table must be included.
+--
+-- Updates that don't change any of the projected columns aren't recorded at all.
+
+create table if not exists cdc.event_log_columns (
+    "schema" text not null,
+    "table" text not null,
+    "columns" text[] not null,
+    primary key ("schema", "table")
+);
+
+-- The requirements subscriber and the candidate correlator only read these columns. The
+-- computed columns (specifier_set, distribution_key, dependency_id) are left out, which
+-- also stops their backfills from producing events.
+insert into cdc.event_log_columns ("schema", "table", "columns")
+values
+    (
+        'pypi_packages',
+        'requirements',
+        array[
+            'requirement_id',
+            'distribution_id',
+            'extras',
+            'dependency_name',
+            'dependency_extras',
+            'version_constraint',
+            'dependency_extras_arr',
+            'parsable'
+        ]
+    ),
+    (
+        'pypi_packages',
+        'requirement_set_members',
+        array[
+            'requirement_set_hash',
+            'requirement_id',
+            'extras',
+            'dependency_name',
+            'dependency_extras',
+            'version_constraint',
+            'dependency_extras_arr',
+            'parsable'
+        ]
+    )
+on conflict do nothing;
+
+create or replace function cdc.project_row(row_json json, columns text[])
+    returns json as
+    $body$
+        select case
+            when row_json is null or columns is null then row_json
+            else (
+                select json_object_agg(r.key, r.value)
+                from json_each(row_json) r
+                where r.key = any(columns)
+            )
+        end;
+    $body$
+language sql immutable;
+
+create or replace function cdc.event_log_insert_tr()
+    returns trigger as $body$
+    declare
+        event_table text := coalesce(tg_argv[0], tg_table_name);
+        projected_columns text[];
+        before_row json;
+        after_row json;
+    begin
+        if current_setting('cdc.skip_events', true) is distinct from 'on' then
+            select elc.columns
+            into projected_columns
+            from cdc.event_log_columns elc
+            where elc.schema = tg_table_schema and elc.table = event_table;
+
+            before_row := cdc.project_row(row_to_json(old), projected_columns);
+            after_row := cdc.project_row(row_to_json(new), projected_columns);
+
+            if tg_op <> 'UPDATE' or before_row::jsonb is distinct from after_row::jsonb then
+                insert into cdc.event_log (
+                    "operation",
+                    "schema",
+                    "table",
+                    "before",
+                    "after"
+                ) values (
+                    tg_op::text,
+                    tg_table_schema::text,
+                    event_table::text,
+                    before_row,
+                    after_row
+                );
+            end if;
+        end if;
+
+        if tg_op = 'DELETE' then
+            return old;
+        else
+            return new;
+        end if;
+    end;
+$body$ language plpgsql;
+
+grant select on cdc.event_log_columns to cdc_user;
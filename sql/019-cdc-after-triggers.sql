@@ -0,0 +1,98 @@
+--
+-- CDC triggers fire after the write
+--
+
+-- The cdc_event_log_insert triggers used to fire before each row was written. A BEFORE
+-- INSERT trigger also fires for rows that "on conflict" then turns into an update, or
+-- skips, so every upsert of an existing version logged an INSERT with a freshly generated
+-- version_id that never reached the table. AFTER triggers only fire for what was actually
+-- written: inserted rows log an INSERT, and rows taking the conflict path log an UPDATE,
+-- which is skipped when nothing changed.
+
+drop trigger if exists cdc_event_log_insert on pypi_packages.versions;
+create trigger cdc_event_log_insert
+    after insert or update or delete
+    on pypi_packages.versions
+    for each row
+    execute function cdc.event_log_insert_tr();
+
+-- Recorded under the name "requirements" whether or not the partitioned table has been
+-- swapped in yet.
+drop trigger if exists cdc_event_log_insert on pypi_packages.requirements;
+create trigger cdc_event_log_insert
+    after insert or update or delete
+    on pypi_packages.requirements
+    for each row
+    execute function cdc.event_log_insert_tr('requirements');
+
+drop trigger if exists cdc_event_log_insert on pypi_packages.requirement_set_members;
+create trigger cdc_event_log_insert
+    after insert or update or delete
+    on pypi_packages.requirement_set_members
+    for each row
+    execute function cdc.event_log_insert_tr();
+
+-- Swapping in the partitioned requirements table recreates its trigger, so it has to
+-- create an AFTER trigger too.
+create or replace function pypi_packages.swap_partitioned_requirements()
+    returns void as
+    $body$
+    begin
+        lock table pypi_packages.requirements in access exclusive mode;
+
+        drop trigger mirror_to_partitioned on pypi_packages.requirements;
+        drop trigger cdc_event_log_insert on pypi_packages.requirements;
+
+        -- The legacy per-requirement candidates table references the old table.
+        alter table pypi_packages.candidates
+            drop constraint if exists candidates_requirement_id_fkey;
+
+        alter table pypi_packages.requirements rename to requirements_unpartitioned;
+        alter table pypi_packages.requirements_partitioned rename to requirements;
+
+        create trigger cdc_event_log_insert
+            after insert or update or delete
+            on pypi_packages.requirements
+            for each row
+            execute function cdc.event_log_insert_tr('requirements');
+
+        -- Views are bound to the old table, so they're recreated on top of the new one.
+        create or replace view pypi_packages.requirement_candidates as
+        select
+            req.requirement_id,
+            req.dependency_name,
+            req.version_constraint,
+            cc.candidate_versions,
+            cc.candidate_version_ids
+        from pypi_packages.requirements req
+        join pypi_packages.constraint_candidates cc
+            on cc.dependency_name = req.dependency_name
+            and cc.version_constraint = req.version_constraint;
+
+        create or replace view pypi_packages.distribution_requirements as
+        select
+            req.requirement_id,
+            req.distribution_id,
+            req.extras,
+            req.dependency_name,
+            req.dependency_extras,
+            req.version_constraint,
+            req.dependency_extras_arr,
+            req.parsable
+        from pypi_packages.requirements req
+        union all
+        select
+            rsm.requirement_id,
+            dist.distribution_id,
+            rsm.extras,
+            rsm.dependency_name,
+            rsm.dependency_extras,
+            rsm.version_constraint,
+            rsm.dependency_extras_arr,
+            rsm.parsable
+        from pypi_packages.distributions dist
+        join pypi_packages.requirement_set_members rsm
+            on rsm.requirement_set_hash = dist.requirement_set_hash;
+    end;
+    $body$
+language plpgsql;
@@ -0,0 +1,82 @@
+--
+-- cdc.event_log partition maintenance without blocking the publisher
+--
+
+-- Creating a partition with "create table ... partition of", and dropping one, take an
+-- ACCESS EXCLUSIVE lock on cdc.event_log. Those queue behind the publisher's open cursor
+-- on the event log, and every write to the event log then queues behind them.
+--
+-- Partition maintenance now runs from the "maintain_event_log_partitions" entrypoint one
+-- partition per transaction, with a lock_timeout and retries:
+--
+-- - New partitions are created as standalone tables, then attached, which only takes a
+--   SHARE UPDATE EXCLUSIVE lock on cdc.event_log.
+-- - Consumed partitions are detached concurrently, then dropped once they're no longer
+--   part of cdc.event_log.
+--
+-- A partitioned table with a default partition can't have partitions detached
+-- concurrently, and attaching a partition has to scan the default partition, so the
+-- default partition is dropped. Events past the created partitions are rejected instead,
+-- so CDC_EVENT_LOG_PARTITIONS_AHEAD must cover the events written between runs of the
+-- entrypoint.
+
+-- Moves any events out of the default partition, and leaves room for new events until the
+-- entrypoint next runs.
+select cdc.create_event_log_partitions(1000000, 4);
+
+do $body$
+begin
+    if exists (select 1 from cdc.event_log_default) then
+        raise exception 'cdc.event_log_default still has events';
+    end if;
+end;
+$body$;
+
+drop table if exists cdc.event_log_default;
+
+drop function if exists cdc.create_event_log_partitions(bigint, int);
+drop function if exists cdc.drop_consumed_event_log_partitions();
+
+-- The partitions of "partition_size" events each that are missing for the next
+-- "num_ahead" * "partition_size" events, in order.
+create or replace function cdc.missing_event_log_partitions(partition_size bigint, num_ahead int)
+    returns table (partition_name text, lower_bound bigint, upper_bound bigint) as
+    $body$
+    declare
+        next_lower_bound bigint;
+        last_event_id bigint;
+    begin
+        select max(cdc.event_log_partition_upper_bound(i.inhrelid))
+        into next_lower_bound
+        from pg_inherits i
+        where i.inhparent = 'cdc.event_log'::regclass;
+
+        last_event_id := coalesce(pg_sequence_last_value('cdc.event_log_event_id_seq'), 0);
+        next_lower_bound := coalesce(next_lower_bound, last_event_id + 1);
+
+        while next_lower_bound <= last_event_id + partition_size * num_ahead loop
+            partition_name := format('event_log_p%s', lpad(next_lower_bound::text, 19, '0'));
+            lower_bound := next_lower_bound;
+            upper_bound := next_lower_bound + partition_size;
+            return next;
+            next_lower_bound := upper_bound;
+        end loop;
+    end;
+    $body$
+language plpgsql stable;
+
+-- The partitions whose events have all been read by every consumer in cdc.offsets, and
+-- whether each is already partway through being detached concurrently.
+create or replace function cdc.consumed_event_log_partitions()
+    returns table (partition_name text, detach_pending boolean) as
+    $body$
+        select c.relname::text, i.inhdetachpending
+        from pg_inherits i
+        join pg_class c on c.oid = i.inhrelid
+        where
+            i.inhparent = 'cdc.event_log'::regclass
+            and cdc.event_log_partition_upper_bound(i.inhrelid)
+                <= (select min(o.event_id) from cdc.offsets o) + 1
+        order by cdc.event_log_partition_upper_bound(i.inhrelid);
+    $body$
+language sql stable;
@@ -0,0 +1,26 @@
+--
+-- pypi_packages.reverse_dependencies foreign key
+--
+
+-- Reverse dependencies are removed along with their dependent version. Without the
+-- foreign key, deleting a version left its reverse dependencies behind.
+--
+-- The constraint is added "not valid" and then validated, so that the table is only
+-- briefly locked against writes, rather than for the whole validation scan.
+
+delete from pypi_packages.reverse_dependencies rd
+where not exists (
+    select 1
+    from pypi_packages.versions kv
+    where kv.version_id = rd.dependent_version_id
+);
+
+alter table pypi_packages.reverse_dependencies
+    add constraint reverse_dependencies_dependent_version_id_fkey
+    foreign key (dependent_version_id)
+    references pypi_packages.versions (version_id)
+    on delete cascade
+    not valid;
+
+alter table pypi_packages.reverse_dependencies
+    validate constraint reverse_dependencies_dependent_version_id_fkey;
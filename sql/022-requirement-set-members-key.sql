@@ -0,0 +1,12 @@
+--
+-- pypi_packages.requirement_set_members key
+--
+
+-- Full scans of requirements, such as loading them for candidate correlation, page
+-- through "requirements" and then "requirement_set_members" by requirement_id, so set
+-- members need the same index on it as requirements rows.
+
+create unique index if not exists requirement_set_members_requirement_id_idx
+    on pypi_packages.requirement_set_members
+    using btree
+    (requirement_id);
@@ -0,0 +1,74 @@
+--
+-- cdc.event_log partition headroom in time
+--
+
+-- The event log has no default partition (see 020), so an event past the last created
+-- partition fails the write that logged it. A fixed number of partitions ahead covers
+-- less and less time as the rate of events goes up, and a burst of reprocessing can use
+-- it up between runs of the "maintain_event_log_partitions" entrypoint.
+--
+-- Partitions are now also created far enough ahead to cover "headroom" at the recent
+-- rate of events, estimated from the timestamps of the newest event and of the event
+-- one partition's worth of events before it. Both are looked up by event_id.
+
+drop function if exists cdc.missing_event_log_partitions(bigint, int);
+
+-- The partitions of "partition_size" events each that are missing for the next
+-- "num_ahead" * "partition_size" events, or the events expected within "headroom",
+-- whichever is more, in order.
+create or replace function cdc.missing_event_log_partitions(
+    partition_size bigint,
+    num_ahead int,
+    headroom interval
+)
+    returns table (partition_name text, lower_bound bigint, upper_bound bigint) as
+    $body$
+    declare
+        next_lower_bound bigint;
+        last_event_id bigint;
+        events_ahead bigint;
+        newest_event cdc.event_log%rowtype;
+        older_event cdc.event_log%rowtype;
+        elapsed_seconds double precision;
+    begin
+        select max(cdc.event_log_partition_upper_bound(i.inhrelid))
+        into next_lower_bound
+        from pg_inherits i
+        where i.inhparent = 'cdc.event_log'::regclass;
+
+        last_event_id := coalesce(pg_sequence_last_value('cdc.event_log_event_id_seq'), 0);
+        next_lower_bound := coalesce(next_lower_bound, last_event_id + 1);
+        events_ahead := partition_size * num_ahead;
+
+        select * into newest_event
+        from cdc.event_log el
+        order by el.event_id desc
+        limit 1;
+
+        select * into older_event
+        from cdc.event_log el
+        where el.event_id >= newest_event.event_id - partition_size
+        order by el.event_id
+        limit 1;
+
+        elapsed_seconds := extract(epoch from newest_event.timestamp - older_event.timestamp);
+        if elapsed_seconds > 0 then
+            events_ahead := greatest(
+                events_ahead,
+                ceil(
+                    (newest_event.event_id - older_event.event_id) / elapsed_seconds
+                    * extract(epoch from headroom)
+                )::bigint
+            );
+        end if;
+
+        while next_lower_bound <= last_event_id + events_ahead loop
+            partition_name := format('event_log_p%s', lpad(next_lower_bound::text, 19, '0'));
+            lower_bound := next_lower_bound;
+            upper_bound := next_lower_bound + partition_size;
+            return next;
+            next_lower_bound := upper_bound;
+        end loop;
+    end;
+    $body$
+language plpgsql stable;
@@ -0,0 +1,114 @@
+--
+-- requirement_candidates under either candidates encoding
+--
+
+-- Records written with CANDIDATES_ENCODING=ranges leave candidate_versions and
+-- candidate_version_ids null, and store ordinals into the dependency's version order
+-- instead. The requirement_candidates view now decodes those against version_orders, so
+-- that SQL consumers see candidate arrays under either encoding.
+--
+-- Decoded candidates are ordered by ordinal, newest first. Ordinals follow version order
+-- except for versions discovered after their package was first ordered, such as
+-- backports, which sort by when they were discovered instead.
+
+create or replace function pypi_packages.decode_candidate_ranges(
+    candidate_ranges int4multirange,
+    version_ids uuid[],
+    package_versions text[],
+    out candidate_versions text[],
+    out candidate_version_ids uuid[]
+) as
+    $body$
+        select
+            coalesce(array_agg(package_versions[o + 1] order by o desc), '{}'),
+            coalesce(array_agg(version_ids[o + 1] order by o desc), '{}')
+        from unnest(candidate_ranges) r
+        cross join generate_series(lower(r), upper(r) - 1) o
+        where o < cardinality(version_ids);
+    $body$
+language sql immutable strict;
+
+-- The view is recreated whenever the table under it is swapped, by
+-- swap_partitioned_requirements and by the candidates rebuild, so its definition lives
+-- in one place.
+create or replace function pypi_packages.create_requirement_candidates_view()
+    returns void as
+    $body$
+    begin
+        create or replace view pypi_packages.requirement_candidates as
+        select
+            req.requirement_id,
+            req.dependency_name,
+            req.version_constraint,
+            coalesce(cc.candidate_versions, decoded.candidate_versions) candidate_versions,
+            coalesce(cc.candidate_version_ids, decoded.candidate_version_ids) candidate_version_ids
+        from pypi_packages.requirements req
+        join pypi_packages.constraint_candidates cc
+            on cc.dependency_name = req.dependency_name
+            and cc.version_constraint = req.version_constraint
+        left join pypi_packages.version_orders vo
+            on vo.package_name = cc.dependency_name
+            and cc.candidate_ranges is not null
+        left join lateral pypi_packages.decode_candidate_ranges(
+            cc.candidate_ranges, vo.version_ids, vo.package_versions
+        ) decoded on true;
+    end;
+    $body$
+language plpgsql;
+
+select pypi_packages.create_requirement_candidates_view();
+
+-- Swapping in the partitioned requirements table recreates the view with the definition
+-- above.
+create or replace function pypi_packages.swap_partitioned_requirements()
+    returns void as
+    $body$
+    begin
+        lock table pypi_packages.requirements in access exclusive mode;
+
+        drop trigger mirror_to_partitioned on pypi_packages.requirements;
+        drop trigger cdc_event_log_insert on pypi_packages.requirements;
+
+        -- The legacy per-requirement candidates table references the old table.
+        alter table pypi_packages.candidates
+            drop constraint if exists candidates_requirement_id_fkey;
+
+        alter table pypi_packages.requirements rename to requirements_unpartitioned;
+        alter table pypi_packages.requirements_partitioned rename to requirements;
+
+        create trigger cdc_event_log_insert
+            after insert or update or delete
+            on pypi_packages.requirements
+            for each row
+            execute function cdc.event_log_insert_tr('requirements');
+
+        -- Views are bound to the old table, so they're recreated on top of the new one.
+        perform pypi_packages.create_requirement_candidates_view();
+
+        create or replace view pypi_packages.distribution_requirements as
+        select
+            req.requirement_id,
+            req.distribution_id,
+            req.extras,
+            req.dependency_name,
+            req.dependency_extras,
+            req.version_constraint,
+            req.dependency_extras_arr,
+            req.parsable
+        from pypi_packages.requirements req
+        union all
+        select
+            rsm.requirement_id,
+            dist.distribution_id,
+            rsm.extras,
+            rsm.dependency_name,
+            rsm.dependency_extras,
+            rsm.version_constraint,
+            rsm.dependency_extras_arr,
+            rsm.parsable
+        from pypi_packages.distributions dist
+        join pypi_packages.requirement_set_members rsm
+            on rsm.requirement_set_hash = dist.requirement_set_hash;
+    end;
+    $body$
+language plpgsql;
@@ -0,0 +1,43 @@
+--
+-- pypi_packages.reverse_dependencies on distribution delete
+--
+
+-- The requirements subscriber removes a reverse dependency by looking up the version of
+-- the deleted requirement's distribution. When the distribution itself is deleted, its
+-- requirements' DELETE events arrive after it's gone, so the version can't be found and
+-- the reverse dependency is left behind. Deleting the whole version is covered by the
+-- foreign key added in 021, but deleting a single distribution wasn't.
+--
+-- Instead, deleting a distribution removes the reverse dependencies of its version that
+-- none of the version's other distributions still require, using the version_id of the
+-- deleted row.
+
+create or replace function pypi_packages.reverse_dependencies_distribution_delete_tr()
+    returns trigger as
+    $body$
+    begin
+        delete from pypi_packages.reverse_dependencies rd
+        where
+            rd.dependent_version_id = old.version_id
+            and not exists (
+                select 1
+                from pypi_packages.distributions sibling
+                join pypi_packages.distribution_requirements dr
+                    on dr.distribution_id = sibling.distribution_id
+                where
+                    sibling.version_id = old.version_id
+                    and sibling.distribution_id <> old.distribution_id
+                    and dr.dependency_name = rd.dependency_name
+                    and dr.parsable
+            );
+
+        return old;
+    end;
+    $body$
+language plpgsql;
+
+create or replace trigger reverse_dependencies_distribution_delete
+    after delete
+    on pypi_packages.distributions
+    for each row
+    execute function pypi_packages.reverse_dependencies_distribution_delete_tr();
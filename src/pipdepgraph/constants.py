@@ -1,3 +1,4 @@
+import json
 import os
 import re
 
@@ -19,7 +20,53 @@ if _postgres_password_file:
 elif _postgres_password_envvar:
     POSTGRES_PASSWORD = _postgres_password_envvar
 
+POSTGRES_REPLICA_HOST = os.getenv("POSTGRES_REPLICA_HOST", None)
+POSTGRES_REPLICA_PORT = int(os.getenv("POSTGRES_REPLICA_PORT", str(POSTGRES_PORT)))
+"""
+Optional read replica of the primary database, using the same database name and
+credentials. When set, entrypoints that scan tables in bulk read through the replica.
+See `common.initialize_async_read_pool` for which reads are routed to it.
+"""
+
 POSTGRES_MAX_QUERY_PARAMS = 65535
+POSTGRES_POOL_PROFILE = os.getenv("POSTGRES_POOL_PROFILE", None)
+"""
+Overrides the connection pool profile chosen by the entrypoint. See
+`common.POOL_PROFILES`.
+"""
+POSTGRES_POOL_MIN_SIZE = os.getenv("POSTGRES_POOL_MIN_SIZE", None)
+POSTGRES_POOL_MAX_SIZE = os.getenv("POSTGRES_POOL_MAX_SIZE", None)
+POSTGRES_POOL_WARM_UP = os.getenv("POSTGRES_POOL_WARM_UP", None)
+"""
+Each of these overrides the corresponding setting of the connection pool profile, when
+set.
+"""
+POSTGRES_COPY_THRESHOLD = int(os.getenv("POSTGRES_COPY_THRESHOLD", "1000"))
+"""
+Batches of at least this many records are bulk loaded by the repositories using COPY
+into a temporary table, followed by a single "insert ... select". Set to 0 to always
+use multi-row "insert ... values" statements.
+"""
+
+QUERY_SLOW_LOG_THRESHOLD_MS = float(os.getenv("QUERY_SLOW_LOG_THRESHOLD_MS", "1000"))
+"""
+Repository statements that take at least this many milliseconds are logged as slow
+queries, along with the name of the repository method. Set to 0 to disable.
+"""
+QUERY_SLOW_LOG_MAX_LENGTH = int(os.getenv("QUERY_SLOW_LOG_MAX_LENGTH", "1000"))
+QUERY_METRICS_REPORT_INTERVAL = float(os.getenv("QUERY_METRICS_REPORT_INTERVAL", "60"))
+"""
+Number of seconds between reports of per-query statistics to the metrics sink. Set to
+0 to disable reporting.
+"""
+
+POSTGRES_PIPELINE = bool(
+    os.getenv("POSTGRES_PIPELINE", "true").strip().lower() == "true"
+)
+"""
+Whether the processing services send each unit of work's statements in pipeline mode,
+so that they share round trips instead of each waiting for the previous one.
+"""
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
 RABBITMQ_PORT = os.getenv("RABBITMQ_PORT", "5672")
@@ -47,6 +94,11 @@ RABBITMQ_REQS_CAND_CORR_QNAME = "requirements_candidate_correlation"
 RABBITMQ_REQS_CAND_CORR_RK_PREFIX = "correlate_candidates.requirement."
 RABBITMQ_REQS_CAND_CORR_RK = f"{RABBITMQ_REQS_CAND_CORR_RK_PREFIX}#"
 RABBITMQ_REQS_CAND_CORR_SUB_PREFETCH = int(os.getenv("RABBITMQ_REQS_CAND_CORR_SUB_PREFETCH", 100))
+RABBITMQ_BATCH_WAIT_SECONDS = float(os.getenv("RABBITMQ_BATCH_WAIT_SECONDS", "0.1"))
+"""
+Subscribers which consume messages in batches hand over a partial batch once no further
+messages arrive within this many seconds.
+"""
 
 RABBITMQ_CDC_VERSIONS_QNAME = "cdc.versions"
 RABBITMQ_CDC_VERSIONS_RK_PREFIX = f"cdc.{table_names.VERSIONS}"
@@ -55,7 +107,170 @@ RABBITMQ_CDC_VERSIONS_SUB_PREFETCH = int(os.getenv("RABBITMQ_CDC_VERSIONS_SUB_PR
 RABBITMQ_CDC_REQS_QNAME = "cdc.requirements"
 RABBITMQ_CDC_REQS_RK_PREFIX = f"cdc.{table_names.REQUIREMENTS}"
 RABBITMQ_CDC_REQS_SUB_PREFETCH = int(os.getenv("RABBITMQ_CDC_REQS_SUB_PREFETCH", 100))
+RABBITMQ_CDC_REQ_SET_MEMBERS_RK_PREFIX = f"cdc.{table_names.REQUIREMENT_SET_MEMBERS}"
+
+CDC_NOTIFY_CHANNEL = "cdc_event_log"
+CDC_PUBLISHER_POLL_INTERVAL = float(os.getenv("CDC_PUBLISHER_POLL_INTERVAL", "30"))
+"""
+The CDC publisher wakes up as soon as events are written to the event log, using
+LISTEN/NOTIFY on `CDC_NOTIFY_CHANNEL`. It also drains the event log at least this often
+(in seconds), in case a notification is missed, e.g. while reconnecting.
+"""
+CDC_PUBLISHER_COALESCE_SECONDS = float(os.getenv("CDC_PUBLISHER_COALESCE_SECONDS", "0.05"))
+"""
+After being woken up, the CDC publisher waits this long for further notifications, so
+that a burst of transactions is published in one pass over the event log.
+"""
+CDC_PUBLISH_WINDOW_SIZE = int(os.getenv("CDC_PUBLISH_WINDOW_SIZE", "1000"))
+"""
+The number of CDC events published before waiting for the broker to confirm them. The
+CDC publisher's offset only moves past events once they're confirmed.
+"""
+CDC_MESSAGE_ENCODING = os.getenv("CDC_MESSAGE_ENCODING", "json")
+"""
+How the CDC publisher encodes events: `json`, or `msgpack`, which is smaller and faster
+to decode. Consumers decode messages by their content type, so they have to be upgraded
+before switching to `msgpack`.
+"""
+CDC_COMPACTION_WINDOW_SIZE = int(os.getenv("CDC_COMPACTION_WINDOW_SIZE", "10_000"))
+"""
+The number of consecutive CDC events that are compacted together before publishing. Within
+a window, the events for each row are collapsed into the row's net change, and rows whose
+changes cancel out aren't published at all. 1 disables compaction.
+"""
+CDC_ROW_KEYS: dict[str, list[str]] = {
+    table_names.VERSIONS: ["version_id"],
+    table_names.REQUIREMENTS: [
+        "distribution_id",
+        "extras",
+        "dependency_name",
+        "dependency_extras",
+        "version_constraint",
+    ],
+    table_names.REQUIREMENT_SET_MEMBERS: ["requirement_set_hash", "requirement_id"],
+    **json.loads(os.getenv("CDC_ROW_KEYS", "{}")),
+}
+"""
+The columns that identify a row of each table in CDC events, keyed by the
+schema-qualified table name. Used to compact each row's events. Overridden per table with
+a JSON object, e.g. `{"pypi_packages.requirements": ["distribution_id", "requirement_id"]}`.
+Events for other tables aren't compacted.
+
+Requirements are keyed by their contents rather than by `requirement_id`, since
+reprocessing a distribution deletes its requirements and inserts them again with new
+IDs, and those pairs should cancel out.
+"""
+CDC_GENERATED_COLUMNS: dict[str, list[str]] = {
+    table_names.REQUIREMENTS: ["requirement_id"],
+    **json.loads(os.getenv("CDC_GENERATED_COLUMNS", "{}")),
+}
+"""
+Columns that are generated whenever a row is inserted, keyed by the schema-qualified table
+name. They're ignored when checking whether a row's compacted changes cancel out.
+"""
+CDC_PARTITION_KEYS: dict[str, list[str]] = {
+    table_names.VERSIONS: ["version_id"],
+    table_names.REQUIREMENTS: ["distribution_id"],
+    table_names.REQUIREMENT_SET_MEMBERS: ["requirement_set_hash"],
+    **json.loads(os.getenv("CDC_PARTITION_KEYS", "{}")),
+}
+"""
+The columns that decide which publisher partition each table's events belong to, keyed
+by the schema-qualified table name, and overridden the same way as `CDC_ROW_KEYS`. They
+have to be columns that never change, so that all of a row's events stay in the same
+partition, and in order. They're separate from `CDC_ROW_KEYS`, since a requirement's row
+key includes `extras`, which `update_requirement` can change. Partitioning requirements
+by distribution also keeps the deletes and inserts of a reprocessed distribution
+together, so that they're compacted. Events for other tables are partitioned by event id.
+"""
+CDC_PUBLISHER_TABLES = [
+    table_name.strip()
+    for table_name in os.getenv("CDC_PUBLISHER_TABLES", "").split(",")
+    if table_name.strip()
+]
+"""
+Schema-qualified tables whose events this CDC publisher publishes. Empty for every table.
+"""
+CDC_PUBLISHER_PARTITION_COUNT = int(os.getenv("CDC_PUBLISHER_PARTITION_COUNT", "1"))
+CDC_PUBLISHER_PARTITION_INDEX = int(os.getenv("CDC_PUBLISHER_PARTITION_INDEX", "0"))
+"""
+Splits the events of `CDC_PUBLISHER_TABLES` across `CDC_PUBLISHER_PARTITION_COUNT`
+publishers, by the hash of each event's partition key (see `CDC_PARTITION_KEYS`). This publisher
+publishes the partition numbered `CDC_PUBLISHER_PARTITION_INDEX`, starting from 0.
+
+Each stream of events has its own row in `cdc.offsets`, which starts from the whole event
+log's offset. Once a set of streams has taken over from a single publisher, the offsets
+of streams that are no longer published, including the whole event log's, have to be
+deleted, or they hold back the pruning of the event log.
+
+With `CDC_SOURCE` set to `logical_decoding`, each stream has its own replication slot,
+which only sees changes made after it's created. To take over from the whole log's
+publisher, run the "create_replication_slots" entrypoint with the new
+`CDC_PUBLISHER_TABLES` and `CDC_PUBLISHER_PARTITION_COUNT` while that publisher is still
+running, stop it, start the new publishers, then drop the `CDC_REPLICATION_SLOT` slot,
+which otherwise holds back WAL. Changes published by both are published twice. The
+publishers refuse to start without their slot while the whole log's slot exists.
+"""
+CDC_EVENT_LOG_PARTITION_SIZE = int(os.getenv("CDC_EVENT_LOG_PARTITION_SIZE", "1_000_000"))
+"""
+The number of events per partition of the (range-partitioned) event log. Partitions are
+the unit of pruning, so the event log keeps up to about this many events past the
+slowest consumer's offset.
+"""
+CDC_EVENT_LOG_PARTITIONS_AHEAD = int(os.getenv("CDC_EVENT_LOG_PARTITIONS_AHEAD", "4"))
+"""
+The least number of partitions of the event log to create ahead of the newest event.
+"""
+CDC_EVENT_LOG_HEADROOM = os.getenv("CDC_EVENT_LOG_HEADROOM", "1 day")
+"""
+How long, as a postgres interval, the partitions created ahead of the newest event should
+last at the recent rate of events, if that's more than `CDC_EVENT_LOG_PARTITIONS_AHEAD`
+partitions. The event log has no default partition, so writes to it fail once they're
+used up. Must be longer than the time between runs of the
+"maintain_event_log_partitions" entrypoint, with room for it failing to run.
+"""
+CDC_EVENT_LOG_PARTITION_LOCK_TIMEOUT = os.getenv("CDC_EVENT_LOG_PARTITION_LOCK_TIMEOUT", "2s")
+CDC_EVENT_LOG_PARTITION_LOCK_ATTEMPTS = int(os.getenv("CDC_EVENT_LOG_PARTITION_LOCK_ATTEMPTS", "10"))
+CDC_EVENT_LOG_PARTITION_LOCK_RETRY_DELAY = float(os.getenv("CDC_EVENT_LOG_PARTITION_LOCK_RETRY_DELAY", "5"))
+"""
+Creating, detaching and dropping partitions of the event log gives up on waiting for
+locks after `CDC_EVENT_LOG_PARTITION_LOCK_TIMEOUT` (a postgres interval), so that the
+queued lock doesn't hold up the CDC publisher and every write to the event log. It's
+retried after `CDC_EVENT_LOG_PARTITION_LOCK_RETRY_DELAY` seconds, up to
+`CDC_EVENT_LOG_PARTITION_LOCK_ATTEMPTS` times.
+"""
+CDC_SOURCE = os.getenv("CDC_SOURCE", "event_log")
+"""
+Where the CDC publisher reads changes from:
 
+- `event_log`: The `cdc.event_log` table, written by the "cdc_event_log_insert" triggers.
+- `logical_decoding`: The `CDC_REPLICATION_SLOT` logical replication slot, read with the
+  "test_decoding" plugin. Requires `wal_level = logical`. Once the publisher has caught
+  up on the event log, the triggers can be disabled with
+  `select cdc.set_event_log_triggers_enabled(false);`, so that changes are no longer
+  written twice.
+"""
+CDC_REPLICATION_SLOT = os.getenv("CDC_REPLICATION_SLOT", "pipdepgraph_cdc")
+CDC_LOGICAL_DECODING_TABLES = [
+    table_name.strip()
+    for table_name in os.getenv(
+        "CDC_LOGICAL_DECODING_TABLES",
+        ",".join(
+            [
+                table_names.VERSIONS,
+                table_names.REQUIREMENTS,
+                table_names.REQUIREMENT_SET_MEMBERS,
+            ]
+        ),
+    ).split(",")
+    if table_name.strip()
+]
+"""
+Schema-qualified tables whose changes are published when `CDC_SOURCE` is
+`logical_decoding`. Changes to partitions are published under their parent's name.
+"""
+CDC_LOGICAL_DECODING_POLL_INTERVAL = float(os.getenv("CDC_LOGICAL_DECODING_POLL_INTERVAL", "1"))
+CDC_LOGICAL_DECODING_BATCH_SIZE = int(os.getenv("CDC_LOGICAL_DECODING_BATCH_SIZE", "10_000"))
 RABBITMQ_CTAG_PREFIX = os.getenv("RABBITMQ_CTAG_PREFIX", None)
 
 DIST_PROCESSOR_DISCOVER_PACKAGE_NAMES = bool(
@@ -64,6 +279,26 @@ DIST_PROCESSOR_DISCOVER_PACKAGE_NAMES = bool(
 DIST_PROCESSOR_IGNORE_PROCESSED_FLAG = bool(
     os.getenv("DIST_PROCESSOR_IGNORE_PROCESSED_FLAG", "false").strip().lower() == "true"
 )
+REQUIREMENTS_PARTITION_COUNT = int(os.getenv("REQUIREMENTS_PARTITION_COUNT", "16"))
+"""
+Number of hash partitions of the partitioned requirements table. Must match the number
+of partitions created by "sql/013-partitioned-requirements.sql".
+"""
+JOIN_ON_COMPACT_KEYS = bool(
+    os.getenv("JOIN_ON_COMPACT_KEYS", "false").strip().lower() == "true"
+)
+"""
+Whether queries join versions, distributions and requirements on the bigint keys added by
+"sql/011-compact-keys.sql" instead of their uuid keys. Only turn this on once the
+"migrate_compact_keys" entrypoint has backfilled every record, since records without
+compact keys are left out of the joins.
+"""
+REQUIREMENTS_STORAGE = os.getenv("REQUIREMENTS_STORAGE", "rows").strip().lower()
+"""
+How the distribution processor stores requirements. "rows" stores one requirements row
+per requirement per distribution. "sets" stores each distinct set of requirements once,
+in "requirement_sets", and links distributions to their set by its content hash.
+"""
 
 UPL_LOAD_PACKAGE_NAMES = bool(
     os.getenv("UPL_LOAD_PACKAGE_NAMES", "false").strip().lower() == "true"
@@ -84,12 +319,61 @@ UPL_LOAD_REQUIREMENTS_FOR_CANDIDATE_CORRELATION = bool(
     os.getenv("UPL_LOAD_REQUIREMENTS_FOR_CANDIDATE_CORRELATION", "false").strip().lower() == "true"
 )
 
+CANDIDATE_CORRELATION_PROCESS_POOL_SIZE = int(os.getenv("CANDIDATE_CORRELATION_PROCESS_POOL_SIZE", "0"))
+"""
+Number of worker processes used for specifier matching by the candidate correlation
+service. Set to 0 to match specifiers inline on the event loop.
+"""
+CANDIDATE_CORRELATION_MATCH_BATCH_SIZE = int(os.getenv("CANDIDATE_CORRELATION_MATCH_BATCH_SIZE", "500"))
+CANDIDATE_CORRELATION_CONCURRENCY = int(os.getenv("CANDIDATE_CORRELATION_CONCURRENCY", "8"))
+"""
+Number of dependencies of a batch of requirements that the candidate correlator processes
+at once, each holding a connection while it does. Sizes the "correlator" connection pool.
+"""
+CANDIDATES_ENCODING = os.getenv("CANDIDATES_ENCODING", "arrays").strip().lower()
+"""
+How the candidate correlation service stores candidates. "arrays" stores the candidate
+version strings and IDs. "ranges" stores ranges of ordinals into each package's version
+order, which is far smaller for lax constraints.
+"""
+CANDIDATE_REBUILD_PROCESS_POOL_SIZE = int(os.getenv("CANDIDATE_REBUILD_PROCESS_POOL_SIZE", str(os.cpu_count() or 1)))
+CANDIDATE_REBUILD_MAX_PENDING_PACKAGES = int(os.getenv("CANDIDATE_REBUILD_MAX_PENDING_PACKAGES", "64"))
+
 NAMES_REPO_ITER_BATCH_SIZE = int(os.getenv("NAMES_REPO_ITER_BATCH_SIZE", "50_000"))
 VERSIONS_REPO_ITER_BATCH_SIZE = int(os.getenv("VERSIONS_REPO_ITER_BATCH_SIZE", "50_000"))
 DISTRIBUTIONS_REPO_ITER_BATCH_SIZE = int(os.getenv("DISTRIBUTIONS_REPO_ITER_BATCH_SIZE", "50_000"))
 REQUIREMENTS_REPO_ITER_BATCH_SIZE = int(os.getenv("REQUIREMENTS_REPO_ITER_BATCH_SIZE", "50_000"))
 CDC_EVENT_LOG_REPO_ITER_BATCH_SIZE = int(os.getenv("CDC_EVENT_LOG_REPO_ITER_BATCH_SIZE", "10_000"))
 
+WRITE_BATCH_TARGET_SECONDS = float(os.getenv("WRITE_BATCH_TARGET_SECONDS", "0.5"))
+"""
+Repository inserts are split into batches, sized adaptively so that each batch's
+statement takes about this long. See `adaptive_batching.AdaptiveBatchSize`.
+"""
+WRITE_BATCH_INITIAL_SIZE = int(os.getenv("WRITE_BATCH_INITIAL_SIZE", "5_000"))
+WRITE_BATCH_MIN_SIZE = int(os.getenv("WRITE_BATCH_MIN_SIZE", "100"))
+WRITE_BATCH_MAX_SIZE = int(os.getenv("WRITE_BATCH_MAX_SIZE", "50_000"))
+FETCH_BATCH_TARGET_SECONDS = float(os.getenv("FETCH_BATCH_TARGET_SECONDS", "1.0"))
+"""
+Repository iterators fetch batches sized adaptively so that each fetch takes about this
+long, starting from, and never exceeding, the `*_REPO_ITER_BATCH_SIZE` settings.
+"""
+FETCH_BATCH_MIN_SIZE = int(os.getenv("FETCH_BATCH_MIN_SIZE", "1_000"))
+
+SCAN_NUM_SHARDS = int(os.getenv("SCAN_NUM_SHARDS", "16"))
+"""
+Number of disjoint primary key ranges that sharded table scans are split into.
+"""
+SCAN_CONCURRENCY = int(os.getenv("SCAN_CONCURRENCY", "4"))
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "10_000"))
+SCAN_PROCESS_INDEX = int(os.getenv("SCAN_PROCESS_INDEX", "0"))
+SCAN_PROCESS_COUNT = int(os.getenv("SCAN_PROCESS_COUNT", "1"))
+"""
+Sharded scans can be spread over several processes by running `SCAN_PROCESS_COUNT`
+processes, each with a distinct `SCAN_PROCESS_INDEX`. Each process scans every
+`SCAN_PROCESS_COUNT`-th key range, starting from its own index.
+"""
+
 PACKAGE_RELEASE_TERM_MAX_SIZE = 9_223_372_036_854_775_807  # Postgres bigint max size
 """
 This is based on Postgres's max value for bigint. There are a few package version
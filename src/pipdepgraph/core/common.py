@@ -1,10 +1,106 @@
+import contextlib
+import dataclasses
 import logging
 import sys
 
 import aiohttp
+from psycopg import AsyncConnection, AsyncPipeline
 from psycopg_pool import AsyncConnectionPool
 
 from pipdepgraph import constants
+from pipdepgraph.repositories import instrumentation
+
+logger = logging.getLogger("pipdepgraph.core.common")
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class PoolProfile:
+    """
+    Connection pool settings for a kind of workload.
+
+    - `min_size`: Connections kept open while idle.
+    - `max_size`: Connections opened at most. Requests beyond this wait for a
+      connection to be returned, which shows up as "requests_queued" in pool metrics.
+    - `warm_up`: Wait for `min_size` connections to be opened before the pool is used,
+      rather than opening them in the background.
+    """
+
+    min_size: int
+    max_size: int
+    warm_up: bool = False
+
+
+POOL_PROFILES: dict[str, PoolProfile] = {
+    "default": PoolProfile(min_size=1, max_size=10),
+    # Processors that fetch from PyPI and write what they find. Connections are only
+    # held between requests, but messages arrive steadily, so a few are kept warm.
+    "crawler": PoolProfile(min_size=2, max_size=10, warm_up=True),
+    # Subscribers that handle one message at a time, with at most a transaction and an
+    # iterator open at once.
+    "subscriber": PoolProfile(min_size=1, max_size=4),
+    # The candidate correlator, which handles a batch of messages at a time, with a
+    # transaction open for each dependency it's processing.
+    "correlator": PoolProfile(
+        min_size=1,
+        max_size=constants.CANDIDATE_CORRELATION_CONCURRENCY,
+    ),
+    # The CDC publisher holds a connection listening for event log notifications, and a
+    # server-side cursor on the event log while updating its offset on a separate
+    # connection.
+    "publisher": PoolProfile(min_size=2, max_size=5),
+    # Sharded scans and backfills, which hold one connection per concurrent key range.
+    "scan": PoolProfile(
+        min_size=constants.SCAN_CONCURRENCY,
+        max_size=constants.SCAN_CONCURRENCY,
+        warm_up=True,
+    ),
+}
+
+
+def resolve_pool_profile(profile: str) -> PoolProfile:
+    """
+    Returns the pool profile named `profile`, or by `POSTGRES_POOL_PROFILE` if that's
+    set, with any of the `POSTGRES_POOL_*` overrides applied.
+    """
+
+    profile = constants.POSTGRES_POOL_PROFILE or profile
+    if profile not in POOL_PROFILES:
+        raise ValueError(f"Unknown connection pool profile: {profile}")
+
+    pool_profile = POOL_PROFILES[profile]
+    if constants.POSTGRES_POOL_MIN_SIZE:
+        pool_profile = dataclasses.replace(
+            pool_profile, min_size=int(constants.POSTGRES_POOL_MIN_SIZE)
+        )
+    if constants.POSTGRES_POOL_MAX_SIZE:
+        pool_profile = dataclasses.replace(
+            pool_profile, max_size=int(constants.POSTGRES_POOL_MAX_SIZE)
+        )
+    if constants.POSTGRES_POOL_WARM_UP:
+        pool_profile = dataclasses.replace(
+            pool_profile,
+            warm_up=constants.POSTGRES_POOL_WARM_UP.strip().lower() == "true",
+        )
+
+    return pool_profile
+
+
+class ProfiledConnectionPool(AsyncConnectionPool):
+    """
+    A connection pool that reports its stats along with the query metrics, and that
+    optionally waits for its minimum number of connections when it's opened.
+    """
+
+    def __init__(self, *args, warm_up: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.warm_up = warm_up
+
+    async def open(self, wait: bool = False, timeout: float = 30.0) -> None:
+        await super().open(wait=wait or self.warm_up, timeout=timeout)
+        instrumentation.register_pool(self)
+
+        if self.warm_up:
+            logger.info("Warmed up %s connections in pool %s", self.min_size, self.name)
 
 
 def initialize_logger() -> None:
@@ -20,14 +116,42 @@ def initialize_logger() -> None:
     root.addHandler(handler)
 
 
+async def _configure_read_only_connection(conn: AsyncConnection):
+    await instrumentation.configure_connection(conn)
+    await conn.set_read_only(True)
+
+
 def initialize_async_connection_pool(
     host=constants.POSTGRES_HOST,
     port=constants.POSTGRES_PORT,
     db=constants.POSTGRES_DB,
     username=constants.POSTGRES_USERNAME,
     password=constants.POSTGRES_PASSWORD,
-    max_pool_size=10,
+    profile: str = "default",
+    max_pool_size: int | None = None,
+    read_only: bool = False,
 ) -> AsyncConnectionPool:
+    """
+    Creates a connection pool sized by the pool profile named `profile`. See
+    `POOL_PROFILES`. `max_pool_size` overrides the profile's max size, and the min size
+    if that's larger. If `read_only` is set, every connection is made read-only.
+
+    The pool must be opened with `async with`.
+    """
+
+    pool_profile = resolve_pool_profile(profile)
+    if max_pool_size is not None:
+        pool_profile = dataclasses.replace(
+            pool_profile,
+            min_size=min(pool_profile.min_size, max_pool_size),
+            max_size=max_pool_size,
+        )
+
+    pool_name = constants.POSTGRES_POOL_PROFILE or profile
+    configure = instrumentation.configure_connection
+    if read_only:
+        pool_name += "-read-only"
+        configure = _configure_read_only_connection
 
     connection_string = f"""
     dbname={db}
@@ -37,12 +161,69 @@ def initialize_async_connection_pool(
     port={port}
     """
 
-    return AsyncConnectionPool(
+    return ProfiledConnectionPool(
         conninfo=connection_string,
-        min_size=1,
-        max_size=max_pool_size,
+        min_size=pool_profile.min_size,
+        max_size=pool_profile.max_size,
+        warm_up=pool_profile.warm_up,
+        open=False,
+        name=pool_name,
+        configure=configure,
+    )
+
+
+def initialize_async_read_pool(
+    profile: str = "default",
+    max_pool_size: int | None = None,
+) -> contextlib.AbstractAsyncContextManager[AsyncConnectionPool | None]:
+    """
+    Creates a read-only connection pool to the read replica at `POSTGRES_REPLICA_HOST`,
+    sized the same as `initialize_async_connection_pool`. If no replica is configured,
+    yields None instead, in which case repositories read from their primary pool.
+
+    Read-your-writes policy:
+
+    - Repository methods that are passed a cursor always read through it, from the
+      primary, within the caller's transaction.
+    - Iterators (`iter_*`) called without a cursor read from the replica, and may lag
+      behind the primary by the replication delay. They're meant for bulk scans.
+    - Lookups (`get_*`) and writes always use the primary, so that services can act on
+      what they've just written.
+    - Bulk jobs whose results replace what's on the primary, like "rebuild_candidates",
+      read from the primary too.
+    """
+
+    if not constants.POSTGRES_REPLICA_HOST:
+        return contextlib.nullcontext(None)
+
+    return initialize_async_connection_pool(
+        host=constants.POSTGRES_REPLICA_HOST,
+        port=constants.POSTGRES_REPLICA_PORT,
+        profile=profile,
+        max_pool_size=max_pool_size,
+        read_only=True,
     )
 
 
+def pipeline(
+    conn: AsyncConnection,
+) -> contextlib.AbstractAsyncContextManager[AsyncPipeline | None]:
+    """
+    Puts `conn` into pipeline mode for the duration of the block, if `POSTGRES_PIPELINE`
+    is enabled and supported by the installed libpq.
+
+    In pipeline mode, statements are sent without waiting for the previous statement's
+    results. Only fetching results, `conn.commit()` and leaving the block wait for the
+    server. If a statement fails, the statements queued after it are skipped by the
+    server, and the error is raised on the next wait, so the block should be wrapped in
+    a try that rolls back the transaction after leaving the block.
+    """
+
+    if not constants.POSTGRES_PIPELINE or not AsyncPipeline.is_supported():
+        return contextlib.nullcontext(None)
+
+    return conn.pipeline()
+
+
 def initialize_client_session() -> aiohttp.ClientSession:
     return aiohttp.ClientSession(headers={"User-Agent": "schaffer.austin.t@gmail.com"})
@@ -0,0 +1,103 @@
+from typing import Iterable
+
+from pipdepgraph import models
+
+
+def compact_events(
+    events: Iterable[models.EventLogEntry],
+    keys: dict[str, list[str]],
+    generated_columns: dict[str, list[str]] | None = None,
+) -> list[models.EventLogEntry]:
+    """
+    Collapses the events for each row into a single event for the row's net change, and
+    drops the events of rows whose changes cancel out, such as an insert followed by a
+    delete, or updates that end where they started.
+
+    Rows are identified by the columns in `keys` for the event's schema-qualified table.
+    Events for tables without keys, or without a row to take the key from, are kept as
+    they are. Each net event takes the place, `event_id` and timestamp of the row's last
+    event, so that events are still in order of their last change.
+
+    Columns in `generated_columns` for the event's table, such as IDs generated on
+    insert, are ignored when checking whether a row's changes cancel out.
+    """
+
+    generated_columns = generated_columns or {}
+
+    compacted: dict[object, tuple[models.EventLogEntry, models.EventLogEntry]] = {}
+
+    for event in events:
+        key = row_key(event, keys)
+        if key is None:
+            compacted[object()] = (event, event)
+            continue
+
+        first, _ = compacted.pop(key, (event, event))
+        compacted[key] = (first, event)
+
+    net_events = []
+    for first, last in compacted.values():
+        net_event = (
+            first
+            if first is last
+            else _net_event(
+                first,
+                last,
+                generated_columns.get(f"{last.schema}.{last.table}", []),
+            )
+        )
+        if net_event is not None:
+            net_events.append(net_event)
+
+    return net_events
+
+
+def row_key(event: models.EventLogEntry, keys: dict[str, list[str]]) -> tuple | None:
+    """
+    Returns what identifies the row changed by `event`, using the columns in `keys` for
+    the event's schema-qualified table, or None if it can't be identified.
+    """
+
+    key_columns = keys.get(f"{event.schema}.{event.table}")
+    row = event.after if event.after is not None else event.before
+    if not key_columns or row is None or any(column not in row for column in key_columns):
+        return None
+
+    return (event.schema, event.table, *(row[column] for column in key_columns))
+
+
+def _net_event(
+    first: models.EventLogEntry,
+    last: models.EventLogEntry,
+    generated_columns: list[str],
+) -> models.EventLogEntry | None:
+    existed_before = first.operation != "INSERT"
+    exists_after = last.operation != "DELETE"
+
+    if not existed_before and not exists_after:
+        return None
+
+    if not existed_before:
+        operation, before, after = "INSERT", None, last.after
+    elif not exists_after:
+        operation, before, after = "DELETE", first.before, None
+    else:
+        operation, before, after = "UPDATE", first.before, last.after
+        if before is not None and _without(before, generated_columns) == _without(
+            after, generated_columns
+        ):
+            return None
+
+    return models.EventLogEntry(
+        event_id=last.event_id,
+        operation=operation,
+        schema=last.schema,
+        table=last.table,
+        before=before,
+        after=after,
+        timestamp=last.timestamp,
+    )
+
+
+def _without(row: dict, columns: list[str]) -> dict:
+    return {name: value for name, value in row.items() if name not in columns}
@@ -0,0 +1,265 @@
+"""
+Parsing of the output of postgres' "test_decoding" logical decoding plugin, as returned
+by `pg_logical_slot_peek_changes`, into the same shape as the rows of `cdc.event_log`.
+
+Each change is a single line, e.g.:
+
+    table pypi_packages.requirements: INSERT: requirement_id[uuid]:'...' parsable[boolean]:true
+    table pypi_packages.versions: UPDATE: old-key: version_id[uuid]:'...' new-tuple: version_id[uuid]:'...'
+    table pypi_packages.requirements: DELETE: requirement_id[uuid]:'...'
+
+Old rows are only included in full for tables with "replica identity full".
+"""
+
+import datetime
+import json
+import re
+
+SKIP_EVENTS_MESSAGE_PREFIX = "cdc.skip_events"
+"""
+Prefix of the transactional logical decoding message that marks a transaction's changes
+as not to be published, the same as setting `cdc.skip_events` for the event log trigger.
+"""
+
+_CHANGE_PATTERN = re.compile(
+    r"^table (?P<relation>.+?): (?P<operation>INSERT|UPDATE|DELETE|TRUNCATE):(?: (?P<columns>.*))?$",
+    re.DOTALL,
+)
+_COMMIT_TIMESTAMP_PATTERN = re.compile(r"\(at (?P<timestamp>[^)]+)\)")
+
+_INTEGER_TYPES = {"smallint", "integer", "bigint", "oid"}
+_FLOAT_TYPES = {"real", "double precision", "numeric"}
+_JSON_TYPES = {"json", "jsonb"}
+
+_UNCHANGED_TOAST = "unchanged-toast-datum"
+_MISSING = object()
+
+
+def parse_lsn(lsn: str) -> int:
+    """
+    Converts a textual LSN, e.g. "16/B374D848", to the 64-bit position it represents.
+    LSNs are increasing, so they can stand in for event ids.
+    """
+
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def is_begin(data: str) -> bool:
+    return data.startswith("BEGIN")
+
+
+def is_commit(data: str) -> bool:
+    return data.startswith("COMMIT")
+
+
+def is_skip_events_message(data: str) -> bool:
+    return data.startswith("message: transactional: 1 ") and (
+        f"prefix: {SKIP_EVENTS_MESSAGE_PREFIX}," in data
+    )
+
+
+def parse_commit_timestamp(data: str) -> datetime.datetime | None:
+    """
+    Parses the commit timestamp of a "COMMIT" line, which is only included when the slot
+    is read with "include-timestamp" on.
+    """
+
+    match = _COMMIT_TIMESTAMP_PATTERN.search(data)
+    if not match:
+        return None
+
+    try:
+        return datetime.datetime.fromisoformat(match["timestamp"])
+    except ValueError:
+        return None
+
+
+def parse_change(data: str) -> tuple[str, str, str, dict | None, dict | None] | None:
+    """
+    Parses a single change into `(operation, schema, table, before, after)`. Returns None
+    for lines that aren't row changes, and for truncates, which the event log trigger
+    doesn't record either.
+    """
+
+    match = _CHANGE_PATTERN.match(data)
+    if not match or match["operation"] == "TRUNCATE":
+        return None
+
+    schema, _, table = match["relation"].partition(".")
+    schema, table = _unquote_identifier(schema), _unquote_identifier(table)
+    operation = match["operation"]
+    columns = match["columns"] or ""
+
+    before = after = None
+
+    if operation == "INSERT":
+        after = _parse_columns(columns)
+
+    elif operation == "UPDATE":
+        if columns.startswith("old-key: "):
+            old, _, new = columns[len("old-key: "):].partition(" new-tuple: ")
+            before = _parse_columns(old)
+            after = _parse_columns(new)
+        else:
+            after = _parse_columns(columns)
+
+        # Unchanged TOASTed values aren't sent, but they're in the old row if it's
+        # sent in full.
+        for name, value in list(after.items()):
+            if value is _MISSING:
+                if before is not None and name in before:
+                    after[name] = before[name]
+                else:
+                    del after[name]
+
+    elif operation == "DELETE":
+        if not columns.startswith("(no-tuple data)"):
+            before = _parse_columns(columns)
+
+    for row in (before, after):
+        if row is not None:
+            for name in [name for name, value in row.items() if value is _MISSING]:
+                del row[name]
+
+    return operation, schema, table, before, after
+
+
+def _unquote_identifier(identifier: str) -> str:
+    if len(identifier) >= 2 and identifier[0] == '"' and identifier[-1] == '"':
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def _parse_columns(text: str) -> dict:
+    """
+    Parses a list of `name[type]:value` columns, separated by spaces.
+    """
+
+    row = {}
+    i = 0
+    while i < len(text):
+        if text[i] == '"':
+            end = i + 1
+            while True:
+                end = text.index('"', end)
+                if text.startswith('""', end):
+                    end += 2
+                else:
+                    break
+            name = text[i : end + 1]
+            i = end + 1
+        else:
+            end = text.index("[", i)
+            name = text[i:end]
+            i = end
+
+        type_end = text.index("]:", i)
+        type_name = text[i + 1 : type_end]
+        i = type_end + 2
+
+        if i < len(text) and text[i] == "'":
+            value = []
+            i += 1
+            while True:
+                end = text.index("'", i)
+                value.append(text[i:end])
+                if text.startswith("''", end):
+                    value.append("'")
+                    i = end + 2
+                else:
+                    i = end + 1
+                    break
+            raw, quoted = "".join(value), True
+        else:
+            end = text.find(" ", i)
+            end = len(text) if end == -1 else end
+            raw, quoted = text[i:end], False
+            i = end
+
+        row[_unquote_identifier(name)] = _convert_value(type_name, raw, quoted)
+
+        while i < len(text) and text[i] == " ":
+            i += 1
+
+    return row
+
+
+def _convert_value(type_name: str, raw: str, quoted: bool):
+    """
+    Converts a column value to what `row_to_json` would have produced for it. Types
+    without a JSON equivalent, including composites, are kept as their text
+    representation.
+    """
+
+    if not quoted:
+        if raw == "null":
+            return None
+        if raw == _UNCHANGED_TOAST:
+            return _MISSING
+
+    if type_name.endswith("[]"):
+        elements = _parse_array(raw)
+        if elements is None:
+            return raw
+        element_type = type_name[:-2]
+        return [
+            None if element is None else _convert_scalar(element_type, element)
+            for element in elements
+        ]
+
+    return _convert_scalar(type_name, raw)
+
+
+def _convert_scalar(type_name: str, raw: str):
+    if type_name == "boolean":
+        return raw in ("true", "t")
+    if type_name in _INTEGER_TYPES:
+        return int(raw)
+    if type_name in _FLOAT_TYPES:
+        return float(raw)
+    if type_name in _JSON_TYPES:
+        return json.loads(raw)
+    if type_name.startswith("timestamp"):
+        return raw.replace(" ", "T", 1)
+    return raw
+
+
+def _parse_array(text: str) -> list[str | None] | None:
+    """
+    Parses a one-dimensional array literal, e.g. `{a,"b c",NULL}`. Returns None for
+    anything else, such as multi-dimensional arrays.
+    """
+
+    if not (text.startswith("{") and text.endswith("}")):
+        return None
+
+    body = text[1:-1]
+    if not body:
+        return []
+
+    elements = []
+    i = 0
+    while True:
+        if body.startswith('"', i):
+            value = []
+            i += 1
+            while body[i] != '"':
+                if body[i] == "\\":
+                    i += 1
+                value.append(body[i])
+                i += 1
+            elements.append("".join(value))
+            i += 1
+        else:
+            end = body.find(",", i)
+            end = len(body) if end == -1 else end
+            element = body[i:end]
+            if "{" in element:
+                return None
+            elements.append(None if element == "NULL" else element)
+            i = end
+
+        if i >= len(body):
+            return elements
+        i += 1
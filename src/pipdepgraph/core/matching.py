@@ -0,0 +1,95 @@
+import array
+from typing import Iterable
+
+import packaging.specifiers
+import packaging.version
+
+
+def match_version_constraints(
+    package_versions: list[str],
+    version_constraints: list[str],
+) -> list[array.array | None]:
+    """
+    Matches each of the `version_constraints` against the same list of
+    `package_versions`, returning one result per constraint.
+
+    Each result is a compact array of indexes into `package_versions`, ordered
+    newest version first, following the same semantics as `SpecifierSet.filter`.
+    A result is `None` if its constraint can't be parsed.
+
+    This is pure CPU work with picklable inputs and outputs, so that it can be
+    submitted to a `ProcessPoolExecutor`. Each version string is only parsed once
+    per call, so callers should batch many constraints against a single package's
+    version list.
+    """
+
+    parsed_version_to_index: dict[packaging.version.Version, int] = {}
+    for index, package_version in enumerate(package_versions):
+        try:
+            parsed_version_to_index[packaging.version.Version(package_version)] = index
+        except Exception:
+            pass
+
+    results: list[array.array | None] = []
+    for version_constraint in version_constraints:
+        try:
+            specifier_set = packaging.specifiers.SpecifierSet(version_constraint)
+            sorted_parsed_candidate_versions = sorted(
+                specifier_set.filter(parsed_version_to_index.keys()),
+                reverse=True,
+            )
+        except Exception:
+            results.append(None)
+            continue
+
+        results.append(array.array(
+            "I",
+            (parsed_version_to_index[v] for v in sorted_parsed_candidate_versions),
+        ))
+
+    return results
+
+
+def indexes_to_ranges(indexes: Iterable[int]) -> list[tuple[int, int]]:
+    """
+    Compresses a collection of indexes into a sorted list of disjoint, half-open
+    `(lower, upper)` ranges. Lax constraints like `>=2` match long runs of
+    consecutive ordinals, and compress down to a single range.
+    """
+
+    ranges: list[tuple[int, int]] = []
+    for index in sorted(set(indexes)):
+        if ranges and ranges[-1][1] == index:
+            ranges[-1] = (ranges[-1][0], index + 1)
+        else:
+            ranges.append((index, index + 1))
+    return ranges
+
+
+def ranges_to_indexes(ranges: Iterable[tuple[int, int]]) -> list[int]:
+    """
+    Expands the half-open `(lower, upper)` ranges produced by `indexes_to_ranges`
+    back into a sorted list of indexes.
+    """
+
+    return [
+        index
+        for lower, upper in ranges
+        for index in range(lower, upper)
+    ]
+
+
+def sort_package_versions(package_versions: list[str]) -> list[int]:
+    """
+    Returns the indexes of `package_versions`, ordered from oldest to newest version.
+    Version strings that can't be parsed are ordered first.
+    """
+
+    sort_keys: list[tuple[bool, packaging.version.Version]] = []
+    for package_version in package_versions:
+        try:
+            sort_keys.append((True, packaging.version.Version(package_version)))
+        except Exception:
+            sort_keys.append((False, packaging.version.Version("0")))
+
+    return sorted(range(len(package_versions)), key=sort_keys.__getitem__)
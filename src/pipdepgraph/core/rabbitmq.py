@@ -1,3 +1,4 @@
+import asyncio
 import queue
 import json
 import logging
@@ -5,7 +6,10 @@ import uuid
 from typing import Callable, Any
 import threading
 
+import msgpack
 import pika
+import pika.exceptions
+import pika.frame
 import pika.spec
 import pika.channel
 import pika.adapters.asyncio_connection
@@ -16,8 +20,36 @@ from pipdepgraph import constants
 
 logger = logging.getLogger(__name__)
 
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
 
-def initialize_rabbitmq_connection() -> pika.BlockingConnection:
+
+def encode_message_body(payload: Any, encoding: str) -> tuple[bytes | str, str]:
+    """
+    Encodes a message payload as `encoding`, either "json" or "msgpack". Returns the
+    body, and the content type to publish it with.
+    """
+
+    if encoding == "msgpack":
+        return msgpack.packb(payload), CONTENT_TYPE_MSGPACK
+    elif encoding == "json":
+        return json.dumps(payload), CONTENT_TYPE_JSON
+    else:
+        raise ValueError(f"Unknown message encoding: {encoding}")
+
+
+def decode_message_body(body: bytes, content_type: str | None) -> Any:
+    """
+    Decodes a message body according to its content type. Messages without a content
+    type are JSON.
+    """
+
+    if content_type == CONTENT_TYPE_MSGPACK:
+        return msgpack.unpackb(body)
+    return json.loads(body)
+
+
+def _connection_parameters() -> pika.ConnectionParameters:
     params = {
         k: v
         for k, v in dict(
@@ -32,10 +64,162 @@ def initialize_rabbitmq_connection() -> pika.BlockingConnection:
         if v is not None
     }
 
-    rabbitmq_connection = pika.BlockingConnection(pika.ConnectionParameters(**params))
+    return pika.ConnectionParameters(**params)
+
+
+def initialize_rabbitmq_connection() -> pika.BlockingConnection:
+    rabbitmq_connection = pika.BlockingConnection(_connection_parameters())
     return rabbitmq_connection
 
 
+class ConfirmedPublisher:
+    """
+    Publishes messages on a channel in confirm mode, over a connection driven by the
+    running asyncio event loop.
+
+    Messages are published without waiting, and `wait_for_confirms` waits until the
+    broker has confirmed every message published so far, so that a whole window of
+    messages is in flight at once rather than one at a time. Used as an async context
+    manager, or with `open` and `close`, which open and close the connection.
+    """
+
+    def __init__(self):
+        self._connection: pika.adapters.asyncio_connection.AsyncioConnection | None = None
+        self._channel: pika.channel.Channel | None = None
+        self._num_published = 0
+        self._unconfirmed: set[int] = set()
+        self._num_nacked = 0
+        self._closed_reason: Exception | None = None
+        self._confirmed: asyncio.Future | None = None
+
+    async def __aenter__(self) -> "ConfirmedPublisher":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def is_closed(self) -> bool:
+        """
+        Whether the connection or channel is closed, or was never opened. A closed
+        publisher can't be reopened.
+        """
+
+        return (
+            self._connection is None
+            or self._connection.is_closed
+            or self._closed_reason is not None
+        )
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+
+        connection_opened = loop.create_future()
+        self._connection = pika.adapters.asyncio_connection.AsyncioConnection(
+            _connection_parameters(),
+            on_open_callback=lambda connection: connection_opened.set_result(None),
+            on_open_error_callback=lambda connection, error: connection_opened.set_exception(
+                error
+                if isinstance(error, Exception)
+                else pika.exceptions.AMQPConnectionError(error)
+            ),
+            on_close_callback=lambda connection, reason: self._on_closed(reason),
+            custom_ioloop=loop,
+        )
+        await connection_opened
+
+        channel_opened = loop.create_future()
+        self._connection.channel(on_open_callback=channel_opened.set_result)
+        self._channel = await channel_opened
+        self._channel.add_on_close_callback(lambda channel, reason: self._on_closed(reason))
+
+        confirm_selected = loop.create_future()
+        self._channel.confirm_delivery(
+            self._on_delivery_confirmation,
+            callback=lambda frame: confirm_selected.set_result(None),
+        )
+        await confirm_selected
+
+    async def close(self):
+        if self._connection is None or self._connection.is_closed:
+            return
+
+        closed = asyncio.get_running_loop().create_future()
+        self._connection.add_on_close_callback(
+            lambda connection, reason: closed.done() or closed.set_result(None)
+        )
+        if not self._connection.is_closing:
+            self._connection.close()
+        await closed
+
+    def publish(
+        self,
+        *,
+        exchange: str,
+        routing_key: str,
+        body: str | bytes,
+        properties: pika.spec.BasicProperties | None = None,
+    ):
+        if self._closed_reason is not None:
+            raise self._closed_reason
+
+        self._channel.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=properties,
+        )
+
+        # In confirm mode, the broker numbers the messages published on a channel from 1.
+        self._num_published += 1
+        self._unconfirmed.add(self._num_published)
+
+    async def wait_for_confirms(self):
+        """
+        Waits until every message published so far has been confirmed. Raises if any of
+        them were nacked, or if the channel was closed before they were confirmed.
+        """
+
+        if self._unconfirmed and self._closed_reason is None:
+            self._confirmed = asyncio.get_running_loop().create_future()
+            try:
+                await self._confirmed
+            finally:
+                self._confirmed = None
+
+        if self._closed_reason is not None:
+            raise self._closed_reason
+
+        if self._num_nacked:
+            num_nacked, self._num_nacked = self._num_nacked, 0
+            raise pika.exceptions.AMQPError(f"{num_nacked} messages were nacked by the broker")
+
+    def _on_delivery_confirmation(self, frame: pika.frame.Method):
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self._unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self._unconfirmed else []
+
+        self._unconfirmed.difference_update(tags)
+        if isinstance(method, pika.spec.Basic.Nack):
+            self._num_nacked += len(tags)
+
+        if not self._unconfirmed and self._confirmed and not self._confirmed.done():
+            self._confirmed.set_result(None)
+
+    def _on_closed(self, reason: Exception):
+        if self._closed_reason is None:
+            self._closed_reason = (
+                reason
+                if isinstance(reason, Exception)
+                else pika.exceptions.AMQPConnectionError(reason)
+            )
+        if self._confirmed and not self._confirmed.done():
+            self._confirmed.set_result(None)
+
+
 def start_rabbitmq_consume_thread[
     TModel
 ](
@@ -103,7 +287,7 @@ def consume_from_rabbitmq_target[
             body: bytes,
         ):
             try:
-                payload = json.loads(body)
+                payload = decode_message_body(body, properties.content_type)
                 model = model_factory(payload)
                 model_queue.put(model)
 
@@ -139,6 +323,111 @@ def consume_from_rabbitmq_target[
         channel.start_consuming()
 
 
+def start_rabbitmq_batch_consume_thread[
+    TModel
+](
+    *,
+    rabbitmq_queue_name: str,
+    model_factory: Callable[[Any], TModel],
+    batch_queue: queue.Queue[list[TModel]],
+    ack_queue: queue.Queue[bool],
+    prefetch_count: int,
+) -> threading.Thread:
+    """
+    Starts a thread to run the `consume_batches_from_rabbitmq_target` method, with the
+    given arguments. Returns the thread.
+    """
+
+    consume_from_rabbitmq_thread = threading.Thread(
+        target=consume_batches_from_rabbitmq_target,
+        kwargs=dict(
+            rabbitmq_queue_name=rabbitmq_queue_name,
+            model_factory=model_factory,
+            batch_queue=batch_queue,
+            ack_queue=ack_queue,
+            prefetch_count=prefetch_count,
+        ),
+    )
+
+    consume_from_rabbitmq_thread.start()
+    return consume_from_rabbitmq_thread
+
+
+def consume_batches_from_rabbitmq_target[
+    TModel
+](
+    *,
+    rabbitmq_queue_name: str,
+    model_factory: Callable[[Any], TModel],
+    batch_queue: queue.Queue[list[TModel]],
+    ack_queue: queue.Queue[bool],
+    prefetch_count: int,
+):
+    """
+    Like `consume_from_rabbitmq_target`, but places records into the `batch_queue` in
+    batches of up to `prefetch_count`, so that they can be processed concurrently. A
+    batch is handed over once it's full, or once no further messages arrive within
+    `RABBITMQ_BATCH_WAIT_SECONDS`. Expects a single boolean flag on the `ack_queue` per
+    batch, indicating whether the whole batch should be acked or nacked.
+    """
+
+    with (
+        initialize_rabbitmq_connection() as connection,
+        connection.channel() as channel,
+    ):
+        channel: pika.adapters.blocking_connection.BlockingChannel
+        declare_rabbitmq_infrastructure(channel)
+        channel.basic_qos(prefetch_count=prefetch_count)
+
+        delivery_tags: list[int] = []
+        batch: list[TModel] = []
+
+        def _model_consumer(
+            ch: pika.channel.Channel,
+            basic_deliver: pika.spec.Basic.Deliver,
+            properties: pika.spec.BasicProperties,
+            body: bytes,
+        ):
+            delivery_tags.append(basic_deliver.delivery_tag)
+            payload = decode_message_body(body, properties.content_type)
+            batch.append(model_factory(payload))
+
+        consumer_tag = None
+        if constants.RABBITMQ_CTAG_PREFIX:
+            consumer_tag = f"{constants.RABBITMQ_CTAG_PREFIX}{uuid.uuid4()}"
+            logger.info("Starting RabbitMQ consumer with ctag: %s", consumer_tag)
+
+        channel.basic_consume(
+            queue=rabbitmq_queue_name,
+            on_message_callback=_model_consumer,
+            consumer_tag=consumer_tag,
+            auto_ack=False,
+        )
+
+        while True:
+            num_received = -1
+            while len(delivery_tags) < prefetch_count and num_received != len(delivery_tags):
+                num_received = len(delivery_tags)
+                connection.process_data_events(
+                    time_limit=constants.RABBITMQ_BATCH_WAIT_SECONDS
+                )
+
+            if not batch:
+                continue
+
+            batch_queue.put(list(batch))
+
+            if ack_queue.get():
+                channel.basic_ack(delivery_tags[-1], multiple=True)
+            else:
+                channel.basic_nack(delivery_tags[-1], multiple=True)
+                channel.close()
+                return
+
+            delivery_tags.clear()
+            batch.clear()
+
+
 def declare_rabbitmq_infrastructure(
     channel: pika.adapters.blocking_connection.BlockingChannel,
 ):
@@ -200,3 +489,9 @@ def declare_rabbitmq_infrastructure(
         queue=constants.RABBITMQ_CDC_REQS_QNAME,
         routing_key=f"{constants.RABBITMQ_CDC_REQS_RK_PREFIX}.#",
     )
+
+    channel.queue_bind(
+        exchange=constants.RABBITMQ_EXCHANGE,
+        queue=constants.RABBITMQ_CDC_REQS_QNAME,
+        routing_key=f"{constants.RABBITMQ_CDC_REQ_SET_MEMBERS_RK_PREFIX}.#",
+    )
@@ -0,0 +1,52 @@
+import logging
+import asyncio
+
+from pipdepgraph import constants
+from pipdepgraph.core import common
+
+from pipdepgraph.repositories import (
+    cdc_repository,
+)
+
+logger = logging.getLogger("pipdepgraph.entrypoints.cdc.create_replication_slots")
+
+
+async def main():
+    """
+    Creates the replication slots of every partition of `CDC_PUBLISHER_TABLES` across
+    `CDC_PUBLISHER_PARTITION_COUNT` publishers. Meant to be run while the publisher being
+    taken over from is still running, as slots only see changes made after they're
+    created.
+    """
+
+    logger.info("Initializing DB pool")
+    async with (
+        common.initialize_async_connection_pool(profile="default") as db_pool,
+    ):
+        logger.info("Initializing repositories")
+        cdcr = cdc_repository.CdcRepository(db_pool)
+
+        for partition_index in range(constants.CDC_PUBLISHER_PARTITION_COUNT):
+            stream = cdc_repository.CdcStream(
+                tables=tuple(sorted(constants.CDC_PUBLISHER_TABLES)),
+                partition_index=partition_index,
+                partition_count=constants.CDC_PUBLISHER_PARTITION_COUNT,
+            )
+
+            if await cdcr.create_replication_slot(stream):
+                logger.info(
+                    "Created replication slot %s for stream %s",
+                    stream.replication_slot,
+                    stream.offset_name,
+                )
+            else:
+                logger.info(
+                    "Replication slot %s for stream %s already exists",
+                    stream.replication_slot,
+                    stream.offset_name,
+                )
+
+
+if __name__ == "__main__":
+    common.initialize_logger()
+    asyncio.run(main())
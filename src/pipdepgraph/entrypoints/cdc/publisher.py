@@ -1,9 +1,9 @@
 import logging
 import asyncio
-import time
+import contextlib
 
 from pipdepgraph import constants, models
-from pipdepgraph.core import common, rabbitmq
+from pipdepgraph.core import common, compaction, rabbitmq
 
 from pipdepgraph.services import rabbitmq_publish_service
 
@@ -15,9 +15,13 @@ logger = logging.getLogger("pipdepgraph.entrypoints.cdc.publisher")
 
 
 async def main():
+    # Fails fast on an unknown encoding, rather than on the first event.
+    rabbitmq.encode_message_body({}, constants.CDC_MESSAGE_ENCODING)
+    logger.info("Encoding events as %s", constants.CDC_MESSAGE_ENCODING)
+
     logger.info("Initializing DB pool")
     async with (
-        common.initialize_async_connection_pool() as db_pool,
+        common.initialize_async_connection_pool(profile="publisher") as db_pool,
     ):
         with (
             rabbitmq.initialize_rabbitmq_connection() as connection,
@@ -28,23 +32,150 @@ async def main():
         logger.info("Initializing repositories")
         cdcr = cdc_repository.CdcRepository(db_pool)
 
+        stream = cdc_repository.CdcStream.from_constants()
+        logger.info("Publishing stream %s", stream.offset_name)
+
+        if constants.CDC_SOURCE == "logical_decoding":
+            if (
+                not stream.is_whole_log
+                and not await cdcr.replication_slot_exists(stream)
+                and await cdcr.replication_slot_exists(cdc_repository.CdcStream())
+            ):
+                # A slot created now would miss the changes the whole log's publisher
+                # hasn't published yet.
+                raise RuntimeError(
+                    f"Replication slot {stream.replication_slot} doesn't exist, but "
+                    f"{constants.CDC_REPLICATION_SLOT} does. Run the "
+                    "create_replication_slots entrypoint before stopping the whole "
+                    "log's publisher."
+                )
+
+            if await cdcr.create_replication_slot(stream):
+                logger.info("Created replication slot %s", stream.replication_slot)
+            drain = _drain_replication_slot
+            # Writes to the replication slot aren't notified, so it's polled.
+            listening = contextlib.nullcontext()
+        elif constants.CDC_SOURCE == "event_log":
+            drain = _drain_event_log
+            listening = cdcr.listen()
+        else:
+            raise ValueError(f"Unknown CDC source: {constants.CDC_SOURCE}")
+
         logger.info("Initializing services")
         rmq_pub = rabbitmq_publish_service.RabbitMqPublishService(rabbitmq.initialize_rabbitmq_connection)
 
         logger.info("Running.")
-        while True:
-            logger.info("Polling event log for new events.")
+        publisher = rabbitmq.ConfirmedPublisher()
+        async with listening as listener:
+            try:
+                while True:
+                    # The connection is kept open between drains, and only reopened
+                    # once the broker closes it.
+                    if publisher.is_closed:
+                        await publisher.close()
+                        logger.info("Opening RabbitMQ publisher connection.")
+                        publisher = rabbitmq.ConfirmedPublisher()
+                        await publisher.open()
 
-            with (
-                rabbitmq.initialize_rabbitmq_connection() as connection,
-                connection.channel() as channel,
-            ):
-                async for event in cdcr.iter_event_log():
-                    logger.debug("Publishing event: %s", event)
-                    rmq_pub.publish_cdc_event_log_entry(event, channel)
+                    logger.info("Draining %s.", constants.CDC_SOURCE)
+                    num_published = await drain(cdcr, stream, rmq_pub, publisher)
+
+                    logger.info(
+                        "%s drained, %s events published. Waiting for new events.",
+                        constants.CDC_SOURCE,
+                        num_published,
+                    )
+                    if listener is None:
+                        await asyncio.sleep(constants.CDC_LOGICAL_DECODING_POLL_INTERVAL)
+                    elif not await listener.wait(constants.CDC_PUBLISHER_POLL_INTERVAL):
+                        logger.info(
+                            "No notification within %s seconds, polling event log.",
+                            constants.CDC_PUBLISHER_POLL_INTERVAL,
+                        )
+            finally:
+                await publisher.close()
+
+
+async def _drain_event_log(
+    cdcr: cdc_repository.CdcRepository,
+    stream: cdc_repository.CdcStream,
+    rmq_pub: rabbitmq_publish_service.RabbitMqPublishService,
+    publisher: rabbitmq.ConfirmedPublisher,
+) -> int:
+    """
+    Publishes the events of `stream` past its offset, compacted one window of
+    `CDC_COMPACTION_WINDOW_SIZE` events at a time. The offset is moved to the last event
+    of each window once the broker has confirmed everything published from it, so that
+    events are published at least once.
+    """
+
+    num_published = 0
+    window: list[models.EventLogEntry] = []
+
+    async def _publish_window():
+        nonlocal num_published
+        num_published += await _publish_compacted(window, rmq_pub, publisher)
+        await cdcr.upsert_offset(stream.offset_name, window[-1].event_id)
+        window.clear()
+
+    async for event in cdcr.iter_event_log(auto_upsert_offset=False, stream=stream):
+        window.append(event)
+        if len(window) >= constants.CDC_COMPACTION_WINDOW_SIZE:
+            await _publish_window()
+
+    if window:
+        await _publish_window()
+
+    return num_published
+
+
+async def _drain_replication_slot(
+    cdcr: cdc_repository.CdcRepository,
+    stream: cdc_repository.CdcStream,
+    rmq_pub: rabbitmq_publish_service.RabbitMqPublishService,
+    publisher: rabbitmq.ConfirmedPublisher,
+) -> int:
+    """
+    Publishes the changes of `stream` in its replication slot, compacted one batch at a
+    time. The slot can only be advanced past whole transactions, so it's advanced once
+    everything published from a batch has been confirmed.
+    """
+
+    num_published = 0
+    while True:
+        events, lsn = await cdcr.peek_replication_slot(stream)
+        if lsn is None:
+            return num_published
+
+        num_published += await _publish_compacted(events, rmq_pub, publisher)
+        await cdcr.advance_replication_slot(lsn, stream)
+
+
+async def _publish_compacted(
+    events: list[models.EventLogEntry],
+    rmq_pub: rabbitmq_publish_service.RabbitMqPublishService,
+    publisher: rabbitmq.ConfirmedPublisher,
+) -> int:
+    """
+    Compacts `events`, and publishes what's left one window of `CDC_PUBLISH_WINDOW_SIZE`
+    events at a time, waiting for each window to be confirmed. Returns the number of
+    events published.
+    """
+
+    if constants.CDC_COMPACTION_WINDOW_SIZE > 1:
+        compacted = compaction.compact_events(
+            events, constants.CDC_ROW_KEYS, constants.CDC_GENERATED_COLUMNS
+        )
+        logger.debug("Compacted %s events into %s.", len(events), len(compacted))
+    else:
+        compacted = events
+
+    for i in range(0, len(compacted), constants.CDC_PUBLISH_WINDOW_SIZE):
+        window = compacted[i : i + constants.CDC_PUBLISH_WINDOW_SIZE]
+        await rmq_pub.publish_cdc_event_log_entries_confirmed(window, publisher)
+
+    return len(compacted)
 
-            logger.info("Event log drained. Waiting 10 seconds.")
-            time.sleep(10)
 
 if __name__ == "__main__":
     common.initialize_logger()
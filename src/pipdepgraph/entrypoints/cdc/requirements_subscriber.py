@@ -8,59 +8,93 @@ from pipdepgraph import constants, models
 from pipdepgraph.services import rabbitmq_publish_service
 from pipdepgraph.core import rabbitmq
 from pipdepgraph.core import common
+from pipdepgraph.repositories import reverse_dependencies_repository
 
 logger = logging.getLogger("pipdepgraph.entrypoints.cdc.requirements_subscriber")
 
 
 async def main():
-    logger.info("Initializing RabbitMQ Connection")
-    with (
-        rabbitmq.initialize_rabbitmq_connection() as rabbitmq_connection,
-        rabbitmq_connection.channel() as channel,
-    ):
-        channel: pika.adapters.blocking_connection.BlockingChannel
-        rabbitmq.declare_rabbitmq_infrastructure(channel)
-
-        logger.info("Starting RabbitMQ consumer thread")
-        event_queue: queue.Queue[models.EventLogEntry] = queue.Queue()
-        ack_queue: queue.Queue[bool] = queue.Queue()
-
-        consume_from_rabbitmq_thread = rabbitmq.start_rabbitmq_consume_thread(
-            rabbitmq_queue_name=constants.RABBITMQ_CDC_REQS_QNAME,
-            model_factory=models.EventLogEntry.from_dict,
-            model_queue=event_queue,
-            ack_queue=ack_queue,
-            prefetch_count=constants.RABBITMQ_CDC_REQS_SUB_PREFETCH,
-        )
+    logger.info("Initializing DB pool")
+    async with (common.initialize_async_connection_pool(profile="subscriber") as db_pool,):
+        logger.info("Initializing repositories")
+        rdr = reverse_dependencies_repository.ReverseDependenciesRepository(db_pool)
+
+        logger.info("Initializing RabbitMQ Connection")
+        with (
+            rabbitmq.initialize_rabbitmq_connection() as rabbitmq_connection,
+            rabbitmq_connection.channel() as channel,
+        ):
+            channel: pika.adapters.blocking_connection.BlockingChannel
+            rabbitmq.declare_rabbitmq_infrastructure(channel)
+
+            logger.info("Starting RabbitMQ consumer thread")
+            event_queue: queue.Queue[models.EventLogEntry] = queue.Queue()
+            ack_queue: queue.Queue[bool] = queue.Queue()
+
+            consume_from_rabbitmq_thread = rabbitmq.start_rabbitmq_consume_thread(
+                rabbitmq_queue_name=constants.RABBITMQ_CDC_REQS_QNAME,
+                model_factory=models.EventLogEntry.from_dict,
+                model_queue=event_queue,
+                ack_queue=ack_queue,
+                prefetch_count=constants.RABBITMQ_CDC_REQS_SUB_PREFETCH,
+            )
+
+            rmq_pub = rabbitmq_publish_service.RabbitMqPublishService(None)
+
+            logger.info("Running.")
+            while True:
+                event = None
 
-        rmq_pub = rabbitmq_publish_service.RabbitMqPublishService(None)
+                try:
+                    event = event_queue.get(timeout=5.0)
+                    if event.operation in ('INSERT', 'UPDATE') and event.after is not None:
+                        rmq_pub.publish_requirement_dict_for_candidate_correlation(
+                            event.after,
+                            channel=channel,
+                        )
 
-        logger.info("Running.")
-        while True:
-            event = None
+                    # Requirement set members aren't linked to a distribution, so their
+                    # reverse dependencies are maintained by the distribution processor.
+                    if event.table == "requirements":
+                        await _update_reverse_dependencies(rdr, event)
 
-            try:
-                event = event_queue.get(timeout=5.0)
-                if event.operation in ('INSERT', 'UPDATE') and event.after is not None:
-                    rmq_pub.publish_requirement_dict_for_candidate_correlation(
-                        event.after,
-                        channel=channel,
+                    ack_queue.put(True)
+
+                except queue.Empty as ex:
+                    if not consume_from_rabbitmq_thread.is_alive():
+                        logger.error("RabbitMQ consumer thread has died.")
+                        return
+
+                except Exception as ex:
+                    logger.error(
+                        f"Error while handling CDC Requirement message: {event}",
+                        exc_info=ex,
                     )
-                ack_queue.put(True)
+                    ack_queue.put(False)
+                    raise
 
-            except queue.Empty as ex:
-                if not consume_from_rabbitmq_thread.is_alive():
-                    logger.error("RabbitMQ consumer thread has died.")
-                    return
 
-            except Exception as ex:
-                logger.error(
-                    f"Error while handling CDC Requirement message: {event}",
-                    exc_info=ex,
-                )
-                ack_queue.put(False)
-                raise
+async def _update_reverse_dependencies(
+    rdr: reverse_dependencies_repository.ReverseDependenciesRepository,
+    event: models.EventLogEntry,
+):
+    """
+    Applies a CDC requirements event to the reverse dependencies index. Removals are
+    applied before additions, so that an update which doesn't change the dependency
+    is a no-op.
+    """
 
+    if event.before is not None and event.before.get("parsable", True):
+        await rdr.remove_reverse_dependency(
+            distribution_id=event.before["distribution_id"],
+            dependency_name=event.before["dependency_name"],
+        )
+
+    if event.after is not None and event.after.get("parsable", True):
+        await rdr.add_reverse_dependency(
+            distribution_id=event.after["distribution_id"],
+            dependency_name=event.after["dependency_name"],
+        )
 
 if __name__ == "__main__":
     common.initialize_logger()
@@ -1,62 +1,89 @@
 import logging
 import asyncio
+import concurrent.futures
+import contextlib
 import queue
 
-import pika.adapters.blocking_connection
-
 from pipdepgraph import constants, models
-from pipdepgraph.services import rabbitmq_publish_service
 from pipdepgraph.core import rabbitmq
 from pipdepgraph.core import common
 
-logger = logging.getLogger("pipdepgraph.entrypoints.cdc.requirements_subscriber")
+from pipdepgraph.services import candidate_correlation_service
+
+from pipdepgraph.repositories import (
+    versions_repository,
+    requirements_repository,
+    candidates_repository,
+)
+
+logger = logging.getLogger("pipdepgraph.entrypoints.cdc.versions_subscriber")
 
 
 async def main():
-    logger.info("Initializing RabbitMQ Connection")
-    with (
-        rabbitmq.initialize_rabbitmq_connection() as rabbitmq_connection,
-        rabbitmq_connection.channel() as channel,
-    ):
-        channel: pika.adapters.blocking_connection.BlockingChannel
-        rabbitmq.declare_rabbitmq_infrastructure(channel)
-
-        logger.info("Starting RabbitMQ consumer thread")
-        event_queue: queue.Queue[models.EventLogEntry] = queue.Queue()
-        ack_queue: queue.Queue[bool] = queue.Queue()
-
-        consume_from_rabbitmq_thread = rabbitmq.start_rabbitmq_consume_thread(
-            rabbitmq_queue_name=constants.RABBITMQ_CDC_REQS_QNAME,
-            model_factory=models.EventLogEntry.from_dict,
-            model_queue=event_queue,
-            ack_queue=ack_queue,
-            prefetch_count=constants.RABBITMQ_CDC_REQS_SUB_PREFETCH,
-        )
-
-        rmq_pub = rabbitmq_publish_service.RabbitMqPublishService(None)
-
-        logger.info("Running.")
-        while True:
-            event = None
-
-            try:
-                event = event_queue.get(timeout=5.0)
-                if event.operation in ('INSERT', 'UPDATE') and event.after is not None:
-                    rmq_pub.publish_requirement_dict_for_candidate_correlation(event.after)
-                ack_queue.put(True)
-
-            except queue.Empty as ex:
-                if not consume_from_rabbitmq_thread.is_alive():
-                    logger.error("RabbitMQ consumer thread has died.")
-                    return
-
-            except Exception as ex:
-                logger.error(
-                    f"Error while handling CDC Requirement message: {event}",
-                    exc_info=ex,
-                )
-                ack_queue.put(False)
-                raise
+    logger.info("Initializing DB pool")
+    async with (common.initialize_async_connection_pool(profile="subscriber") as db_pool,):
+        with (
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=constants.CANDIDATE_CORRELATION_PROCESS_POOL_SIZE
+            )
+            if constants.CANDIDATE_CORRELATION_PROCESS_POOL_SIZE > 0
+            else contextlib.nullcontext()
+        ) as executor:
+            logger.info("Initializing repositories")
+            vr = versions_repository.VersionsRepository(db_pool)
+            rr = requirements_repository.RequirementsRepository(db_pool)
+            cr = candidates_repository.CandidatesRepository(db_pool)
+
+            logger.info(
+                "Initializing candidate_correlation_service.CandidateCorrelationService"
+            )
+            ccs = candidate_correlation_service.CandidateCorrelationService(
+                db_pool=db_pool,
+                rr=rr,
+                vr=vr,
+                cr=cr,
+                executor=executor,
+            )
+
+            logger.info("Starting RabbitMQ consumer thread")
+            event_queue: queue.Queue[models.EventLogEntry] = queue.Queue()
+            ack_queue: queue.Queue[bool] = queue.Queue()
+
+            consume_from_rabbitmq_thread = rabbitmq.start_rabbitmq_consume_thread(
+                rabbitmq_queue_name=constants.RABBITMQ_CDC_VERSIONS_QNAME,
+                model_factory=models.EventLogEntry.from_dict,
+                model_queue=event_queue,
+                ack_queue=ack_queue,
+                prefetch_count=constants.RABBITMQ_CDC_VERSIONS_SUB_PREFETCH,
+            )
+
+            logger.info("Running.")
+            while True:
+                event = None
+
+                try:
+                    event = event_queue.get(timeout=5.0)
+
+                    # Updates to version records only ever re-parse the version string,
+                    # which can't change the set of requirements the version satisfies.
+                    if event.operation == 'INSERT' and event.after is not None:
+                        await ccs.process_version_record(
+                            models.Version.from_dict(event.after)
+                        )
+                    ack_queue.put(True)
+
+                except queue.Empty as ex:
+                    if not consume_from_rabbitmq_thread.is_alive():
+                        logger.error("RabbitMQ consumer thread has died.")
+                        return
+
+                except Exception as ex:
+                    logger.error(
+                        f"Error while handling CDC Version message: {event}",
+                        exc_info=ex,
+                    )
+                    ack_queue.put(False)
+                    raise
 
 
 if __name__ == "__main__":
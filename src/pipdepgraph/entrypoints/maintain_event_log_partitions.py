@@ -0,0 +1,35 @@
+import logging
+import asyncio
+
+from pipdepgraph.core import common
+
+from pipdepgraph.repositories import (
+    cdc_repository,
+)
+
+logger = logging.getLogger("pipdepgraph.entrypoints.maintain_event_log_partitions")
+
+
+async def main():
+    """
+    Creates the upcoming partitions of the (partitioned) event log, and drops the
+    partitions that every CDC consumer has read past. Meant to be run periodically.
+    """
+
+    logger.info("Initializing DB pool")
+    async with (
+        common.initialize_async_connection_pool(profile="default") as db_pool,
+    ):
+        logger.info("Initializing repositories")
+        cdcr = cdc_repository.CdcRepository(db_pool)
+
+        for partition_name in await cdcr.create_event_log_partitions():
+            logger.info("Created partition %s", partition_name)
+
+        for partition_name in await cdcr.drop_consumed_event_log_partitions():
+            logger.info("Dropped partition %s", partition_name)
+
+
+if __name__ == "__main__":
+    common.initialize_logger()
+    asyncio.run(main())
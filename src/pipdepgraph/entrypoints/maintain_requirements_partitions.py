@@ -0,0 +1,43 @@
+import logging
+import asyncio
+
+from pipdepgraph import constants
+from pipdepgraph.core import common
+
+from pipdepgraph.repositories import (
+    requirements_repository,
+)
+
+logger = logging.getLogger("pipdepgraph.entrypoints.maintain_requirements_partitions")
+
+
+async def main():
+    """
+    Vacuums and analyzes the partitions of the partitioned requirements table, up to
+    `SCAN_CONCURRENCY` partitions at a time.
+    """
+
+    logger.info("Initializing DB pool")
+    async with (
+        common.initialize_async_connection_pool(profile="scan") as db_pool,
+    ):
+        logger.info("Initializing repositories")
+        rr = requirements_repository.RequirementsRepository(db_pool)
+
+        semaphore = asyncio.Semaphore(constants.SCAN_CONCURRENCY)
+
+        async def _maintain_partition(partition_index: int):
+            async with semaphore:
+                logger.info("Vacuuming partition %s", partition_index)
+                await rr.vacuum_analyze_partition(partition_index)
+                logger.info("Vacuumed partition %s", partition_index)
+
+        await asyncio.gather(*(
+            _maintain_partition(partition_index)
+            for partition_index in range(constants.REQUIREMENTS_PARTITION_COUNT)
+        ))
+
+
+if __name__ == "__main__":
+    common.initialize_logger()
+    asyncio.run(main())
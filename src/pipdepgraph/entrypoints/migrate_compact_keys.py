@@ -0,0 +1,62 @@
+import logging
+import asyncio
+
+from pipdepgraph.core import common
+
+from pipdepgraph.repositories import (
+    package_names_repository,
+    versions_repository,
+    distributions_repository,
+    requirements_repository,
+    table_scan,
+)
+
+logger = logging.getLogger("pipdepgraph.entrypoints.migrate_compact_keys")
+
+
+async def main():
+    """
+    Backfills the compact keys added by "sql/011-compact-keys.sql" for every existing
+    record. Tables are backfilled in dependency order, since each table's references
+    are copied from the compact keys of the table it references. Each table is split
+    into key ranges which are backfilled in parallel, committing after every page.
+
+    Safe to re-run, and to run while the other services are running. Records inserted
+    concurrently are assigned their compact keys by triggers.
+    """
+
+    logger.info("Initializing DB pool")
+    async with (
+        common.initialize_async_connection_pool(profile="scan") as db_pool,
+    ):
+        logger.info("Initializing repositories")
+        pnr = package_names_repository.PackageNamesRepository(db_pool)
+        vr = versions_repository.VersionsRepository(db_pool)
+        dr = distributions_repository.DistributionsRepository(db_pool)
+        rr = requirements_repository.RequirementsRepository(db_pool)
+
+        logger.info("Backfilling package IDs")
+        num_updated = await pnr.backfill_package_ids()
+        logger.info("Backfilled %s package names", num_updated)
+
+        key_ranges = table_scan.uuid_key_ranges()
+
+        for table_name, backfill in (
+            ("versions", vr.backfill_compact_keys),
+            ("distributions", dr.backfill_compact_keys),
+            ("requirements", rr.backfill_compact_keys),
+        ):
+            logger.info("Backfilling %s across %s key ranges", table_name, len(key_ranges))
+            num_updated = 0
+
+            async def _backfill_key_range(key_range: table_scan.KeyRange):
+                nonlocal num_updated
+                num_updated += await backfill(key_range)
+
+            await table_scan.run_sharded(key_ranges, _backfill_key_range)
+            logger.info("Backfilled %s %s", num_updated, table_name)
+
+
+if __name__ == "__main__":
+    common.initialize_logger()
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+import logging
+import asyncio
+
+from pipdepgraph.core import common
+
+from pipdepgraph.repositories import (
+    requirements_repository,
+    table_scan,
+)
+
+logger = logging.getLogger("pipdepgraph.entrypoints.migrate_partitioned_requirements")
+
+
+async def main():
+    """
+    Migrates the requirements table to the hash-partitioned table created by
+    "sql/013-partitioned-requirements.sql", while the other services keep running.
+    Existing records are copied over one key range at a time, while new writes are
+    mirrored by a trigger. Once every record has been copied, the tables are swapped.
+    """
+
+    logger.info("Initializing DB pool")
+    async with (
+        common.initialize_async_connection_pool(profile="scan") as db_pool,
+    ):
+        logger.info("Initializing repositories")
+        rr = requirements_repository.RequirementsRepository(db_pool)
+
+        key_ranges = table_scan.uuid_key_ranges()
+        num_copied = 0
+
+        async def _copy_key_range(key_range: table_scan.KeyRange):
+            nonlocal num_copied
+            num_copied += await rr.copy_to_partitioned(key_range)
+            logger.info("Copied key range %s. (%s records so far)", key_range, num_copied)
+
+        logger.info("Copying requirements across %s key ranges", len(key_ranges))
+        await table_scan.run_sharded(key_ranges, _copy_key_range)
+        logger.info("Copied %s requirements", num_copied)
+
+        logger.info("Swapping in the partitioned requirements table")
+        await rr.swap_partitioned()
+        logger.info("Done. The old table has been renamed to requirements_unpartitioned.")
+
+
+if __name__ == "__main__":
+    common.initialize_logger()
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+import logging
+import asyncio
+import concurrent.futures
+
+from pipdepgraph import constants
+from pipdepgraph.core import common
+
+from pipdepgraph.services import candidate_correlation_service
+
+from pipdepgraph.repositories import (
+    versions_repository,
+    requirements_repository,
+    candidates_repository,
+)
+
+logger = logging.getLogger("pipdepgraph.entrypoints.rebuild_candidates")
+
+
+async def main():
+    """
+    Rebuilds the "constraint_candidates" table in bulk, bypassing CDC and RabbitMQ.
+
+    Reads from the primary rather than the read replica. The rebuilt table is swapped in
+    place of the primary's, so anything written to the primary but not yet replicated
+    would be lost.
+    """
+
+    logger.info("Initializing DB pool")
+    async with (
+        common.initialize_async_connection_pool() as db_pool,
+    ):
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=constants.CANDIDATE_REBUILD_PROCESS_POOL_SIZE
+        ) as executor:
+            logger.info("Initializing repositories")
+            vr = versions_repository.VersionsRepository(db_pool)
+            rr = requirements_repository.RequirementsRepository(db_pool)
+            cr = candidates_repository.CandidatesRepository(db_pool)
+
+            logger.info(
+                "Initializing candidate_correlation_service.CandidateCorrelationService"
+            )
+            ccs = candidate_correlation_service.CandidateCorrelationService(
+                db_pool=db_pool,
+                rr=rr,
+                vr=vr,
+                cr=cr,
+                executor=executor,
+            )
+
+            logger.info("Rebuilding candidates.")
+            num_records = await ccs.rebuild_constraint_candidates()
+            logger.info("Done. Rebuilt %s candidate records.", num_records)
+
+
+if __name__ == "__main__":
+    common.initialize_logger()
+    asyncio.run(main())
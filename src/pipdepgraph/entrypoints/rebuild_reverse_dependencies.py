@@ -0,0 +1,43 @@
+import logging
+import asyncio
+
+from pipdepgraph.core import common
+
+from pipdepgraph.repositories import (
+    reverse_dependencies_repository,
+    table_scan,
+)
+
+logger = logging.getLogger("pipdepgraph.entrypoints.rebuild_reverse_dependencies")
+
+
+async def main():
+    """
+    Loads the reverse dependencies of every existing distribution into the
+    "reverse_dependencies" table. Distributions are split into key ranges which are
+    loaded in parallel. Safe to re-run, and to run while the other services are running.
+    """
+
+    logger.info("Initializing DB pool")
+    async with (
+        common.initialize_async_connection_pool(profile="scan") as db_pool,
+    ):
+        logger.info("Initializing repositories")
+        rdr = reverse_dependencies_repository.ReverseDependenciesRepository(db_pool)
+
+        key_ranges = table_scan.process_key_ranges(table_scan.uuid_key_ranges())
+        num_added = 0
+
+        async def _rebuild_key_range(key_range: table_scan.KeyRange):
+            nonlocal num_added
+            num_added += await rdr.rebuild_key_range(key_range)
+            logger.info("Rebuilt key range %s. (%s records so far)", key_range, num_added)
+
+        logger.info("Rebuilding reverse dependencies across %s key ranges", len(key_ranges))
+        await table_scan.run_sharded(key_ranges, _rebuild_key_range)
+        logger.info("Done. Added %s reverse dependencies.", num_added)
+
+
+if __name__ == "__main__":
+    common.initialize_logger()
+    asyncio.run(main())
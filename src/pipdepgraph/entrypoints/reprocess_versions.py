@@ -1,10 +1,12 @@
 import logging
 import asyncio
 
+from pipdepgraph import constants
 from pipdepgraph.core import parsing
 from pipdepgraph.core import common
 
 from pipdepgraph.repositories import (
+    table_scan,
     versions_repository,
 )
 
@@ -13,32 +15,44 @@ logger = logging.getLogger("pipdepgraph.entrypoints.reprocess_package_versions")
 
 async def main():
     logger.info("Initializing DB pool")
-    async with (common.initialize_async_connection_pool() as db_pool,):
+    async with (
+        common.initialize_async_connection_pool(
+            profile="scan",
+            max_pool_size=2 * constants.SCAN_CONCURRENCY,
+        ) as db_pool,
+        common.initialize_async_read_pool(profile="scan") as read_pool,
+    ):
         logger.info("Initializing repositories")
-        vr = versions_repository.VersionsRepository(db_pool)
-
-        async with (db_pool.connection() as conn, conn.cursor() as edit_cursor,):
-            async for version in vr.iter_versions():
-                parsed_version = parsing.parse_version_string(version.package_version)
-                if parsed_version is None:
-                    continue
-
-                version.epoch = parsed_version.epoch
-                version.package_release = parsed_version.package_release
-                version.pre = parsed_version.pre
-                version.post = parsed_version.post
-                version.dev = parsed_version.dev
-                version.local = parsed_version.local
-                version.is_devrelease = parsed_version.is_devrelease
-                version.is_postrelease = parsed_version.is_postrelease
-                version.is_prerelease = parsed_version.is_prerelease
-
-                try:
-                    await vr.update_version(version, edit_cursor)
-                    await edit_cursor.execute("commit;")
-                except Exception as e:
-                    logger.error(f"Error reprocessing version: {version}", exc_info=e)
-
+        vr = versions_repository.VersionsRepository(db_pool, read_pool)
+
+        async def _reprocess_key_range(key_range: table_scan.KeyRange):
+            async with (db_pool.connection() as conn, conn.cursor() as edit_cursor,):
+                async for version in vr.iter_versions_in_key_range(key_range):
+                    parsed_version = parsing.parse_version_string(version.package_version)
+                    if parsed_version is None:
+                        continue
+
+                    version.epoch = parsed_version.epoch
+                    version.package_release = parsed_version.package_release
+                    version.pre = parsed_version.pre
+                    version.post = parsed_version.post
+                    version.dev = parsed_version.dev
+                    version.local = parsed_version.local
+                    version.is_devrelease = parsed_version.is_devrelease
+                    version.is_postrelease = parsed_version.is_postrelease
+                    version.is_prerelease = parsed_version.is_prerelease
+
+                    try:
+                        await vr.update_version(version, edit_cursor)
+                        await edit_cursor.execute("commit;")
+                    except Exception as e:
+                        logger.error(f"Error reprocessing version: {version}", exc_info=e)
+
+            logger.info("Finished reprocessing versions in key range: %s", key_range)
+
+        key_ranges = table_scan.process_key_ranges(table_scan.uuid_key_ranges())
+        logger.info("Reprocessing versions across %s key ranges", len(key_ranges))
+        await table_scan.run_sharded(key_ranges, _reprocess_key_range)
 
 
 if __name__ == "__main__":
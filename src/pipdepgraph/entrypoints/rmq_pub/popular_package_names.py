@@ -20,7 +20,7 @@ logger = logging.getLogger("pipdepgraph.entrypoints.rmq_pub.popular_package_name
 async def main():
     logger.info("Initializing DB pool")
     async with (
-        common.initialize_async_connection_pool() as db_pool,
+        common.initialize_async_connection_pool(profile="crawler") as db_pool,
         common.initialize_client_session() as client,
     ):
         logger.info("Initializing repositories")
@@ -16,6 +16,7 @@ from pipdepgraph.repositories import (
     distributions_repository,
     package_names_repository,
     requirements_repository,
+    table_scan,
 )
 
 from pipdepgraph.services import (
@@ -32,11 +33,14 @@ async def main():
     """
 
     logger.info("Initializing DB pool")
-    async with (common.initialize_async_connection_pool() as db_pool,):
+    async with (
+        common.initialize_async_connection_pool() as db_pool,
+        common.initialize_async_read_pool() as read_pool,
+    ):
         logger.info("Initializing repositories")
-        pnr = package_names_repository.PackageNamesRepository(db_pool)
-        dr = distributions_repository.DistributionsRepository(db_pool)
-        rr = requirements_repository.RequirementsRepository(db_pool)
+        pnr = package_names_repository.PackageNamesRepository(db_pool, read_pool)
+        dr = distributions_repository.DistributionsRepository(db_pool, read_pool)
+        rr = requirements_repository.RequirementsRepository(db_pool, read_pool)
 
         logger.info("Initializing RabbitMQ session")
         with (
@@ -48,6 +52,10 @@ async def main():
 
             rmq_pub = rabbitmq_publish_service.RabbitMqPublishService(None)
 
+            # Distributions and requirements are scanned as several key ranges in
+            # parallel, which keeps the scans ahead of publishing.
+            key_ranges = table_scan.process_key_ranges(table_scan.uuid_key_ranges())
+
             if constants.UPL_LOAD_DISTRIBUTIONS:
                 package_type = (
                     'bdist_wheel' if constants.UPL_ONLY_LOAD_BDIST_WHEEL_DISTRIBUTIONS else None
@@ -61,10 +69,14 @@ async def main():
                     processed,
                 )
 
-                async for vd in dr.iter_distributions(
-                    processed=processed,
-                    package_type=package_type
-                ):
+                async for vd in table_scan.merge_iters([
+                    dr.iter_distributions_in_key_range(
+                        key_range,
+                        processed=processed,
+                        package_type=package_type,
+                    )
+                    for key_range in key_ranges
+                ]):
                     logger.debug(
                         "Loading unprocessed version distribution: %s",
                         vd.distribution_id,
@@ -79,13 +91,19 @@ async def main():
 
             if constants.UPL_LOAD_INCOMPLETE_REQUIREMENTS:
                 logger.info("Loading all incomplete requirements records into RabbitMQ")
-                async for req in rr.iter_requirements(dependency_extras_arr_is_none=True):
+                async for req in table_scan.merge_iters([
+                    rr.iter_requirements_in_key_range(key_range, dependency_extras_arr_is_none=True)
+                    for key_range in key_ranges
+                ]):
                     logger.debug("Loading Requirement: %s", req)
                     rmq_pub.publish_requirement_for_reprocessing(req, channel=channel)
 
             if constants.UPL_LOAD_REQUIREMENTS_FOR_CANDIDATE_CORRELATION:
                 logger.info("Loading all requirements records into RabbitMQ")
-                async for req in rr.iter_requirements():
+                async for req in table_scan.merge_iters([
+                    rr.iter_requirements_in_key_range(key_range)
+                    for key_range in key_ranges
+                ]):
                     logger.debug("Loading Requirement: %s", req)
                     rmq_pub.publish_requirement_for_candidate_correlation(req, channel=channel)
 
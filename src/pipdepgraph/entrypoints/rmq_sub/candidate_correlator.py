@@ -1,5 +1,7 @@
 import logging
 import asyncio
+import concurrent.futures
+import contextlib
 import queue
 
 from pipdepgraph import constants, models
@@ -21,57 +23,96 @@ logger = logging.getLogger(
 
 async def main():
     logger.info("Initializing DB pool")
-    async with (common.initialize_async_connection_pool() as db_pool,):
-        logger.info("Initializing repositories")
-        vr = versions_repository.VersionsRepository(db_pool)
-        rr = requirements_repository.RequirementsRepository(db_pool)
-        cr = candidates_repository.CandidatesRepository(db_pool)
-
-        logger.info(
-            "Initializing candidate_correlation_service.CandidateCorrelationService"
-        )
-        ccs = candidate_correlation_service.CandidateCorrelationService(
-            db_pool=db_pool,
-            rr=rr,
-            vr=vr,
-            cr=cr,
-        )
+    async with (common.initialize_async_connection_pool(profile="correlator") as db_pool,):
+        with (
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=constants.CANDIDATE_CORRELATION_PROCESS_POOL_SIZE
+            )
+            if constants.CANDIDATE_CORRELATION_PROCESS_POOL_SIZE > 0
+            else contextlib.nullcontext()
+        ) as executor:
+            logger.info("Initializing repositories")
+            vr = versions_repository.VersionsRepository(db_pool)
+            rr = requirements_repository.RequirementsRepository(db_pool)
+            cr = candidates_repository.CandidatesRepository(db_pool)
 
-        logger.info("Starting RabbitMQ consumer thread")
-        requirements_queue: queue.Queue[models.Requirement] = queue.Queue()
-        ack_queue: queue.Queue[bool] = queue.Queue()
+            logger.info(
+                "Initializing candidate_correlation_service.CandidateCorrelationService"
+            )
+            ccs = candidate_correlation_service.CandidateCorrelationService(
+                db_pool=db_pool,
+                rr=rr,
+                vr=vr,
+                cr=cr,
+                executor=executor,
+            )
 
-        consume_from_rabbitmq_thread = rabbitmq.start_rabbitmq_consume_thread(
-            rabbitmq_queue_name=constants.RABBITMQ_REQS_CAND_CORR_QNAME,
-            model_factory=models.Requirement.from_dict,
-            model_queue=requirements_queue,
-            ack_queue=ack_queue,
-            prefetch_count=constants.RABBITMQ_REQS_CAND_CORR_SUB_PREFETCH,
-        )
+            logger.info("Starting RabbitMQ consumer thread")
+            batch_queue: queue.Queue[list[models.Requirement]] = queue.Queue()
+            ack_queue: queue.Queue[bool] = queue.Queue()
 
-        logger.info("Running.")
-        while True:
-            requirement = None
+            consume_from_rabbitmq_thread = rabbitmq.start_rabbitmq_batch_consume_thread(
+                rabbitmq_queue_name=constants.RABBITMQ_REQS_CAND_CORR_QNAME,
+                model_factory=models.Requirement.from_dict,
+                batch_queue=batch_queue,
+                ack_queue=ack_queue,
+                prefetch_count=constants.RABBITMQ_REQS_CAND_CORR_SUB_PREFETCH,
+            )
 
-            try:
-                requirement = requirements_queue.get(timeout=5.0)
-                logger.debug("Correlating candidates for requirement: %s", requirement)
-                await ccs.process_requirement_record(requirement)
-                ack_queue.put(True)
+            logger.info("Running.")
+            while True:
+                requirements = None
+
+                try:
+                    requirements = batch_queue.get(timeout=5.0)
+                    logger.debug("Correlating candidates for %s requirements.", len(requirements))
+                    await _process_requirements(ccs, requirements)
+                    ack_queue.put(True)
+
+                except queue.Empty as ex:
+                    if not consume_from_rabbitmq_thread.is_alive():
+                        logger.error("RabbitMQ consumer thread has died.")
+                        return
 
-            except queue.Empty as ex:
-                if not consume_from_rabbitmq_thread.is_alive():
-                    logger.error("RabbitMQ consumer thread has died.")
-                    return
+                except Exception as ex:
+                    logger.error(
+                        f"Error while handling Requirement messages: {requirements}",
+                        exc_info=ex,
+                    )
+                    ack_queue.put(False)
+                    raise
 
-            except Exception as ex:
-                logger.error(
-                    f"Error while handling Requirement message: {requirement}",
-                    exc_info=ex,
-                )
-                ack_queue.put(False)
-                raise
 
+async def _process_requirements(
+    ccs: candidate_correlation_service.CandidateCorrelationService,
+    requirements: list[models.Requirement],
+):
+    """
+    Correlates a batch of requirements, grouped by dependency, with each dependency's
+    requirements processed in order and up to `CANDIDATE_CORRELATION_CONCURRENCY`
+    dependencies processed concurrently. That keeps the process pool busy, while
+    requirements on the same dependency, which share candidate records, don't race each
+    other.
+    """
+
+    requirements_by_dependency: dict[str, list[models.Requirement]] = {}
+    for requirement in requirements:
+        requirements_by_dependency.setdefault(requirement.dependency_name, []).append(
+            requirement
+        )
+
+    # Each dependency holds a connection while it's processed.
+    semaphore = asyncio.Semaphore(constants.CANDIDATE_CORRELATION_CONCURRENCY)
+
+    async def _process_dependency(dependency_requirements: list[models.Requirement]):
+        async with semaphore:
+            for requirement in dependency_requirements:
+                await ccs.process_requirement_record(requirement)
+
+    await asyncio.gather(*(
+        _process_dependency(dependency_requirements)
+        for dependency_requirements in requirements_by_dependency.values()
+    ))
 
 if __name__ == "__main__":
     common.initialize_logger()
@@ -9,6 +9,7 @@ from pipdepgraph.repositories import (
     distributions_repository,
     package_names_repository,
     requirements_repository,
+    reverse_dependencies_repository,
 )
 
 from pipdepgraph.services import (
@@ -22,13 +23,14 @@ logger = logging.getLogger("pipdepgraph.entrypoints.rmq_sub.distribution_process
 async def main():
     logger.info("Initializing DB pool")
     async with (
-        common.initialize_async_connection_pool() as db_pool,
+        common.initialize_async_connection_pool(profile="crawler") as db_pool,
         common.initialize_client_session() as session,
     ):
         logger.info("Initializing repositories")
         pnr = package_names_repository.PackageNamesRepository(db_pool)
         dr = distributions_repository.DistributionsRepository(db_pool)
         rr = requirements_repository.RequirementsRepository(db_pool)
+        rdr = reverse_dependencies_repository.ReverseDependenciesRepository(db_pool)
 
         logger.info("Initializing pypi_api.PypiApi")
         pypi = pypi_api.PypiApi(session)
@@ -48,6 +50,7 @@ async def main():
             pypi=pypi,
             db_pool=db_pool,
             rmq_pub=rmq_pub,
+            rdr=rdr,
         )
 
         logger.info("Starting RabbitMQ consumer thread")
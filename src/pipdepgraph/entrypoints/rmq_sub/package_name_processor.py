@@ -32,7 +32,7 @@ logger = logging.getLogger("pipdepgraph.entrypoints.rmq_sub.package_name_process
 async def main():
     logger.info("Initializing DB pool")
     async with (
-        common.initialize_async_connection_pool() as db_pool,
+        common.initialize_async_connection_pool(profile="crawler") as db_pool,
         common.initialize_client_session() as session,
     ):
         logger.info("Initializing repositories")
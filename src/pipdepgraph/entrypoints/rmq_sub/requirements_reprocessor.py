@@ -15,7 +15,7 @@ logger = logging.getLogger("pipdepgraph.entrypoints.rmq_sub.requirements_reproce
 async def main():
     logger.info("Initializing DB pool")
     async with (
-        common.initialize_async_connection_pool() as db_pool,
+        common.initialize_async_connection_pool(profile="subscriber") as db_pool,
         db_pool.connection() as conn,
         conn.cursor() as edit_cursor,
     ):
@@ -42,6 +42,14 @@ async def main():
             try:
                 requirement = requirements_queue.get(timeout=5.0)
 
+                # Only requirements rows are reprocessed. Requirement set members
+                # always have dependency_extras_arr, and are shared between
+                # distributions.
+                if requirement.distribution_id is None:
+                    logger.warning(f"Skipping requirement set member: {requirement}")
+                    ack_queue.put(True)
+                    continue
+
                 if requirement.extras is None:
                     requirement.extras = ""
 
@@ -52,7 +60,8 @@ async def main():
                     )
 
                 logger.info(f"Updating requirement: {requirement}")
-                await rr.update_requirement(requirement, cursor=edit_cursor)
+                if not await rr.update_requirement(requirement, cursor=edit_cursor):
+                    logger.warning(f"No requirements row to update: {requirement}")
                 await edit_cursor.execute("commit;")
 
                 ack_queue.put(True)
@@ -5,7 +5,7 @@ import uuid
 import json
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class PackageName:
     package_name: str
     date_discovered: Optional[datetime.datetime]
@@ -19,6 +19,15 @@ class PackageName:
             date_last_checked=data.get("date_last_checked", None),
         )
 
+    @classmethod
+    def from_row(cls, row: tuple) -> "PackageName":
+        """
+        Builds a package name from a positional row of
+        `(package_name, date_discovered, date_last_checked)`.
+        """
+
+        return cls(*row)
+
     def to_json(self) -> str:
         return json.dumps(
             dict(
@@ -37,7 +46,7 @@ class PackageName:
         )
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Version:
     version_id: str | uuid.UUID | None
     package_name: str
@@ -80,8 +89,22 @@ class Version:
             is_devrelease=data.get("is_devrelease", None),
         )
 
+    @classmethod
+    def from_row(cls, row: tuple) -> "Version":
+        """
+        Builds a version from a positional row of `(version_id, package_name,
+        package_version, date_discovered, epoch, package_release, pre_0, pre_1, post,
+        dev, local, is_prerelease, is_postrelease, is_devrelease)`.
+        """
+
+        return cls(
+            row[0], row[1], row[2], row[3],
+            row[4], row[5], (row[6], row[7]), row[8], row[9], row[10],
+            row[11], row[12], row[13],
+        )
+
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Distribution:
     version_id: Optional[str]
     distribution_id: Optional[str]
@@ -111,6 +134,15 @@ class Distribution:
             metadata_file_size=data.get("metadata_file_size", None),
         )
 
+    @classmethod
+    def from_row(cls, row: tuple) -> "Distribution":
+        """
+        Builds a distribution from a positional row, with columns in the same order
+        as the fields of this class.
+        """
+
+        return cls(*row)
+
     def to_json(self) -> str:
         return json.dumps(
             dict(
@@ -137,10 +169,10 @@ class Distribution:
         )
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Requirement:
     requirement_id: str | None
-    distribution_id: str
+    distribution_id: str | None
     extras: str
     dependency_name: str
     dependency_extras: str
@@ -161,6 +193,15 @@ class Requirement:
             parsable=data.get("parsable", None),
         )
 
+    @classmethod
+    def from_row(cls, row: tuple) -> "Requirement":
+        """
+        Builds a requirement from a positional row, with columns in the same order
+        as the fields of this class.
+        """
+
+        return cls(*row)
+
     def to_json(self) -> str:
         return json.dumps(
             dict(
@@ -169,7 +210,11 @@ class Requirement:
                     if self.requirement_id is not None
                     else None
                 ),
-                distribution_id=str(self.distribution_id),
+                distribution_id=(
+                    str(self.distribution_id)
+                    if self.distribution_id is not None
+                    else None
+                ),
                 extras=self.extras,
                 dependency_name=self.dependency_name,
                 dependency_extras=self.dependency_extras,
@@ -180,7 +225,7 @@ class Requirement:
         )
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
 class Candidate:
     requirement_id: str
     candidate_versions: list[str]
@@ -195,7 +240,66 @@ class Candidate:
         )
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True)
+class ConstraintCandidate:
+    dependency_name: str
+    version_constraint: str
+    candidate_versions: list[str] | None
+    candidate_version_ids: list[str] | None
+    candidate_ranges: list[tuple[int, int]] | None = None
+    """
+    Alternate encoding of the candidates, as half-open ranges of ordinals into the
+    dependency's `VersionOrder`. Set instead of the candidate arrays when
+    `CANDIDATES_ENCODING` is "ranges".
+    """
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConstraintCandidate":
+        return cls(
+            dependency_name=data.get("dependency_name", None),
+            version_constraint=data.get("version_constraint", None),
+            candidate_versions=data.get("candidate_versions", None),
+            candidate_version_ids=data.get("candidate_version_ids", None),
+            candidate_ranges=data.get("candidate_ranges", None),
+        )
+
+
+@dataclasses.dataclass(slots=True)
+class VersionOrder:
+    """
+    An append-only ordering of a package's versions. A version's ordinal is its
+    index in these arrays, and never changes once assigned.
+    """
+
+    package_name: str
+    version_ids: list[str]
+    package_versions: list[str]
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "VersionOrder":
+        return cls(
+            package_name=data.get("package_name", None),
+            version_ids=data.get("version_ids", None),
+            package_versions=data.get("package_versions", None),
+        )
+
+
+@dataclasses.dataclass(slots=True)
+class ReverseDependency:
+    dependency_name: str
+    dependent_package_name: str
+    dependent_version_id: str
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ReverseDependency":
+        return cls(
+            dependency_name=data.get("dependency_name", None),
+            dependent_package_name=data.get("dependent_package_name", None),
+            dependent_version_id=data.get("dependent_version_id", None),
+        )
+
+
+@dataclasses.dataclass(slots=True)
 class EventLogEntry:
     event_id: int
     operation: Literal["INSERT", "UPDATE", "DELETE"]
@@ -217,19 +321,20 @@ class EventLogEntry:
             timestamp=data.get("timestamp", None),
         )
 
-    def to_json(self) -> str:
-        return json.dumps(
-            dict(
-                event_id=self.event_id,
-                operation=self.operation,
-                schema=self.schema,
-                table=self.table,
-                before=self.before,
-                after=self.after,
-                timestamp=(
-                    None
-                    if self.timestamp is None
-                    else self.timestamp.isoformat("T")
-                )
+    def to_dict(self) -> dict:
+        return dict(
+            event_id=self.event_id,
+            operation=self.operation,
+            schema=self.schema,
+            table=self.table,
+            before=self.before,
+            after=self.after,
+            timestamp=(
+                None
+                if self.timestamp is None
+                else self.timestamp.isoformat("T")
             )
         )
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
@@ -0,0 +1,173 @@
+from typing import AsyncIterable, Awaitable, Callable, Sequence
+import time
+import weakref
+
+from psycopg import AsyncConnection, AsyncCursor, AsyncServerCursor, pq
+
+from pipdepgraph import constants
+from pipdepgraph.repositories import instrumentation
+
+
+class AdaptiveBatchSize:
+    """
+    Steers a batch size toward the number of records that can be written or fetched in
+    `target_seconds`, based on how long previous batches took.
+
+    Each batch's throughput (records per second) gives an estimate of the ideal size.
+    The size moves halfway toward that estimate after every batch, and grows at most 2x
+    per batch. A batch that overruns the target by more than 2x at least halves the size,
+    whatever slowed it down. Lock waits aren't measured separately, they only show up as
+    slower batches. Sizes are kept within `[min_size, max_size]`.
+
+    A controller should only be used for one kind of write or scan, and by one caller at
+    a time, so that the batches it measures are all alike. Writers keep one per
+    connection with `PerConnection`, so that what's learned carries over between calls.
+    Writers bind each column as a single array, so that the statement text is the same
+    for every batch size, and is prepared once per connection.
+    """
+
+    def __init__(
+        self,
+        *,
+        initial_size: int,
+        target_seconds: float,
+        min_size: int,
+        max_size: int,
+    ):
+        self.target_seconds = target_seconds
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self._size = self._clamp(initial_size)
+
+    @classmethod
+    def for_writes(cls) -> "AdaptiveBatchSize":
+        return cls(
+            initial_size=constants.WRITE_BATCH_INITIAL_SIZE,
+            target_seconds=constants.WRITE_BATCH_TARGET_SECONDS,
+            min_size=constants.WRITE_BATCH_MIN_SIZE,
+            max_size=constants.WRITE_BATCH_MAX_SIZE,
+        )
+
+    @classmethod
+    def for_fetches(cls, max_size: int) -> "AdaptiveBatchSize":
+        """
+        `max_size` is one of the `*_REPO_ITER_BATCH_SIZE` settings, which bounds how
+        many records are held in memory at once. Fetching starts at that size.
+        """
+
+        return cls(
+            initial_size=max_size,
+            target_seconds=constants.FETCH_BATCH_TARGET_SECONDS,
+            min_size=constants.FETCH_BATCH_MIN_SIZE,
+            max_size=max_size,
+        )
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _clamp(self, size: float) -> int:
+        return max(self.min_size, min(self.max_size, int(size)))
+
+    def observe(self, batch_size: int, seconds: float):
+        """
+        Adjusts the batch size after a batch of `batch_size` records took `seconds`.
+        """
+
+        if batch_size <= 0:
+            return
+
+        if seconds <= 0:
+            self._size = self._clamp(self._size * 2)
+            return
+
+        ideal_size = batch_size / seconds * self.target_seconds
+
+        if seconds > 2 * self.target_seconds:
+            self._size = self._clamp(min(ideal_size, self._size / 2))
+        else:
+            ideal_size = min(ideal_size, self._size * 2)
+            self._size = self._clamp((self._size + ideal_size) / 2)
+
+    async def write_batches[T, R](
+        self,
+        records: Sequence[T],
+        cursor: AsyncCursor,
+        write_batch: Callable[[AsyncCursor, Sequence[T]], Awaitable[list[R] | None]],
+        commit: bool = False,
+    ) -> list[R]:
+        """
+        Writes `records` with `write_batch`, in consecutive batches sized by how long the
+        previous batches took. Only the awaited `write_batch` call is timed. Returns the
+        concatenated results of `write_batch`.
+
+        If `commit` is set, each batch is committed separately, so that the locks on its
+        rows are released before the next batch is written.
+
+        Statements sent in pipeline mode don't wait for the server, so batches written
+        while `cursor`'s connection is in a pipeline aren't measured.
+        """
+
+        results: list[R] = []
+        start = 0
+        while start < len(records):
+            batch = records[start : start + self._size]
+            start += len(batch)
+            instrumentation.record_batch_size(len(batch))
+
+            timed = cursor.connection.pgconn.pipeline_status == pq.PipelineStatus.OFF
+            started = time.perf_counter()
+            batch_results = await write_batch(cursor, batch)
+            if timed:
+                self.observe(len(batch), time.perf_counter() - started)
+
+            if batch_results:
+                results += batch_results
+            if commit:
+                await cursor.execute("commit;")
+
+        return results
+
+    async def fetch(self, cursor: AsyncCursor) -> AsyncIterable[list]:
+        """
+        Fetches the remaining results of `cursor` in batches, using `fetchmany`. Only
+        the time spent fetching is measured, and not the time the caller spends on each
+        batch.
+
+        Only server-side cursors are tuned. A client-side cursor already holds every
+        result, so its batches are always `max_size`.
+        """
+
+        if not isinstance(cursor, AsyncServerCursor):
+            while records := await cursor.fetchmany(size=self.max_size):
+                yield records
+            return
+
+        while True:
+            started = time.perf_counter()
+            records = await cursor.fetchmany(size=self._size)
+            if not records:
+                return
+
+            self.observe(len(records), time.perf_counter() - started)
+            yield records
+
+
+class PerConnection:
+    """
+    One `AdaptiveBatchSize` per connection, created by `factory` on first use. A
+    connection is only used by one caller at a time, so neither is its controller.
+    Controllers are dropped along with their connection.
+    """
+
+    def __init__(self, factory: Callable[[], AdaptiveBatchSize]):
+        self.factory = factory
+        self._controllers: weakref.WeakKeyDictionary[AsyncConnection, AdaptiveBatchSize] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def get(self, connection: AsyncConnection) -> AdaptiveBatchSize:
+        controller = self._controllers.get(connection)
+        if controller is None:
+            controller = self._controllers[connection] = self.factory()
+        return controller
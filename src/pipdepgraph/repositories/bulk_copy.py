@@ -0,0 +1,56 @@
+from typing import Iterable, Sequence
+
+from psycopg import AsyncCursor, pq
+
+from pipdepgraph import constants
+
+
+def should_copy(records: Sequence, cursor: AsyncCursor) -> bool:
+    """
+    Returns whether a batch of records is large enough to be loaded using
+    `copy_into_temp_table`, rather than with multi-row "insert ... values" statements.
+    COPY can't be used in pipeline mode, so batches written by `cursor` are never
+    copied while its connection is in a pipeline.
+    """
+
+    return (
+        cursor.connection.pgconn.pipeline_status == pq.PipelineStatus.OFF
+        and constants.POSTGRES_COPY_THRESHOLD > 0
+        and len(records) >= constants.POSTGRES_COPY_THRESHOLD
+    )
+
+
+async def copy_into_temp_table(
+    cursor: AsyncCursor,
+    temp_table_name: str,
+    columns: list[tuple[str, str]],
+    rows: Iterable[Sequence],
+) -> None:
+    """
+    Creates a temporary table named `temp_table_name` with the `(name, type)`
+    `columns`, and streams `rows` into it using COPY. The table is dropped on commit,
+    so callers are expected to merge it into the target table within the same
+    transaction, using "insert into ... select ... from temp_table_name".
+
+    Unlike multi-row "insert ... values" statements, COPY has no parameter limit, and
+    doesn't need to be parsed or planned per batch.
+    """
+
+    await cursor.execute(f"drop table if exists pg_temp.{temp_table_name};")
+    await cursor.execute(
+        f"""
+        create temporary table {temp_table_name} (
+            {", ".join(f"{name} {type_name}" for name, type_name in columns)}
+        ) on commit drop
+        ;"""
+    )
+
+    query = f"""
+    copy {temp_table_name} ({", ".join(name for name, _ in columns)})
+    from stdin
+    """
+
+    async with cursor.copy(query) as copy:
+        copy.set_types([type_name for _, type_name in columns])
+        for row in rows:
+            await copy.write_row(row)
@@ -5,15 +5,98 @@ import dataclasses
 from psycopg_pool import AsyncConnectionPool
 from psycopg import AsyncCursor
 from psycopg.rows import dict_row
+from psycopg.types.multirange import Multirange
+from psycopg.types.range import Range
 
 from pipdepgraph import models, constants
-from pipdepgraph.repositories import table_names
+from pipdepgraph.core import matching
+from pipdepgraph.repositories import table_names, instrumentation
+
+
+def format_pg_multirange(ranges: list[tuple[int, int]] | None) -> Multirange | None:
+    """
+    Converts a list of half-open `(lower, upper)` ranges into a postgres multirange.
+    """
+
+    if ranges is None:
+        return None
+
+    return Multirange([Range(lower, upper, "[)") for lower, upper in ranges])
+
+
+def parse_pg_multirange(multirange: Multirange | None) -> list[tuple[int, int]] | None:
+    """
+    Converts a postgres int4multirange into a list of half-open `(lower, upper)` ranges.
+    """
+
+    if multirange is None:
+        return None
+
+    return [(r.lower, r.upper) for r in multirange if not r.isempty]
+
+
+def decode_candidate_ranges(
+    candidate_ranges: list[tuple[int, int]],
+    version_order: models.VersionOrder,
+) -> tuple[list[str], list[str]]:
+    """
+    Decodes a range-encoded candidate list back into candidate version strings and
+    version IDs, ordered newest first, matching the "arrays" encoding.
+    """
+
+    ordinals = [
+        ordinal
+        for ordinal in matching.ranges_to_indexes(candidate_ranges)
+        if ordinal < len(version_order.version_ids)
+    ]
+
+    package_versions = [version_order.package_versions[ordinal] for ordinal in ordinals]
+    sorted_indexes = matching.sort_package_versions(package_versions)[::-1]
+
+    return (
+        [package_versions[i] for i in sorted_indexes],
+        [version_order.version_ids[ordinals[i]] for i in sorted_indexes],
+    )
 
 
 class CandidatesRepository:
     def __init__(self, db_pool: AsyncConnectionPool):
         self.db_pool = db_pool
 
+    @instrumentation.named_query
+    async def lock_dependency(self, dependency_name: str, cursor: AsyncCursor):
+        """
+        Takes a transaction-level advisory lock on the candidate records of
+        `dependency_name`, so that candidates on it are read, matched and written by
+        one transaction at a time. Waits for any rebuild holding `lock_for_rebuild`.
+        """
+
+        await cursor.execute(
+            """
+            select
+                pg_advisory_xact_lock_shared(hashtextextended(%s, 0)),
+                pg_advisory_xact_lock(hashtextextended(%s, 0))
+            ;""",
+            [
+                f"{table_names.CONSTRAINT_CANDIDATES}:rebuild",
+                f"{table_names.CONSTRAINT_CANDIDATES}:{dependency_name}",
+            ],
+        )
+
+    @instrumentation.named_query
+    async def lock_for_rebuild(self, cursor: AsyncCursor):
+        """
+        Takes a transaction-level advisory lock that keeps every `lock_dependency`
+        caller, and so every write to the candidate records, waiting until the
+        transaction ends.
+        """
+
+        await cursor.execute(
+            "select pg_advisory_xact_lock(hashtextextended(%s, 0));",
+            [f"{table_names.CONSTRAINT_CANDIDATES}:rebuild"],
+        )
+
+    @instrumentation.named_query
     async def insert_candidate(
         self,
         candidate: models.Candidate,
@@ -44,3 +127,424 @@ class CandidatesRepository:
             async with self.db_pool.connection() as conn, conn.cursor() as cursor:
                 await _insert_candidate(cursor)
                 await cursor.execute("commit;")
+
+    @instrumentation.named_query
+    async def get_constraint_candidate(
+        self,
+        *,
+        dependency_name: str,
+        version_constraint: str,
+        decode_ranges: bool = True,
+        cursor: AsyncCursor | None = None,
+    ) -> models.ConstraintCandidate | None:
+        """
+        Retrieves the shared candidate record for a `(dependency_name, version_constraint)`
+        pair, if that pair has been correlated.
+
+        If `decode_ranges` is specified and the record is range-encoded, the candidate
+        arrays are decoded from the dependency's version order.
+        """
+
+        async def _get_constraint_candidate(cursor: AsyncCursor) -> models.ConstraintCandidate | None:
+            query = f"""
+            select
+                cc.dependency_name,
+                cc.version_constraint,
+                cc.candidate_versions,
+                cc.candidate_version_ids,
+                cc.candidate_ranges,
+                vo.version_ids,
+                vo.package_versions
+            from {table_names.CONSTRAINT_CANDIDATES} cc
+            left join {table_names.VERSION_ORDERS} vo
+                on vo.package_name = cc.dependency_name
+                and cc.candidate_ranges is not null
+            where
+                cc.dependency_name = %s
+                and cc.version_constraint = %s
+            ;"""
+
+            await cursor.execute(query, [dependency_name, version_constraint])
+            results = await cursor.fetchall()
+            if not results:
+                return None
+
+            record = results[0]
+            constraint_candidate = models.ConstraintCandidate.from_dict(record)
+            constraint_candidate.candidate_ranges = parse_pg_multirange(record["candidate_ranges"])
+
+            if (
+                decode_ranges
+                and constraint_candidate.candidate_ranges is not None
+                and record["version_ids"] is not None
+            ):
+                (
+                    constraint_candidate.candidate_versions,
+                    constraint_candidate.candidate_version_ids,
+                ) = decode_candidate_ranges(
+                    constraint_candidate.candidate_ranges,
+                    models.VersionOrder(
+                        package_name=dependency_name,
+                        version_ids=record["version_ids"],
+                        package_versions=record["package_versions"],
+                    ),
+                )
+
+            return constraint_candidate
+
+        if cursor:
+            return await _get_constraint_candidate(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor(
+                row_factory=dict_row
+            ) as cursor:
+                return await _get_constraint_candidate(cursor)
+
+    @instrumentation.named_query
+    async def upsert_constraint_candidates(
+        self,
+        constraint_candidates: list[models.ConstraintCandidate],
+        overwrite: bool = True,
+        cursor: AsyncCursor | None = None,
+    ):
+        """
+        Inserts shared candidate records into the database, keyed by
+        `(dependency_name, version_constraint)`. If `overwrite` is specified, existing
+        records are updated on PK conflict, otherwise existing records are left as-is.
+        """
+
+        instrumentation.record_batch_size(len(constraint_candidates))
+
+        if not constraint_candidates:
+            return
+
+        async def _upsert_constraint_candidates(cursor: AsyncCursor):
+            query = f"""
+            insert into {table_names.CONSTRAINT_CANDIDATES}
+            (dependency_name, version_constraint, candidate_versions, candidate_version_ids, candidate_ranges)
+            values (%s, %s, %s, %s, %s)
+            """
+
+            if overwrite:
+                query += """
+                on conflict (dependency_name, version_constraint) do update set
+                    candidate_versions = EXCLUDED.candidate_versions,
+                    candidate_version_ids = EXCLUDED.candidate_version_ids,
+                    candidate_ranges = EXCLUDED.candidate_ranges,
+                    date_last_correlated = now()
+                ;"""
+            else:
+                query += " on conflict do nothing; "
+
+            params_seq = [
+                (
+                    cc.dependency_name,
+                    cc.version_constraint,
+                    cc.candidate_versions,
+                    cc.candidate_version_ids,
+                    format_pg_multirange(cc.candidate_ranges),
+                )
+                for cc in constraint_candidates
+            ]
+
+            await cursor.executemany(query, params_seq)
+
+        if cursor:
+            await _upsert_constraint_candidates(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                await _upsert_constraint_candidates(cursor)
+                await cursor.execute("commit;")
+
+    @instrumentation.named_query
+    async def prepend_candidate_version(
+        self,
+        *,
+        dependency_name: str,
+        version_constraints: list[str],
+        version: models.Version,
+        cursor: AsyncCursor | None = None,
+    ) -> list[str]:
+        """
+        Prepends a single version to the candidate arrays of every shared candidate
+        record on `dependency_name` whose version constraint is one of
+        `version_constraints`. Candidate arrays are sorted newest-first, so this is
+        only correct when `version` is newer than every version already in those
+        arrays. Records which already list the version are left untouched.
+
+        Range-encoded records are left untouched too, and their version constraints
+        are returned, so that they can be recomputed in the current encoding.
+        """
+
+        if not version_constraints:
+            return []
+
+        async def _prepend_candidate_version(cursor: AsyncCursor) -> list[str]:
+            query = f"""
+            update {table_names.CONSTRAINT_CANDIDATES} cc set
+                candidate_versions = array_prepend(%s::text, cc.candidate_versions),
+                candidate_version_ids = array_prepend(%s::uuid, cc.candidate_version_ids),
+                date_last_correlated = now()
+            where
+                cc.dependency_name = %s
+                and cc.version_constraint = any(%s)
+                and cc.candidate_ranges is null
+                and not (%s::uuid = any(cc.candidate_version_ids))
+            ;"""
+
+            params = [
+                version.package_version,
+                version.version_id,
+                dependency_name,
+                version_constraints,
+                version.version_id,
+            ]
+
+            await cursor.execute(query, params)
+
+            query = f"""
+            select cc.version_constraint
+            from {table_names.CONSTRAINT_CANDIDATES} cc
+            where
+                cc.dependency_name = %s
+                and cc.version_constraint = any(%s)
+                and cc.candidate_ranges is not null
+            ;"""
+
+            await cursor.execute(query, [dependency_name, version_constraints])
+            return [row[0] for row in await cursor.fetchall()]
+
+        if cursor:
+            return await _prepend_candidate_version(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                result = await _prepend_candidate_version(cursor)
+                await cursor.execute("commit;")
+                return result
+
+    @instrumentation.named_query
+    async def add_candidate_ordinal(
+        self,
+        *,
+        dependency_name: str,
+        version_constraints: list[str],
+        ordinal: int,
+        cursor: AsyncCursor | None = None,
+    ) -> list[str]:
+        """
+        Adds a single version ordinal to the range-encoded candidates of every shared
+        candidate record on `dependency_name` whose version constraint is one of
+        `version_constraints`. The range-encoded counterpart to `prepend_candidate_version`.
+
+        Array-encoded records are left untouched, and their version constraints are
+        returned, so that they can be recomputed in the current encoding.
+        """
+
+        if not version_constraints:
+            return []
+
+        async def _add_candidate_ordinal(cursor: AsyncCursor) -> list[str]:
+            query = f"""
+            update {table_names.CONSTRAINT_CANDIDATES} cc set
+                candidate_ranges = cc.candidate_ranges + int4multirange(int4range(%s, %s)),
+                date_last_correlated = now()
+            where
+                cc.dependency_name = %s
+                and cc.version_constraint = any(%s)
+                and cc.candidate_ranges is not null
+                and not (cc.candidate_ranges @> %s::int4)
+            ;"""
+
+            params = [ordinal, ordinal + 1, dependency_name, version_constraints, ordinal]
+            await cursor.execute(query, params)
+
+            query = f"""
+            select cc.version_constraint
+            from {table_names.CONSTRAINT_CANDIDATES} cc
+            where
+                cc.dependency_name = %s
+                and cc.version_constraint = any(%s)
+                and cc.candidate_ranges is null
+            ;"""
+
+            await cursor.execute(query, [dependency_name, version_constraints])
+            return [row[0] for row in await cursor.fetchall()]
+
+        if cursor:
+            return await _add_candidate_ordinal(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                result = await _add_candidate_ordinal(cursor)
+                await cursor.execute("commit;")
+                return result
+
+    @instrumentation.named_query
+    async def sync_version_order(
+        self,
+        package_name: str,
+        versions: list[models.Version],
+        cursor: AsyncCursor | None = None,
+    ) -> models.VersionOrder:
+        """
+        Returns the version order of the specified package, first appending any of the
+        `versions` that it's missing. Missing versions are sorted oldest to newest
+        among themselves before being appended. Existing ordinals are never changed.
+        The version order record is locked until the end of the transaction.
+        """
+
+        async def _sync_version_order(cursor: AsyncCursor) -> models.VersionOrder:
+            query = f"""
+            insert into {table_names.VERSION_ORDERS}
+            (package_name, version_ids, package_versions)
+            values (%s, '{{}}', '{{}}')
+            on conflict do nothing
+            ;"""
+            await cursor.execute(query, [package_name])
+
+            query = f"""
+            select vo.package_name, vo.version_ids, vo.package_versions
+            from {table_names.VERSION_ORDERS} vo
+            where vo.package_name = %s
+            for update
+            ;"""
+            await cursor.execute(query, [package_name])
+            version_order = models.VersionOrder.from_dict((await cursor.fetchall())[0])
+
+            known_version_ids = {str(version_id) for version_id in version_order.version_ids}
+            missing_versions = [
+                version
+                for version in versions
+                if str(version.version_id) not in known_version_ids
+            ]
+
+            if not missing_versions:
+                return version_order
+
+            missing_versions = [
+                missing_versions[i]
+                for i in matching.sort_package_versions(
+                    [version.package_version for version in missing_versions]
+                )
+            ]
+
+            version_ids = [version.version_id for version in missing_versions]
+            package_versions = [version.package_version for version in missing_versions]
+
+            query = f"""
+            update {table_names.VERSION_ORDERS} set
+                version_ids = version_ids || %s::uuid[],
+                package_versions = package_versions || %s::text[]
+            where package_name = %s
+            ;"""
+            await cursor.execute(query, [version_ids, package_versions, package_name])
+
+            version_order.version_ids.extend(version_ids)
+            version_order.package_versions.extend(package_versions)
+            return version_order
+
+        if cursor:
+            return await _sync_version_order(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor(
+                row_factory=dict_row
+            ) as cursor:
+                result = await _sync_version_order(cursor)
+                await cursor.execute("commit;")
+                return result
+
+    @instrumentation.named_query
+    async def create_constraint_candidates_staging(self, cursor: AsyncCursor):
+        """
+        (Re)creates an empty, unindexed staging copy of the `constraint_candidates`
+        table, to be bulk loaded with `copy_constraint_candidates` and then swapped
+        in with `swap_constraint_candidates_staging`.
+        """
+
+        await cursor.execute(f"drop table if exists {table_names.CONSTRAINT_CANDIDATES_STAGING};")
+        await cursor.execute(
+            f"""
+            create table {table_names.CONSTRAINT_CANDIDATES_STAGING}
+            (like {table_names.CONSTRAINT_CANDIDATES} including defaults)
+            ;"""
+        )
+
+    @instrumentation.named_query
+    async def copy_constraint_candidates(
+        self,
+        constraint_candidates: AsyncIterable[models.ConstraintCandidate],
+        cursor: AsyncCursor,
+    ) -> int:
+        """
+        Streams shared candidate records into the staging table using COPY.
+        Returns the number of records written.
+        """
+
+        query = f"""
+        copy {table_names.CONSTRAINT_CANDIDATES_STAGING}
+        (dependency_name, version_constraint, candidate_versions, candidate_version_ids, candidate_ranges)
+        from stdin
+        """
+
+        num_records = 0
+        async with cursor.copy(query) as copy:
+            copy.set_types(["text", "text", "text[]", "uuid[]", "int4multirange"])
+            async for cc in constraint_candidates:
+                await copy.write_row((
+                    cc.dependency_name,
+                    cc.version_constraint,
+                    cc.candidate_versions,
+                    cc.candidate_version_ids,
+                    format_pg_multirange(cc.candidate_ranges),
+                ))
+                num_records += 1
+
+        return num_records
+
+    @instrumentation.named_query
+    async def swap_constraint_candidates_staging(self, cursor: AsyncCursor):
+        """
+        Indexes the staging table, and atomically swaps it in place of the
+        `constraint_candidates` table, dropping the old table. Must be followed by a
+        commit. The `requirement_candidates` view is rebuilt on top of the new table.
+
+        The staging table is created without the old table's grants, so they're copied
+        over before the old table is dropped.
+        """
+
+        await cursor.execute(
+            f"""
+            alter table {table_names.CONSTRAINT_CANDIDATES_STAGING}
+            add primary key (dependency_name, version_constraint)
+            ;"""
+        )
+
+        await cursor.execute(f"lock table {table_names.CONSTRAINT_CANDIDATES} in access exclusive mode;")
+        await cursor.execute(f"alter table {table_names.CONSTRAINT_CANDIDATES} rename to constraint_candidates_old;")
+        await cursor.execute(f"alter table {table_names.CONSTRAINT_CANDIDATES_STAGING} rename to constraint_candidates;")
+        await cursor.execute("select pypi_packages.create_requirement_candidates_view();")
+        await cursor.execute(
+            f"""
+            do $body$
+            declare
+                grant_statement text;
+            begin
+                for grant_statement in
+                    select format(
+                        'grant %s on {table_names.CONSTRAINT_CANDIDATES} to %s%s;',
+                        a.privilege_type,
+                        case when a.grantee = 0 then 'public' else quote_ident(pg_get_userbyid(a.grantee)) end,
+                        case when a.is_grantable then ' with grant option' else '' end
+                    )
+                    from pg_class c, aclexplode(c.relacl) a
+                    where c.oid = 'pypi_packages.constraint_candidates_old'::regclass
+                loop
+                    execute grant_statement;
+                end loop;
+            end;
+            $body$
+            ;"""
+        )
+        await cursor.execute("drop table pypi_packages.constraint_candidates_old;")
+        await cursor.execute(
+            "alter index pypi_packages.constraint_candidates_staging_pkey rename to constraint_candidates_pkey;"
+        )
@@ -1,34 +1,227 @@
-from typing import AsyncIterable
+from typing import AsyncIterable, AsyncIterator
+import asyncio
+import contextlib
+import dataclasses
+import hashlib
+import logging
+import zlib
 
 from psycopg_pool import AsyncConnectionPool
-from psycopg import AsyncCursor
+from psycopg import AsyncConnection, AsyncCursor, sql
+import psycopg.errors
 from psycopg.rows import dict_row
 
 from pipdepgraph import models, constants
-from pipdepgraph.repositories import table_names
+from pipdepgraph.core import compaction, logical_decoding
+from pipdepgraph.repositories import table_names, instrumentation
+
+logger = logging.getLogger("pipdepgraph.repositories.cdc_repository")
+
+
+class EventLogListener:
+    """
+    Waits for notifications that events were written to the event log, on a connection
+    that is listening on `CDC_NOTIFY_CHANNEL`. Created by `CdcRepository.listen`.
+    """
+
+    def __init__(self, conn: AsyncConnection):
+        self.conn = conn
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Waits up to `timeout` seconds for a notification. Once one arrives, keeps
+        consuming notifications for `CDC_PUBLISHER_COALESCE_SECONDS`, so that a burst of
+        transactions only wakes the caller once. The coalescing window isn't extended by
+        further notifications, so a steady stream of them can't delay the caller
+        indefinitely.
+
+        Returns whether any notification arrived.
+        """
+
+        notified = False
+        async for _ in self.conn.notifies(timeout=timeout, stop_after=1):
+            notified = True
+
+        if not notified:
+            return False
+
+        # The timeout is a deadline for the whole generator, not for each notification.
+        async for _ in self.conn.notifies(timeout=constants.CDC_PUBLISHER_COALESCE_SECONDS):
+            pass
+
+        return True
+
+
+@dataclasses.dataclass(frozen=True)
+class CdcStream:
+    """
+    The share of CDC events published by one of several publishers: the events for
+    `tables` (every table if empty) whose partition key, as configured by
+    `CDC_PARTITION_KEYS`, hashes to partition `partition_index` of `partition_count`. All of a row's events
+    belong to the same stream, so each stream keeps the order of its rows' changes, and
+    is published with its own offset.
+    """
+
+    tables: tuple[str, ...] = ()
+    partition_index: int = 0
+    partition_count: int = 1
+
+    def __post_init__(self):
+        if not 0 <= self.partition_index < self.partition_count:
+            raise ValueError(
+                f"CDC partition index {self.partition_index} is out of range for "
+                f"{self.partition_count} partitions"
+            )
+
+    @classmethod
+    def from_constants(cls) -> "CdcStream":
+        return cls(
+            tables=tuple(sorted(constants.CDC_PUBLISHER_TABLES)),
+            partition_index=constants.CDC_PUBLISHER_PARTITION_INDEX,
+            partition_count=constants.CDC_PUBLISHER_PARTITION_COUNT,
+        )
+
+    @property
+    def is_whole_log(self) -> bool:
+        return not self.tables and self.partition_count == 1
+
+    @property
+    def offset_name(self) -> str:
+        """
+        The stream's key in `cdc.offsets`. The whole event log keeps the event log's key.
+        """
+
+        name = table_names.CDC_EVENT_LOG
+        if self.tables:
+            name += f":{','.join(self.tables)}"
+        if self.partition_count > 1:
+            name += f":{self.partition_index}/{self.partition_count}"
+        return name
+
+    @property
+    def replication_slot(self) -> str:
+        """
+        The stream's logical replication slot. Slot names are limited to 63 characters,
+        so streams other than the whole log get a suffix derived from their offset name.
+        """
+
+        if self.is_whole_log:
+            return constants.CDC_REPLICATION_SLOT
+
+        digest = hashlib.sha1(self.offset_name.encode()).hexdigest()[:12]
+        return f"{constants.CDC_REPLICATION_SLOT}_{digest}"
+
+    def includes(self, event: models.EventLogEntry) -> bool:
+        if self.tables and f"{event.schema}.{event.table}" not in self.tables:
+            return False
+
+        if self.partition_count == 1:
+            return True
+
+        key = compaction.row_key(event, constants.CDC_PARTITION_KEYS)
+        if key is None:
+            key = event.event_id
+
+        return zlib.crc32(repr(key).encode()) % self.partition_count == self.partition_index
+
+    def event_log_filter(self) -> sql.Composable:
+        """
+        Conditions on the event log, aliased as `el`, that select the stream's events,
+        each starting with "and". Hashes partition keys in SQL, so the partitions don't match
+        those of `includes`.
+        """
+
+        conditions = []
+        table = sql.SQL("el.schema || '.' || el.table")
+
+        if self.tables:
+            conditions.append(
+                sql.SQL("{} = any({})").format(table, sql.Literal(list(self.tables)))
+            )
+
+        if self.partition_count > 1:
+            row = sql.SQL("coalesce(el.after, el.before)")
+            row_keys = [
+                sql.SQL("when {} then concat_ws('/', {})").format(
+                    sql.Literal(table_name),
+                    sql.SQL(", ").join(
+                        sql.SQL("{} ->> {}").format(row, sql.Literal(column))
+                        for column in columns
+                    ),
+                )
+                for table_name, columns in constants.CDC_PARTITION_KEYS.items()
+                if columns
+            ]
+            row_key = sql.SQL("case {} {} else el.event_id::text end").format(
+                table, sql.SQL(" ").join(row_keys)
+            )
+            # Masking off the sign bit keeps the hash non-negative.
+            conditions.append(
+                sql.SQL("mod(hashtextextended({}, 0) & {}, {}) = {}").format(
+                    row_key,
+                    sql.Literal(2**63 - 1),
+                    sql.Literal(self.partition_count),
+                    sql.Literal(self.partition_index),
+                )
+            )
+
+        return sql.SQL("").join(sql.SQL(" and ") + condition for condition in conditions)
 
 
 class CdcRepository:
     def __init__(self, db_pool: AsyncConnectionPool):
         self.db_pool = db_pool
 
+    @contextlib.asynccontextmanager
+    async def listen(self) -> AsyncIterator[EventLogListener]:
+        """
+        Holds a connection listening for notifications that events were written to the
+        event log, sent by the "cdc_event_log_notify" trigger.
+
+        Notifications are only delivered to a connection that is listening when the
+        writing transaction commits, so the listener should be entered before the event
+        log is first drained.
+        """
+
+        channel = sql.Identifier(constants.CDC_NOTIFY_CHANNEL)
+        async with self.db_pool.connection() as conn:
+            await conn.set_autocommit(True)
+            try:
+                await conn.execute(sql.SQL("listen {};").format(channel))
+                yield EventLogListener(conn)
+            finally:
+                if not conn.closed:
+                    await conn.execute("unlisten *;")
+                    await conn.set_autocommit(False)
+
+
+    @instrumentation.named_query
+    async def get_event_log_offset(self, stream: CdcStream = CdcStream()) -> int:
+        """
+        Returns the id of the last event of `stream` that was published. A stream
+        without an offset yet starts from the whole event log's offset, so that
+        splitting the event log into streams doesn't publish it all over again.
+        """
 
-    async def get_event_log_offset(self) -> int:
         async with self.db_pool.connection() as conn, conn.cursor(
             row_factory=dict_row, name='iter_event_log'
         ) as cursor:
 
             query = f"select o.event_id event_id from {table_names.CDC_OFFSETS} o where o.table = %s;"
-            params = [table_names.CDC_EVENT_LOG]
+            params = [stream.offset_name]
             await cursor.execute(query, params)
             result = await cursor.fetchall()
 
             if len(result) > 1:
-                raise ValueError(f"{table_names.CDC_OFFSETS} has more than one entry for table {table_names.CDC_EVENT_LOG}")
+                raise ValueError(f"{table_names.CDC_OFFSETS} has more than one entry for table {stream.offset_name}")
 
             elif len(result) == 1:
                 event_id_offset = result[0]["event_id"]
 
+            elif not stream.is_whole_log:
+                event_id_offset = await self.get_event_log_offset()
+                await self.upsert_offset(stream.offset_name, event_id_offset)
+
             else:
                 await self.upsert_offset(table_names.CDC_EVENT_LOG, -1)
                 event_id_offset = -1
@@ -36,16 +229,18 @@ class CdcRepository:
             return event_id_offset
 
 
+    @instrumentation.named_query
     async def iter_event_log(
         self,
         auto_upsert_offset: bool = True,
+        stream: CdcStream = CdcStream(),
     ) -> AsyncIterable[models.EventLogEntry]:
         async with self.db_pool.connection() as conn, conn.cursor(
             row_factory=dict_row, name='iter_event_log'
         ) as cursor:
-            event_id_offset = await self.get_event_log_offset()
+            event_id_offset = await self.get_event_log_offset(stream)
 
-            query = f"""
+            query = sql.SQL(f"""
             select
                 el.event_id,
                 el.operation,
@@ -55,10 +250,10 @@ class CdcRepository:
                 el.after,
                 el.timestamp
             from {table_names.CDC_EVENT_LOG} el
-            where el.event_id > %s
+            where el.event_id > %s {{stream_filter}}
             order by el.event_id asc
             limit %s
-            ;"""
+            ;""").format(stream_filter=stream.event_log_filter())
 
             params = [event_id_offset, constants.CDC_EVENT_LOG_REPO_ITER_BATCH_SIZE]
 
@@ -78,13 +273,305 @@ class CdcRepository:
                     yield event
 
                 if auto_upsert_offset:
-                    await self.upsert_offset(table_names.CDC_EVENT_LOG, max_event_id_seen)
+                    await self.upsert_offset(stream.offset_name, max_event_id_seen)
 
                 params[0] = max_event_id_seen
                 await cursor.execute(query, params)
                 records = await cursor.fetchall()
 
 
+    @instrumentation.named_query
+    async def create_replication_slot(self, stream: CdcStream = CdcStream()) -> bool:
+        """
+        Creates the logical replication slot of `stream`, unless it already exists.
+        Returns whether it was created.
+
+        The slot only sees changes made after it's created, so the slots of streams
+        taking over from another publisher have to be created while that publisher is
+        still running. See the "create_replication_slots" entrypoint.
+        """
+
+        async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            query = """
+            select pg_create_logical_replication_slot(%s, 'test_decoding')
+            where not exists (
+                select 1 from pg_replication_slots where slot_name = %s
+            )
+            ;"""
+
+            params = [stream.replication_slot, stream.replication_slot]
+            await cursor.execute(query, params)
+            created = bool(await cursor.fetchall())
+            await cursor.execute("commit;")
+            return created
+
+
+    @instrumentation.named_query
+    async def replication_slot_exists(self, stream: CdcStream = CdcStream()) -> bool:
+        async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            query = "select 1 from pg_replication_slots where slot_name = %s;"
+            await cursor.execute(query, [stream.replication_slot])
+            exists = bool(await cursor.fetchall())
+            await cursor.execute("commit;")
+            return exists
+
+
+    @instrumentation.named_query
+    async def peek_replication_slot(
+        self,
+        stream: CdcStream = CdcStream(),
+    ) -> tuple[list[models.EventLogEntry], str | None]:
+        """
+        Reads the next batch of changes to `CDC_LOGICAL_DECODING_TABLES` that belong to
+        `stream` from the stream's logical replication slot, in commit order, as event
+        log entries. Each event's `event_id` is the LSN of the change.
+
+        Batches are made of whole transactions, of up to about
+        `CDC_LOGICAL_DECODING_BATCH_SIZE` changes. Returns the batch's events, and the
+        LSN the slot has to be advanced to, with `advance_replication_slot`, before the
+        next batch can be read. The LSN is None once the slot is drained. A batch can
+        have an LSN but no events, if none of its changes are published.
+
+        Transactions that emitted a `logical_decoding.SKIP_EVENTS_MESSAGE_PREFIX`
+        message are skipped, the same as the event log triggers skip transactions that
+        set `cdc.skip_events`.
+        """
+
+        tables = set(constants.CDC_LOGICAL_DECODING_TABLES)
+
+        async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            partition_parents = await self._get_partition_parents(cursor)
+
+            query = """
+            select c.lsn::text, c.data
+            from pg_logical_slot_peek_changes(
+                %s, null, %s, 'include-timestamp', 'on', 'skip-empty-xacts', 'on'
+            ) c
+            ;"""
+
+            params = [stream.replication_slot, constants.CDC_LOGICAL_DECODING_BATCH_SIZE]
+            await cursor.execute(query, params)
+            records = await cursor.fetchall()
+            await cursor.execute("commit;")
+
+        events: list[models.EventLogEntry] = []
+        transaction: list[models.EventLogEntry] = []
+        skip_transaction = False
+        last_commit_lsn = None
+
+        for lsn, data in records:
+            if logical_decoding.is_begin(data):
+                transaction, skip_transaction = [], False
+
+            elif logical_decoding.is_commit(data):
+                timestamp = logical_decoding.parse_commit_timestamp(data)
+                last_commit_lsn = lsn
+                if not skip_transaction:
+                    for event in transaction:
+                        event.timestamp = timestamp
+                    events.extend(transaction)
+                transaction = []
+
+            elif logical_decoding.is_skip_events_message(data):
+                skip_transaction = True
+
+            else:
+                change = logical_decoding.parse_change(data)
+                if change is None:
+                    continue
+
+                operation, schema, table, before, after = change
+                table = partition_parents.get(f"{schema}.{table}", table)
+                if f"{schema}.{table}" not in tables:
+                    continue
+
+                # Same as the event log trigger, which ignores no-op updates.
+                if operation == "UPDATE" and before == after:
+                    continue
+
+                event = models.EventLogEntry(
+                    event_id=logical_decoding.parse_lsn(lsn),
+                    operation=operation,
+                    schema=schema,
+                    table=table,
+                    before=before,
+                    after=after,
+                    timestamp=None,
+                )
+                if stream.includes(event):
+                    transaction.append(event)
+
+        return events, last_commit_lsn
+
+
+    @instrumentation.named_query
+    async def advance_replication_slot(
+        self,
+        lsn: str,
+        stream: CdcStream = CdcStream(),
+        cursor: AsyncCursor = None,
+    ):
+        """
+        Marks every change of the replication slot of `stream` up to `lsn` as consumed,
+        so that it's no longer returned, and its WAL can be recycled.
+        """
+
+        async def _advance_replication_slot(cursor: AsyncCursor):
+            query = "select pg_replication_slot_advance(%s, %s::pg_lsn);"
+            params = [stream.replication_slot, lsn]
+            await cursor.execute(query, params)
+
+        if cursor:
+            await _advance_replication_slot(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                await _advance_replication_slot(cursor)
+                await cursor.execute("commit;")
+
+
+    async def _get_partition_parents(self, cursor: AsyncCursor) -> dict[str, str]:
+        """
+        Maps the schema-qualified name of every partition to the name of its parent, as
+        changes are decoded under the name of the partition they were written to.
+        """
+
+        query = """
+        select n.nspname || '.' || c.relname, p.relname
+        from pg_inherits i
+        join pg_class c on c.oid = i.inhrelid
+        join pg_namespace n on n.oid = c.relnamespace
+        join pg_class p on p.oid = i.inhparent
+        where p.relkind = 'p'
+        ;"""
+
+        await cursor.execute(query)
+        return dict(await cursor.fetchall())
+
+
+    @instrumentation.named_query
+    async def create_event_log_partitions(self) -> list[str]:
+        """
+        Creates partitions of the event log of `CDC_EVENT_LOG_PARTITION_SIZE` events, up
+        to `CDC_EVENT_LOG_PARTITIONS_AHEAD` partitions past the newest event, or enough
+        to last `CDC_EVENT_LOG_HEADROOM` at the recent rate of events. Returns the names
+        of the partitions created.
+
+        Each partition is created as a standalone table and then attached, in its own
+        transaction, which doesn't block reads or writes of the event log.
+        """
+
+        async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            query = "select * from cdc.missing_event_log_partitions(%s, %s, %s::interval);"
+            params = [
+                constants.CDC_EVENT_LOG_PARTITION_SIZE,
+                constants.CDC_EVENT_LOG_PARTITIONS_AHEAD,
+                constants.CDC_EVENT_LOG_HEADROOM,
+            ]
+            await cursor.execute(query, params)
+            missing_partitions = await cursor.fetchall()
+            await cursor.execute("commit;")
+
+        for partition_name, lower_bound, upper_bound in missing_partitions:
+            partition = sql.Identifier("cdc", partition_name)
+            await self._execute_partition_ddl(
+                sql.SQL(
+                    "create table {} (like cdc.event_log including defaults);"
+                ).format(partition),
+                sql.SQL(
+                    "alter table cdc.event_log attach partition {} for values from ({}) to ({});"
+                ).format(partition, sql.Literal(lower_bound), sql.Literal(upper_bound)),
+            )
+
+        return [partition_name for partition_name, _, _ in missing_partitions]
+
+
+    @instrumentation.named_query
+    async def drop_consumed_event_log_partitions(self) -> list[str]:
+        """
+        Drops every partition of the event log whose events every consumer in
+        `cdc.offsets` has read. Returns the names of the partitions dropped.
+
+        Partitions are detached concurrently before being dropped, so that only the
+        dropped partition itself is locked exclusively. A concurrent detach that was
+        interrupted is finalized on the next run instead.
+        """
+
+        async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute("select * from cdc.consumed_event_log_partitions();")
+            consumed_partitions = await cursor.fetchall()
+            await cursor.execute("commit;")
+
+        for partition_name, detach_pending in consumed_partitions:
+            partition = sql.Identifier("cdc", partition_name)
+            if detach_pending:
+                await self._execute_partition_ddl(
+                    sql.SQL("alter table cdc.event_log detach partition {} finalize;").format(
+                        partition
+                    ),
+                )
+            else:
+                await self._execute_partition_ddl(
+                    sql.SQL("alter table cdc.event_log detach partition {} concurrently;").format(
+                        partition
+                    ),
+                    autocommit=True,
+                )
+
+            await self._execute_partition_ddl(sql.SQL("drop table {};").format(partition))
+
+        return [partition_name for partition_name, _ in consumed_partitions]
+
+
+    async def _execute_partition_ddl(
+        self,
+        *statements: sql.Composable,
+        autocommit: bool = False,
+    ):
+        """
+        Executes `statements` in a single transaction, or one at a time outside of a
+        transaction if `autocommit` is set, giving up on waiting for locks after
+        `CDC_EVENT_LOG_PARTITION_LOCK_TIMEOUT` and retrying, up to
+        `CDC_EVENT_LOG_PARTITION_LOCK_ATTEMPTS` times. Waiting indefinitely would hold
+        every later query on the event log up behind the queued lock.
+        """
+
+        for attempt in range(1, constants.CDC_EVENT_LOG_PARTITION_LOCK_ATTEMPTS + 1):
+            try:
+                async with self.db_pool.connection() as conn:
+                    lock_timeout = sql.Literal(constants.CDC_EVENT_LOG_PARTITION_LOCK_TIMEOUT)
+                    if autocommit:
+                        await conn.set_autocommit(True)
+                        try:
+                            await conn.execute(
+                                sql.SQL("set lock_timeout = {};").format(lock_timeout)
+                            )
+                            for statement in statements:
+                                await conn.execute(statement)
+                        finally:
+                            await conn.execute("reset lock_timeout;")
+                            await conn.set_autocommit(False)
+                    else:
+                        async with conn.cursor() as cursor:
+                            await cursor.execute(
+                                sql.SQL("set local lock_timeout = {};").format(lock_timeout)
+                            )
+                            for statement in statements:
+                                await cursor.execute(statement)
+                            await cursor.execute("commit;")
+                return
+
+            except psycopg.errors.LockNotAvailable:
+                if attempt == constants.CDC_EVENT_LOG_PARTITION_LOCK_ATTEMPTS:
+                    raise
+                logger.warning(
+                    "Timed out waiting for a lock on the event log, retrying (attempt %s of %s).",
+                    attempt,
+                    constants.CDC_EVENT_LOG_PARTITION_LOCK_ATTEMPTS,
+                )
+                await asyncio.sleep(constants.CDC_EVENT_LOG_PARTITION_LOCK_RETRY_DELAY)
+
+
+    @instrumentation.named_query
     async def upsert_offset(
         self,
         table_name: str,
@@ -1,19 +1,33 @@
 from typing import AsyncIterable
-import itertools
 
 from psycopg_pool import AsyncConnectionPool
 from psycopg import AsyncCursor
-from psycopg.rows import dict_row
+from psycopg.rows import dict_row, tuple_row
 
 from pipdepgraph import models, constants
-from pipdepgraph.repositories import table_names
+from pipdepgraph.repositories import (
+    table_names,
+    adaptive_batching,
+    bulk_copy,
+    table_scan,
+    instrumentation,
+)
 
 
 class DistributionsRepository:
-    def __init__(self, db_pool: AsyncConnectionPool):
+    def __init__(
+        self,
+        db_pool: AsyncConnectionPool,
+        read_pool: AsyncConnectionPool | None = None,
+    ):
         self.db_pool = db_pool
+        self.read_pool = read_pool or db_pool
+        self._insert_distributions_batch_sizes = adaptive_batching.PerConnection(
+            adaptive_batching.AdaptiveBatchSize.for_writes
+        )
 
 
+    @instrumentation.named_query
     async def insert_distributions(
         self,
         distributions: list[models.Distribution],
@@ -29,15 +43,67 @@ class DistributionsRepository:
         if not distributions:
             return []
 
-        async def _insert_distributions(cursor: AsyncCursor) -> list[models.Distribution]:
-            PARAMS_PER_INSERT = 8
-            for distribution_batch in itertools.batched(
-                distributions,
-                constants.POSTGRES_MAX_QUERY_PARAMS // PARAMS_PER_INSERT,
-            ):
-                query = f"""
-                insert into {table_names.DISTRIBUTIONS}
+        async def _copy_distributions(
+            cursor: AsyncCursor,
+            distributions: list[models.Distribution],
+        ) -> list[models.Distribution]:
+            await bulk_copy.copy_into_temp_table(
+                cursor,
+                "distributions_copy",
+                [
+                    ("version_id", "uuid"),
+                    ("package_type", "text"),
+                    ("python_version", "text"),
+                    ("requires_python", "text"),
+                    ("upload_time", "timestamp"),
+                    ("yanked", "boolean"),
+                    ("package_filename", "text"),
+                    ("package_url", "text"),
+                ],
                 (
+                    (
+                        dist.version_id,
+                        dist.package_type,
+                        dist.python_version,
+                        dist.requires_python,
+                        dist.upload_time,
+                        dist.yanked,
+                        dist.package_filename,
+                        dist.package_url,
+                    )
+                    for dist in distributions
+                ),
+            )
+
+            query = f"""
+            insert into {table_names.DISTRIBUTIONS}
+            (
+                version_id,
+                package_type,
+                python_version,
+                requires_python,
+                upload_time,
+                yanked,
+                package_filename,
+                package_url
+            )
+            select
+                version_id,
+                package_type,
+                python_version,
+                requires_python,
+                upload_time,
+                yanked,
+                package_filename,
+                package_url
+            from distributions_copy
+            on conflict do nothing
+            """
+
+            if return_inserted:
+                query += """
+                returning
+                    distribution_id,
                     version_id,
                     package_type,
                     python_version,
@@ -45,65 +111,142 @@ class DistributionsRepository:
                     upload_time,
                     yanked,
                     package_filename,
-                    package_url
-                )
-                values
+                    package_url,
+                    processed,
+                    metadata_file_size
                 """
 
-                query += ",".join(
-                    "( %s, %s, %s, %s, %s, %s, %s, %s ) "
-                    for _ in range(len(distribution_batch))
-                )
-                query += " on conflict do nothing "
-
-                if return_inserted:
-                    query += """
-                    returning
-                        distribution_id,
-                        version_id,
-                        package_type,
-                        python_version,
-                        requires_python,
-                        upload_time,
-                        yanked,
-                        package_filename,
-                        package_url,
-                        processed,
-                        metadata_file_size
-                    """
-
-                params = [None] * PARAMS_PER_INSERT * len(distribution_batch)
-
-                offset = 0
-                for dist in distribution_batch:
-                    params[offset + 0] = dist.version_id
-                    params[offset + 1] = dist.package_type
-                    params[offset + 2] = dist.python_version
-                    params[offset + 3] = dist.requires_python
-                    params[offset + 4] = dist.upload_time
-                    params[offset + 5] = dist.yanked
-                    params[offset + 6] = dist.package_filename
-                    params[offset + 7] = dist.package_url
-                    offset += PARAMS_PER_INSERT
-
-                await cursor.execute(query, params)
-                if return_inserted:
-                    rows = await cursor.fetchall()
-                    return [models.Distribution(**row) for row in rows]
-                else:
-                    return []
+            await cursor.execute(query)
+            if return_inserted:
+                rows = await cursor.fetchall()
+                return [models.Distribution(**row) for row in rows]
+            else:
+                return []
+
+        async def _insert_distributions(
+            cursor: AsyncCursor,
+            distributions: list[models.Distribution],
+        ) -> list[models.Distribution]:
+            if bulk_copy.should_copy(distributions, cursor):
+                return await _copy_distributions(cursor, distributions)
+
+            query = f"""
+            insert into {table_names.DISTRIBUTIONS}
+            (
+                version_id,
+                package_type,
+                python_version,
+                requires_python,
+                upload_time,
+                yanked,
+                package_filename,
+                package_url
+            )
+            select
+                d.version_id,
+                d.package_type,
+                d.python_version,
+                d.requires_python,
+                d.upload_time,
+                d.yanked,
+                d.package_filename,
+                d.package_url
+            from unnest(
+                %s::uuid[], %s::text[], %s::text[], %s::text[],
+                %s::timestamp[], %s::boolean[], %s::text[], %s::text[]
+            ) as d(
+                version_id,
+                package_type,
+                python_version,
+                requires_python,
+                upload_time,
+                yanked,
+                package_filename,
+                package_url
+            )
+            on conflict do nothing
+            """
+
+            if return_inserted:
+                query += """
+                returning
+                    distribution_id,
+                    version_id,
+                    package_type,
+                    python_version,
+                    requires_python,
+                    upload_time,
+                    yanked,
+                    package_filename,
+                    package_url,
+                    processed,
+                    metadata_file_size
+                """
+
+            params = (
+                [dist.version_id for dist in distributions],
+                [dist.package_type for dist in distributions],
+                [dist.python_version for dist in distributions],
+                [dist.requires_python for dist in distributions],
+                [dist.upload_time for dist in distributions],
+                [dist.yanked for dist in distributions],
+                [dist.package_filename for dist in distributions],
+                [dist.package_url for dist in distributions],
+            )
+
+            await cursor.execute(query, params, prepare=True)
+            if return_inserted:
+                rows = await cursor.fetchall()
+                return [models.Distribution(**row) for row in rows]
+            else:
+                return []
 
         if cursor:
-            return await _insert_distributions(cursor)
+            batch_size = self._insert_distributions_batch_sizes.get(cursor.connection)
+            return await batch_size.write_batches(
+                distributions, cursor, _insert_distributions
+            )
         else:
             async with self.db_pool.connection() as conn, conn.cursor(
                 row_factory=dict_row
             ) as cursor:
-                result = await _insert_distributions(cursor)
+                batch_size = self._insert_distributions_batch_sizes.get(conn)
+                return await batch_size.write_batches(
+                    distributions, cursor, _insert_distributions, commit=True
+                )
+
+
+    @instrumentation.named_query
+    async def set_requirement_set(
+        self,
+        *,
+        distribution_id: str,
+        requirement_set_hash: bytes | None,
+        cursor: AsyncCursor | None = None,
+    ):
+        """
+        Links a distribution to a shared requirement set, by the set's content hash.
+        A `requirement_set_hash` of None unlinks the distribution from its set.
+        """
+
+        async def _set_requirement_set(cursor: AsyncCursor):
+            query = f"""
+            update {table_names.DISTRIBUTIONS}
+            set requirement_set_hash = %s
+            where distribution_id = %s
+            """
+
+            await cursor.execute(query, [requirement_set_hash, distribution_id], prepare=True)
+
+        if cursor:
+            await _set_requirement_set(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                await _set_requirement_set(cursor)
                 await cursor.execute("commit;")
-                return result
 
 
+    @instrumentation.named_query
     async def update_distributions(
         self,
         distributions: list[models.Distribution],
@@ -115,6 +258,8 @@ class DistributionsRepository:
         properties.
         """
 
+        instrumentation.record_batch_size(len(distributions))
+
         if not distributions:
             return
 
@@ -143,19 +288,20 @@ class DistributionsRepository:
                 await _update_distributions(cursor)
                 await cursor.execute("commit;")
 
+    @instrumentation.named_query
     async def iter_distributions(
         self,
         processed: bool | None = None,
         package_type: str | None = None,
         package_name: str | models.PackageName | None = None,
     ) -> AsyncIterable[models.Distribution]:
-        async with self.db_pool.connection() as conn, conn.cursor(
-            row_factory=dict_row, name='iter_distributions'
+        async with self.read_pool.connection() as conn, conn.cursor(
+            row_factory=tuple_row, name='iter_distributions'
         ) as cursor:
             query = f"""
             select
-                dist.distribution_id,
                 dist.version_id,
+                dist.distribution_id,
                 dist.package_type,
                 dist.python_version,
                 dist.requires_python,
@@ -163,11 +309,11 @@ class DistributionsRepository:
                 dist.yanked,
                 dist.package_filename,
                 dist.package_url,
-                dist.metadata_file_size,
-                dist.processed
+                dist.processed,
+                dist.metadata_file_size
             from {table_names.DISTRIBUTIONS} dist
-            {"" if package_name is None else f" left join {table_names.VERSIONS} version on version.version_id = dist.version_id "}
-            {"" if package_name is None else f" left join {table_names.PACKAGE_NAMES} name on name.package_name = version.package_name "}
+            {"" if package_name is None else f" left join {table_names.VERSIONS} version on {'version.version_key = dist.version_key' if constants.JOIN_ON_COMPACT_KEYS else 'version.version_id = dist.version_id'} "}
+            {"" if package_name is None else f" left join {table_names.PACKAGE_NAMES} name on {'name.package_id = version.package_id' if constants.JOIN_ON_COMPACT_KEYS else 'name.package_name = version.package_name'} "}
             """
 
             has_where = False
@@ -206,8 +352,87 @@ class DistributionsRepository:
                 params.append(package_type)
 
             await cursor.execute(query, params)
-            records = await cursor.fetchmany(size=constants.DISTRIBUTIONS_REPO_ITER_BATCH_SIZE)
-            while records:
+            async for records in adaptive_batching.AdaptiveBatchSize.for_fetches(
+                constants.DISTRIBUTIONS_REPO_ITER_BATCH_SIZE
+            ).fetch(cursor):
                 for record in records:
-                    yield models.Distribution.from_dict(record)
-                records = await cursor.fetchmany(size=constants.DISTRIBUTIONS_REPO_ITER_BATCH_SIZE)
+                    yield models.Distribution.from_row(record)
+
+    @instrumentation.named_query
+    async def iter_distributions_in_key_range(
+        self,
+        key_range: table_scan.KeyRange,
+        processed: bool | None = None,
+        package_type: str | None = None,
+    ) -> AsyncIterable[models.Distribution]:
+        """
+        Iterates over the distribution records whose `distribution_id` falls within
+        `key_range`, using keyset pagination. See `table_scan` for splitting a full
+        table scan into key ranges which can be scanned in parallel.
+        """
+
+        select = f"""
+        select
+            dist.version_id,
+            dist.distribution_id,
+            dist.package_type,
+            dist.python_version,
+            dist.requires_python,
+            dist.upload_time,
+            dist.yanked,
+            dist.package_filename,
+            dist.package_url,
+            dist.processed,
+            dist.metadata_file_size
+        from {table_names.DISTRIBUTIONS} dist
+        """
+
+        where = []
+        params = []
+
+        if processed is not None:
+            where.append("dist.processed = %s")
+            params.append(processed)
+
+        if package_type is not None:
+            where.append("dist.package_type = %s")
+            params.append(package_type)
+
+        async for record in table_scan.iter_key_range(
+            self.read_pool,
+            select=select,
+            key_column="dist.distribution_id",
+            key_index=1,
+            key_range=key_range,
+            where=where,
+            params=params,
+        ):
+            yield models.Distribution.from_row(record)
+
+    @instrumentation.named_query
+    async def backfill_compact_keys(self, key_range: table_scan.KeyRange) -> int:
+        """
+        Assigns `distribution_key` and `version_key` to the distribution records within
+        `key_range` that are missing them. Must be run after the versions have been
+        backfilled. Returns the number of records updated.
+        """
+
+        update = f"""
+        update {table_names.DISTRIBUTIONS} dist set
+            distribution_key = coalesce(dist.distribution_key, nextval('pypi_packages.distribution_key_seq')),
+            version_key = coalesce(dist.version_key, kv.version_key)
+        from page, {table_names.VERSIONS} kv
+        where
+            dist.distribution_id = page.key
+            and kv.version_id = dist.version_id
+            and (dist.distribution_key is null or dist.version_key is null)
+        returning 1
+        """
+
+        return await table_scan.update_key_range(
+            self.db_pool,
+            table_name=table_names.DISTRIBUTIONS,
+            key_column="distribution_id",
+            key_range=key_range,
+            update=update,
+        )
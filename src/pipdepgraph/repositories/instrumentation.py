@@ -0,0 +1,408 @@
+from typing import Any, AsyncIterator, Callable
+import bisect
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import inspect
+import logging
+import time
+
+from psycopg import AsyncConnection, AsyncCursor, AsyncServerCursor
+from psycopg_pool import AsyncConnectionPool
+
+from pipdepgraph import constants
+
+logger = logging.getLogger("pipdepgraph.repositories.instrumentation")
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+"""
+Upper bounds, in seconds, of the statement latency histogram buckets. Statements slower
+than the last bound are counted in an extra, unbounded bucket.
+"""
+
+UNNAMED_QUERY = "unnamed"
+
+_query_name: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "query_name", default=UNNAMED_QUERY
+)
+
+
+@dataclasses.dataclass(slots=True)
+class QueryStats:
+    """
+    Statistics for every statement executed under a single query name.
+
+    - `num_statements`, `total_seconds`, `max_seconds`, `latency_buckets`: Statement
+      latencies, including COPY and server-side cursor fetches.
+    - `num_rows`: Rows fetched, plus rows affected by statements that don't return rows.
+    - `num_batches`, `total_batch_size`, `max_batch_size`: Sizes of the batches of
+      records written, and of the pages fetched by `fetchmany`.
+    """
+
+    num_statements: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    latency_buckets: list[int] = dataclasses.field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+    num_rows: int = 0
+    num_batches: int = 0
+    total_batch_size: int = 0
+    max_batch_size: int = 0
+
+    def observe_latency(self, seconds: float):
+        self.num_statements += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def observe_batch_size(self, batch_size: int):
+        self.num_batches += 1
+        self.total_batch_size += batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+
+    def latency_quantile(self, q: float) -> float:
+        """
+        Returns the upper bound of the bucket containing the `q` quantile of statement
+        latencies. Quantiles falling in the unbounded bucket return `max_seconds`.
+        """
+
+        rank = q * self.num_statements
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets):
+            seen += count
+            if seen >= rank and seen > 0:
+                return bound
+        return self.max_seconds
+
+
+MetricsSink = Callable[[dict[str, QueryStats]], None]
+"""
+Receives the statistics collected since the previous report, keyed by query name.
+"""
+
+
+def log_metrics_sink(stats: dict[str, QueryStats]):
+    """
+    The default metrics sink. Logs one line per query name, slowest total time first.
+    """
+
+    for name, s in sorted(stats.items(), key=lambda item: -item[1].total_seconds):
+        logger.info(
+            "%s: %s statements, %.3fs total, p50 <= %.1fms, p99 <= %.1fms, max %.1fms, "
+            "%s rows, %s batches (avg %.1f, max %s)",
+            name,
+            s.num_statements,
+            s.total_seconds,
+            s.latency_quantile(0.5) * 1000,
+            s.latency_quantile(0.99) * 1000,
+            s.max_seconds * 1000,
+            s.num_rows,
+            s.num_batches,
+            s.total_batch_size / s.num_batches if s.num_batches else 0.0,
+            s.max_batch_size,
+        )
+
+
+PoolMetricsSink = Callable[[str, dict[str, int]], None]
+"""
+Receives the name of a connection pool, and the pool's stats since the previous report,
+as returned by `AsyncConnectionPool.pop_stats()`.
+"""
+
+
+def log_pool_metrics_sink(pool_name: str, stats: dict[str, int]):
+    """
+    The default pool metrics sink. Logs the pool's usage, and warns if any requests for
+    a connection had to wait for one to be returned to the pool.
+    """
+
+    num_requests = stats.get("requests_num", 0)
+    num_queued = stats.get("requests_queued", 0)
+    wait_ms = stats.get("requests_wait_ms", 0)
+
+    logger.info(
+        "Pool %s: %s/%s connections (%s available, min %s), %s requests, "
+        "%s queued (%sms total wait), %sms total usage, %s new connections, %s lost",
+        pool_name,
+        stats.get("pool_size", 0),
+        stats.get("pool_max", 0),
+        stats.get("pool_available", 0),
+        stats.get("pool_min", 0),
+        num_requests,
+        num_queued,
+        wait_ms,
+        stats.get("usage_ms", 0),
+        stats.get("connections_num", 0),
+        stats.get("connections_lost", 0),
+    )
+
+    if num_queued:
+        logger.warning(
+            "Pool %s is starved: %s of %s requests waited for a connection, "
+            "%.1fms on average. Consider raising its max size.",
+            pool_name,
+            num_queued,
+            num_requests,
+            wait_ms / num_queued,
+        )
+
+
+_stats: dict[str, QueryStats] = {}
+_sink: MetricsSink = log_metrics_sink
+_pools: list[AsyncConnectionPool] = []
+_pool_sink: PoolMetricsSink = log_pool_metrics_sink
+_last_report = time.monotonic()
+
+
+def set_metrics_sink(sink: MetricsSink):
+    """
+    Replaces the sink that collected statistics are reported to.
+    """
+
+    global _sink
+    _sink = sink
+
+
+def set_pool_metrics_sink(sink: PoolMetricsSink):
+    """
+    Replaces the sink that connection pool stats are reported to.
+    """
+
+    global _pool_sink
+    _pool_sink = sink
+
+
+def register_pool(pool: AsyncConnectionPool):
+    """
+    Includes `pool`'s stats in every report, until the pool is closed.
+    """
+
+    if pool not in _pools:
+        _pools.append(pool)
+
+
+def snapshot(reset: bool = False) -> dict[str, QueryStats]:
+    """
+    Returns the statistics collected so far, keyed by query name. If `reset` is set,
+    collection starts over from nothing.
+    """
+
+    global _stats
+    stats = _stats
+    if reset:
+        _stats = {}
+    else:
+        stats = {
+            name: dataclasses.replace(s, latency_buckets=list(s.latency_buckets))
+            for name, s in stats.items()
+        }
+    return stats
+
+
+def _maybe_report():
+    """
+    Hands the statistics collected since the last report, and the stats of every
+    registered connection pool, to the metrics sinks once every
+    `QUERY_METRICS_REPORT_INTERVAL` seconds. Reporting piggybacks on query execution,
+    so that no background task needs to be started by each entrypoint.
+    """
+
+    global _last_report
+    if constants.QUERY_METRICS_REPORT_INTERVAL <= 0:
+        return
+
+    now = time.monotonic()
+    if now - _last_report < constants.QUERY_METRICS_REPORT_INTERVAL:
+        return
+
+    _last_report = now
+    stats = snapshot(reset=True)
+
+    try:
+        if stats:
+            _sink(stats)
+
+        _pools[:] = [pool for pool in _pools if not pool.closed]
+        for pool in _pools:
+            _pool_sink(pool.name, pool.pop_stats())
+
+    except Exception as ex:
+        logger.error("Error while reporting query metrics", exc_info=ex)
+
+
+def _current_stats() -> QueryStats:
+    name = _query_name.get()
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = QueryStats()
+    return stats
+
+
+def _format_statement(query: Any) -> str:
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    elif not isinstance(query, str):
+        query = repr(query)
+    return " ".join(query.split())[: constants.QUERY_SLOW_LOG_MAX_LENGTH]
+
+
+def _observe_statement(query: Any, seconds: float, num_rows: int):
+    stats = _current_stats()
+    stats.observe_latency(seconds)
+    if num_rows > 0:
+        stats.num_rows += num_rows
+
+    if (
+        constants.QUERY_SLOW_LOG_THRESHOLD_MS > 0
+        and seconds * 1000 >= constants.QUERY_SLOW_LOG_THRESHOLD_MS
+    ):
+        logger.warning(
+            "Slow query %s took %.1fms: %s",
+            _query_name.get(),
+            seconds * 1000,
+            _format_statement(query),
+        )
+
+    _maybe_report()
+
+
+def _observe_fetch(num_rows: int, page: bool):
+    stats = _current_stats()
+    stats.num_rows += num_rows
+    if page:
+        stats.observe_batch_size(num_rows)
+
+
+def record_batch_size(batch_size: int):
+    """
+    Records the number of records written by a single call of the current query.
+    """
+
+    _current_stats().observe_batch_size(batch_size)
+
+
+def named_query[F: Callable](fn: F) -> F:
+    """
+    Decorates a repository method so that every statement it executes is recorded under
+    the method's name. Works on coroutines and async generators. Nested named queries
+    are recorded under the innermost name.
+    """
+
+    name = fn.__name__
+
+    if inspect.isasyncgenfunction(fn):
+
+        @functools.wraps(fn)
+        async def _named_async_gen(*args, **kwargs):
+            agen = fn(*args, **kwargs)
+            try:
+                while True:
+                    # The name is only set while the generator is running, and not
+                    # while the caller is handling what it yielded.
+                    token = _query_name.set(name)
+                    try:
+                        item = await anext(agen)
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        _query_name.reset(token)
+                    yield item
+            finally:
+                await agen.aclose()
+
+        return _named_async_gen  # type: ignore
+
+    @functools.wraps(fn)
+    async def _named_coroutine(*args, **kwargs):
+        token = _query_name.set(name)
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            _query_name.reset(token)
+
+    return _named_coroutine  # type: ignore
+
+
+class _InstrumentedCursorMixin:
+    """
+    Times every statement executed by the cursor, and counts the rows it returns or
+    affects, under the current query name.
+    """
+
+    _fetch_is_round_trip = False
+
+    async def execute(self, query, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            _observe_statement(query, time.perf_counter() - started, self._rows_affected())
+
+    async def executemany(self, query, params_seq, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().executemany(query, params_seq, **kwargs)
+        finally:
+            _observe_statement(query, time.perf_counter() - started, self._rows_affected())
+
+    @contextlib.asynccontextmanager
+    async def copy(self, statement, params=None, **kwargs) -> AsyncIterator[Any]:
+        started = time.perf_counter()
+        try:
+            async with super().copy(statement, params, **kwargs) as copy:
+                yield copy
+        finally:
+            _observe_statement(statement, time.perf_counter() - started, self.rowcount)
+
+    async def fetchone(self):
+        record = await self._timed_fetch(super().fetchone())
+        _observe_fetch(0 if record is None else 1, page=False)
+        return record
+
+    async def fetchmany(self, size: int = 0):
+        records = await self._timed_fetch(super().fetchmany(size))
+        _observe_fetch(len(records), page=True)
+        return records
+
+    async def fetchall(self):
+        records = await self._timed_fetch(super().fetchall())
+        _observe_fetch(len(records), page=False)
+        return records
+
+    async def _timed_fetch(self, fetch):
+        if not self._fetch_is_round_trip:
+            return await fetch
+
+        started = time.perf_counter()
+        try:
+            return await fetch
+        finally:
+            _observe_statement("fetch", time.perf_counter() - started, 0)
+
+    def _rows_affected(self) -> int:
+        # Rows of statements that return a result are counted as they're fetched.
+        if self.pgresult is None or self.description is not None:
+            return 0
+        return self.rowcount
+
+
+class InstrumentedAsyncCursor(_InstrumentedCursorMixin, AsyncCursor):
+    pass
+
+
+class InstrumentedAsyncServerCursor(_InstrumentedCursorMixin, AsyncServerCursor):
+    _fetch_is_round_trip = True
+
+
+async def configure_connection(conn: AsyncConnection):
+    """
+    Connection pool `configure` callback, which instruments every cursor created from
+    the connection.
+    """
+
+    conn.cursor_factory = InstrumentedAsyncCursor
+    conn.server_cursor_factory = InstrumentedAsyncServerCursor
@@ -1,20 +1,34 @@
 from typing import AsyncIterable, List
 import datetime
-import itertools
 
 import packaging.utils
 from psycopg_pool import AsyncConnectionPool
 from psycopg import AsyncCursor
-from psycopg.rows import dict_row
+from psycopg.rows import dict_row, tuple_row
 
 from pipdepgraph import models, constants
-from pipdepgraph.repositories import table_names
+from pipdepgraph.repositories import (
+    table_names,
+    adaptive_batching,
+    bulk_copy,
+    table_scan,
+    instrumentation,
+)
 
 
 class PackageNamesRepository:
-    def __init__(self, db_pool: AsyncConnectionPool):
+    def __init__(
+        self,
+        db_pool: AsyncConnectionPool,
+        read_pool: AsyncConnectionPool | None = None,
+    ):
         self.db_pool = db_pool
+        self.read_pool = read_pool or db_pool
+        self._insert_package_names_batch_sizes = adaptive_batching.PerConnection(
+            adaptive_batching.AdaptiveBatchSize.for_writes
+        )
 
+    @instrumentation.named_query
     async def insert_package_names(
         self,
         package_names: list[models.PackageName] | list[str],
@@ -30,60 +44,103 @@ class PackageNamesRepository:
         if not package_names:
             return []
 
-        async def _insert_package_names(cursor: AsyncCursor) -> list[models.PackageName]:
-            output = []
-            MAX_PARAMS_PER_INSERT = 3
+        async def _copy_package_names(
+            cursor: AsyncCursor,
+            package_names: list[models.PackageName] | list[str],
+        ) -> list[models.PackageName]:
+            if isinstance(package_names[0], models.PackageName):
+                rows = (
+                    (pn.package_name, pn.date_discovered, pn.date_last_checked)
+                    for pn in package_names
+                )
+            elif isinstance(package_names[0], str):
+                rows = ((pn, None, None) for pn in package_names)
+            else:
+                raise ValueError(f"invalid type for package_names: {package_names[0]}")
 
-            for package_name_batch in itertools.batched(
-                package_names, constants.POSTGRES_MAX_QUERY_PARAMS // MAX_PARAMS_PER_INSERT
-            ):
-                query = f"insert into {table_names.PACKAGE_NAMES} "
-                params = []
-
-                if isinstance(package_name_batch[0], models.PackageName):
-                    query += " (package_name, date_discovered, date_last_checked) values "
-                    query += ",".join(
-                        "(%s, coalesce(%s, now()), %s)" for _ in range(len(package_name_batch))
-                    )
-
-                    params = [None] * MAX_PARAMS_PER_INSERT * len(package_name_batch)
-                    offset = 0
-                    for package_name in package_name_batch:
-                        params[offset + 0] = package_name.package_name
-                        params[offset + 1] = package_name.date_discovered
-                        params[offset + 2] = package_name.date_last_checked
-                        offset += 3
-                elif isinstance(package_name_batch[0], str):
-                    query += " (package_name) values "
-                    query += ",".join("(%s)" for _ in range(len(package_name_batch)))
-                    params = package_name_batch
-                else:
-                    raise ValueError(f"invalid type for package_names: {package_name_batch[0]}")
+            await bulk_copy.copy_into_temp_table(
+                cursor,
+                "package_names_copy",
+                [
+                    ("package_name", "text"),
+                    ("date_discovered", "timestamp"),
+                    ("date_last_checked", "timestamp"),
+                ],
+                rows,
+            )
 
-                query += " on conflict do nothing "
-                if return_inserted:
-                    query += " returning package_name, date_discovered, date_last_checked "
+            query = f"""
+            insert into {table_names.PACKAGE_NAMES}
+            (package_name, date_discovered, date_last_checked)
+            select package_name, coalesce(date_discovered, now()), date_last_checked
+            from package_names_copy
+            on conflict do nothing
+            """
+            if return_inserted:
+                query += " returning package_name, date_discovered, date_last_checked "
 
-                await cursor.execute(query, params)
+            await cursor.execute(query)
 
-                if return_inserted:
-                    rows = await cursor.fetchall()
-                    output.extend(map(models.PackageName.from_dict, rows))
+            if return_inserted:
+                return list(map(models.PackageName.from_dict, await cursor.fetchall()))
+            return []
+
+        async def _insert_package_names(
+            cursor: AsyncCursor,
+            package_names: list[models.PackageName] | list[str],
+        ) -> list[models.PackageName]:
+            if bulk_copy.should_copy(package_names, cursor):
+                return await _copy_package_names(cursor, package_names)
 
-            return output
+            if isinstance(package_names[0], models.PackageName):
+                params = (
+                    [pn.package_name for pn in package_names],
+                    [pn.date_discovered for pn in package_names],
+                    [pn.date_last_checked for pn in package_names],
+                )
+            elif isinstance(package_names[0], str):
+                params = (
+                    list(package_names),
+                    [None] * len(package_names),
+                    [None] * len(package_names),
+                )
+            else:
+                raise ValueError(f"invalid type for package_names: {package_names[0]}")
+
+            query = f"""
+            insert into {table_names.PACKAGE_NAMES}
+            (package_name, date_discovered, date_last_checked)
+            select pn.package_name, coalesce(pn.date_discovered, now()), pn.date_last_checked
+            from unnest(%s::text[], %s::timestamp[], %s::timestamp[])
+                as pn(package_name, date_discovered, date_last_checked)
+            on conflict do nothing
+            """
+            if return_inserted:
+                query += " returning package_name, date_discovered, date_last_checked "
+
+            await cursor.execute(query, params, prepare=True)
+
+            if return_inserted:
+                return list(map(models.PackageName.from_dict, await cursor.fetchall()))
+            return []
 
         if cursor:
-            return await _insert_package_names(cursor)
+            batch_size = self._insert_package_names_batch_sizes.get(cursor.connection)
+            return await batch_size.write_batches(
+                package_names, cursor, _insert_package_names
+            )
         else:
             async with (
                 self.db_pool.connection() as conn,
                 conn.cursor(row_factory=dict_row) as cursor,
             ):
-                result = await _insert_package_names(cursor)
-                await cursor.execute("commit;")
-                return result
+                batch_size = self._insert_package_names_batch_sizes.get(conn)
+                return await batch_size.write_batches(
+                    package_names, cursor, _insert_package_names, commit=True
+                )
 
 
+    @instrumentation.named_query
     async def update_package_names(
         self,
         package_names: list[models.PackageName],
@@ -94,6 +151,8 @@ class PackageNamesRepository:
         "touch" command, only supports updating the "date_last_checked" property.
         """
 
+        instrumentation.record_batch_size(len(package_names))
+
         if not package_names:
             return
 
@@ -109,6 +168,7 @@ class PackageNamesRepository:
                 await _update_package_names(cursor)
                 await cursor.execute("commit;")
 
+    @instrumentation.named_query
     async def get_package_name(
         self, package_name: str | models.PackageName
     ) -> models.PackageName | None:
@@ -148,12 +208,38 @@ class PackageNamesRepository:
                 )
             )
 
+    @instrumentation.named_query
+    async def backfill_package_ids(self) -> int:
+        """
+        Assigns an interned `package_id` to every package name that doesn't have one.
+        Returns the number of package names updated.
+        """
+
+        update = f"""
+        update {table_names.PACKAGE_NAMES} kpn set
+            package_id = nextval('pypi_packages.package_id_seq')
+        from page
+        where
+            kpn.package_name = page.key
+            and kpn.package_id is null
+        returning 1
+        """
+
+        return await table_scan.update_key_range(
+            self.db_pool,
+            table_name=table_names.PACKAGE_NAMES,
+            key_column="package_name",
+            key_range=(None, None),
+            update=update,
+        )
+
+    @instrumentation.named_query
     async def iter_package_names(
         self, date_last_checked_before: datetime.datetime | None = None
     ) -> AsyncIterable[models.PackageName]:
         async with (
-            self.db_pool.connection() as conn,
-            conn.cursor(row_factory=dict_row, name='iter_package_names') as cursor,
+            self.read_pool.connection() as conn,
+            conn.cursor(row_factory=tuple_row, name='iter_package_names') as cursor,
         ):
             query = f"select kpn.package_name, kpn.date_discovered, kpn.date_last_checked from {table_names.PACKAGE_NAMES} kpn"
 
@@ -172,11 +258,11 @@ class PackageNamesRepository:
                 params.append(date_last_checked_before)
 
             await cursor.execute(query, params)
-            records = await cursor.fetchmany(size=constants.NAMES_REPO_ITER_BATCH_SIZE)
-            while records:
+            async for records in adaptive_batching.AdaptiveBatchSize.for_fetches(
+                constants.NAMES_REPO_ITER_BATCH_SIZE
+            ).fetch(cursor):
                 for record in records:
-                    yield models.PackageName.from_dict(record)
-                records = await cursor.fetchmany(size=constants.NAMES_REPO_ITER_BATCH_SIZE)
+                    yield models.PackageName.from_row(record)
 
     async def _propagate_dependency_names(self, cursor: AsyncCursor):
         query = f"""
@@ -187,6 +273,7 @@ class PackageNamesRepository:
 
         await cursor.execute(query)
 
+    @instrumentation.named_query
     async def propagate_dependency_names(self, cursor: AsyncCursor | None = None):
         if cursor:
             await self._propagate_dependency_names(cursor)
@@ -1,19 +1,84 @@
 from typing import AsyncIterable
-import itertools
 import dataclasses
+import hashlib
+import json
 
 from psycopg_pool import AsyncConnectionPool
 from psycopg import AsyncCursor
-from psycopg.rows import dict_row
+from psycopg.rows import dict_row, tuple_row
 
 from pipdepgraph import models, constants
-from pipdepgraph.repositories import table_names
+from pipdepgraph.repositories import (
+    table_names,
+    adaptive_batching,
+    bulk_copy,
+    table_scan,
+    instrumentation,
+)
+
+
+def format_pg_text_array(array: list[str | None] | None) -> str | None:
+    """
+    Formats a postgres-compatible text array literal, so that jagged arrays of arrays
+    can be bound as a flat array of literals. Returns None if `array` is None.
+    """
+
+    if array is None:
+        return None
+
+    vals = [
+        "null" if val is None else '"' + val.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        for val in array
+    ]
+
+    return "{" + ",".join(vals) + "}"
+
+
+def hash_requirement_set(requirements: list[models.Requirement]) -> bytes:
+    """
+    Returns the sha256 content hash of a set of requirements. Only the fields that
+    describe the requirement itself are hashed, so the same set of requirements hashes
+    the same regardless of which distribution it belongs to, or its order.
+    """
+
+    canonical_requirements = sorted(
+        (
+            req.extras,
+            req.dependency_name,
+            req.dependency_extras,
+            req.version_constraint,
+            req.dependency_extras_arr,
+            req.parsable,
+        )
+        for req in requirements
+    )
+
+    return hashlib.sha256(
+        json.dumps(canonical_requirements, separators=(",", ":")).encode()
+    ).digest()
+
+
+def requirements_partition(partition_index: int) -> str:
+    """
+    Returns the table name of a single partition of the partitioned requirements table.
+    """
+
+    return f"{table_names.REQUIREMENTS}_p{partition_index:02}"
 
 
 class RequirementsRepository:
-    def __init__(self, db_pool: AsyncConnectionPool):
+    def __init__(
+        self,
+        db_pool: AsyncConnectionPool,
+        read_pool: AsyncConnectionPool | None = None,
+    ):
         self.db_pool = db_pool
+        self.read_pool = read_pool or db_pool
+        self._insert_requirements_batch_sizes = adaptive_batching.PerConnection(
+            adaptive_batching.AdaptiveBatchSize.for_writes
+        )
 
+    @instrumentation.named_query
     async def insert_requirements(
         self,
         requirements: list[models.Requirement],
@@ -27,61 +92,230 @@ class RequirementsRepository:
         if not requirements:
             return
 
-        async def _insert_requirements(cursor: AsyncCursor):
-            PARAMS_PER_INSERT = 8
-            for requirement_batch in itertools.batched(
-                requirements,
-                constants.POSTGRES_MAX_QUERY_PARAMS // PARAMS_PER_INSERT,
-            ):
-                query = f"""
-                insert into {table_names.REQUIREMENTS}
+        async def _copy_requirements(
+            cursor: AsyncCursor,
+            requirements: list[models.Requirement],
+        ):
+            await bulk_copy.copy_into_temp_table(
+                cursor,
+                "requirements_copy",
+                [
+                    ("distribution_id", "uuid"),
+                    ("extras", "text"),
+                    ("dependency_name", "text"),
+                    ("dependency_extras", "text"),
+                    ("version_constraint", "text"),
+                    ("dependency_extras_arr", "text[]"),
+                    ("parsable", "boolean"),
+                ],
                 (
-                    requirement_id,
-                    distribution_id,
-                    extras,
-                    dependency_name,
-                    dependency_extras,
-                    version_constraint,
-                    dependency_extras_arr,
-                    parsable,
-                    specifier_set
-                )
-                values
-                """
+                    (
+                        req.distribution_id,
+                        req.extras,
+                        req.dependency_name,
+                        req.dependency_extras,
+                        req.version_constraint,
+                        req.dependency_extras_arr,
+                        req.parsable,
+                    )
+                    for req in requirements
+                ),
+            )
+
+            query = f"""
+            insert into {table_names.REQUIREMENTS}
+            (
+                requirement_id,
+                distribution_id,
+                extras,
+                dependency_name,
+                dependency_extras,
+                version_constraint,
+                dependency_extras_arr,
+                parsable,
+                specifier_set
+            )
+            select
+                gen_random_uuid(),
+                distribution_id,
+                extras,
+                dependency_name,
+                dependency_extras,
+                version_constraint,
+                dependency_extras_arr,
+                parsable,
+                parse_specifier_set(version_constraint)
+            from requirements_copy
+            on conflict do nothing;
+            """
+
+            await cursor.execute(query)
+
+        async def _insert_requirements(
+            cursor: AsyncCursor,
+            requirements: list[models.Requirement],
+        ):
+            if bulk_copy.should_copy(requirements, cursor):
+                return await _copy_requirements(cursor, requirements)
 
-                query += ",".join(
-                    " ( gen_random_uuid(), %s, %s, %s, %s, %s, %s, %s, parse_specifier_set(%s::text) ) " for _ in range(len(requirement_batch))
+            query = f"""
+            insert into {table_names.REQUIREMENTS}
+            (
+                requirement_id,
+                distribution_id,
+                extras,
+                dependency_name,
+                dependency_extras,
+                version_constraint,
+                dependency_extras_arr,
+                parsable,
+                specifier_set
+            )
+            select
+                gen_random_uuid(),
+                r.distribution_id,
+                r.extras,
+                r.dependency_name,
+                r.dependency_extras,
+                r.version_constraint,
+                r.dependency_extras_arr::text[],
+                r.parsable,
+                parse_specifier_set(r.version_constraint)
+            from unnest(
+                %s::uuid[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::boolean[]
+            ) as r(
+                distribution_id,
+                extras,
+                dependency_name,
+                dependency_extras,
+                version_constraint,
+                dependency_extras_arr,
+                parsable
+            )
+            on conflict do nothing;
+            """
+
+            params = (
+                [req.distribution_id for req in requirements],
+                [req.extras for req in requirements],
+                [req.dependency_name for req in requirements],
+                [req.dependency_extras for req in requirements],
+                [req.version_constraint for req in requirements],
+                [format_pg_text_array(req.dependency_extras_arr) for req in requirements],
+                [req.parsable for req in requirements],
+            )
+
+            await cursor.execute(query, params, prepare=True)
+
+        if cursor:
+            batch_size = self._insert_requirements_batch_sizes.get(cursor.connection)
+            await batch_size.write_batches(requirements, cursor, _insert_requirements)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                batch_size = self._insert_requirements_batch_sizes.get(conn)
+                await batch_size.write_batches(
+                    requirements, cursor, _insert_requirements, commit=True
                 )
-                query += " on conflict do nothing; "
-
-                params = [None] * PARAMS_PER_INSERT * len(requirement_batch)
-                offset = 0
-                for req in requirement_batch:
-                    params[offset + 0] = req.distribution_id
-                    params[offset + 1] = req.extras
-                    params[offset + 2] = req.dependency_name
-                    params[offset + 3] = req.dependency_extras
-                    params[offset + 4] = req.version_constraint
-                    params[offset + 5] = req.dependency_extras_arr
-                    params[offset + 6] = req.parsable
-                    params[offset + 7] = req.version_constraint
-                    offset += PARAMS_PER_INSERT
-
-                await cursor.execute(query, params)
+
+    @instrumentation.named_query
+    async def insert_requirement_set(
+        self,
+        requirements: list[models.Requirement],
+        cursor: AsyncCursor | None = None,
+    ) -> bytes:
+        """
+        Stores `requirements` as a shared requirement set, returning the set's content
+        hash. The set's members are only inserted if no set with the same hash exists,
+        so the common case of a distribution with the same requirements as another is
+        a single primary key lookup. The `distribution_id` of the requirements is
+        ignored.
+        """
+
+        instrumentation.record_batch_size(len(requirements))
+
+        requirement_set_hash = hash_requirement_set(requirements)
+
+        async def _insert_requirement_set(cursor: AsyncCursor):
+            query = f"""
+            insert into {table_names.REQUIREMENT_SETS}
+            (requirement_set_hash, num_requirements)
+            values (%s, %s)
+            on conflict do nothing
+            returning requirement_set_hash
+            ;"""
+
+            await cursor.execute(
+                query, [requirement_set_hash, len(requirements)], prepare=True
+            )
+            if not await cursor.fetchall():
+                return
+
+            query = f"""
+            insert into {table_names.REQUIREMENT_SET_MEMBERS}
+            (
+                requirement_set_hash,
+                extras,
+                dependency_name,
+                dependency_extras,
+                version_constraint,
+                dependency_extras_arr,
+                parsable,
+                specifier_set
+            )
+            select
+                %s,
+                r.extras,
+                r.dependency_name,
+                r.dependency_extras,
+                r.version_constraint,
+                r.dependency_extras_arr::text[],
+                r.parsable,
+                parse_specifier_set(r.version_constraint)
+            from unnest(
+                %s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::boolean[]
+            ) as r(
+                extras,
+                dependency_name,
+                dependency_extras,
+                version_constraint,
+                dependency_extras_arr,
+                parsable
+            );
+            """
+
+            params = (
+                requirement_set_hash,
+                [req.extras for req in requirements],
+                [req.dependency_name for req in requirements],
+                [req.dependency_extras for req in requirements],
+                [req.version_constraint for req in requirements],
+                [format_pg_text_array(req.dependency_extras_arr) for req in requirements],
+                [req.parsable for req in requirements],
+            )
+
+            await cursor.execute(query, params, prepare=True)
 
         if cursor:
-            await _insert_requirements(cursor)
+            await _insert_requirement_set(cursor)
         else:
             async with self.db_pool.connection() as conn, conn.cursor() as cursor:
-                await _insert_requirements(cursor)
+                await _insert_requirement_set(cursor)
                 await cursor.execute("commit;")
 
+        return requirement_set_hash
+
+    @instrumentation.named_query
     async def update_requirement(
         self,
         requirement: models.Requirement,
         cursor: AsyncCursor | None = None,
-    ) -> None:
-        async def _update_requirement(cursor: AsyncCursor):
+    ) -> int:
+        """
+        Updates a requirements row, returning the number of rows updated. Requirement
+        set members are shared between distributions, and aren't updated here.
+        """
+
+        async def _update_requirement(cursor: AsyncCursor) -> int:
             if requirement.requirement_id:
                 sql = f"""
                 update {table_names.REQUIREMENTS} set
@@ -122,14 +356,18 @@ class RequirementsRepository:
 
                 await cursor.execute(sql, params)
 
+            return cursor.rowcount
+
         if cursor:
-            await _update_requirement(cursor)
+            return await _update_requirement(cursor)
         else:
             async with self.db_pool.connection() as conn, conn.cursor() as cursor:
-                await _update_requirement(cursor)
+                num_updated = await _update_requirement(cursor)
                 await cursor.execute("commit;")
+                return num_updated
 
 
+    @instrumentation.named_query
     async def delete_requirements(
         self,
         *,
@@ -158,6 +396,69 @@ class RequirementsRepository:
                 await cursor.execute("commit;")
 
 
+    @instrumentation.named_query
+    async def get_distinct_version_constraints(
+        self,
+        *,
+        dependency_name: str,
+        cursor: AsyncCursor | None = None,
+    ) -> list[str]:
+        """
+        Returns the distinct version constraints of all requirements that depend on
+        `dependency_name`, across both the requirements table and shared requirement
+        sets.
+
+        Implemented as a loose index scan over the `(dependency_name, version_constraint)`
+        index, so that popular dependencies with millions of requirements only cost one
+        index probe per distinct constraint.
+        """
+
+        async def _get_distinct_version_constraints(cursor: AsyncCursor) -> list[str]:
+            version_constraints: set[str] = set()
+
+            for table_name in (table_names.REQUIREMENTS, table_names.REQUIREMENT_SET_MEMBERS):
+                query = f"""
+                with recursive constraints as (
+                    (
+                        select req.version_constraint
+                        from {table_name} req
+                        where req.dependency_name = %(dependency_name)s
+                        order by req.version_constraint
+                        limit 1
+                    )
+                    union all
+                    select (
+                        select req.version_constraint
+                        from {table_name} req
+                        where
+                            req.dependency_name = %(dependency_name)s
+                            and req.version_constraint > c.version_constraint
+                        order by req.version_constraint
+                        limit 1
+                    )
+                    from constraints c
+                    where c.version_constraint is not null
+                )
+                select c.version_constraint
+                from constraints c
+                where c.version_constraint is not null
+                ;"""
+
+                await cursor.execute(query, dict(dependency_name=dependency_name))
+                version_constraints.update(
+                    row["version_constraint"] for row in await cursor.fetchall()
+                )
+
+            return sorted(version_constraints)
+
+        if cursor:
+            return await _get_distinct_version_constraints(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor(row_factory=dict_row) as cursor:
+                return await _get_distinct_version_constraints(cursor)
+
+
+    @instrumentation.named_query
     async def iter_requirements(
         self,
         package_name: str | None = None,
@@ -171,11 +472,19 @@ class RequirementsRepository:
         """
         Iterates over a list of requirements records, returning each
         requirement record.
+
+        With `REQUIREMENTS_STORAGE` set to "sets", reads through the
+        "distribution_requirements" view, so that requirements stored in requirement
+        sets are included once per distribution referencing the set.
         """
 
+        read_sets = constants.REQUIREMENTS_STORAGE == "sets"
+        # The view only exposes distribution_id, not distribution_key.
+        join_on_compact_keys = constants.JOIN_ON_COMPACT_KEYS and not read_sets
+
         async with (
-            self.db_pool.connection() as conn,
-            conn.cursor(row_factory=dict_row, name='iter_requirements') as cursor,
+            self.read_pool.connection() as conn,
+            conn.cursor(row_factory=tuple_row, name='iter_requirements') as cursor,
         ):
             query = f"""
             select
@@ -185,13 +494,14 @@ class RequirementsRepository:
                 req.dependency_name        dependency_name,
                 req.dependency_extras      dependency_extras,
                 req.version_constraint     version_constraint,
-                req.dependency_extras_arr  dependency_extras_arr
-            from {table_names.REQUIREMENTS} req {
-                f" join {table_names.DISTRIBUTIONS} dist on req.distribution_id = dist.distribution_id "
+                req.dependency_extras_arr  dependency_extras_arr,
+                req.parsable               parsable
+            from {table_names.DISTRIBUTION_REQUIREMENTS if read_sets else table_names.REQUIREMENTS} req {
+                f" join {table_names.DISTRIBUTIONS} dist on {'req.distribution_key = dist.distribution_key' if join_on_compact_keys else 'req.distribution_id = dist.distribution_id'} "
                 if any(filter(lambda v: v is not None, [package_name, package_version, dist_processed, dist_package_type])) else
                 ""
             } {
-                f" join {table_names.VERSIONS} version on version.version_id = dist.version_id "
+                f" join {table_names.VERSIONS} version on {'version.version_key = dist.version_key' if constants.JOIN_ON_COMPACT_KEYS else 'version.version_id = dist.version_id'} "
                 if any(filter(lambda v: v is not None, [package_name, package_version])) else
                 ""
             } """
@@ -267,8 +577,247 @@ class RequirementsRepository:
                 params.append(dependency_name)
 
             await cursor.execute(query, params)
-            records = await cursor.fetchmany(size=constants.REQUIREMENTS_REPO_ITER_BATCH_SIZE)
-            while records:
+            async for records in adaptive_batching.AdaptiveBatchSize.for_fetches(
+                constants.REQUIREMENTS_REPO_ITER_BATCH_SIZE
+            ).fetch(cursor):
                 for record in records:
-                    yield models.Requirement.from_dict(record)
-                records = await cursor.fetchmany(size=constants.REQUIREMENTS_REPO_ITER_BATCH_SIZE)
+                    yield models.Requirement.from_row(record)
+
+
+    @instrumentation.named_query
+    async def iter_requirements_in_key_range(
+        self,
+        key_range: table_scan.KeyRange,
+        dependency_extras_arr_is_none: bool | None = None,
+    ) -> AsyncIterable[models.Requirement]:
+        """
+        Iterates over the requirement records whose `requirement_id` falls within
+        `key_range`, using keyset pagination. See `table_scan` for splitting a full
+        table scan into key ranges which can be scanned in parallel.
+
+        Requirement set members within `key_range` are included after the requirements
+        rows, once per set rather than once per distribution, so their `distribution_id`
+        is None. Their `dependency_extras_arr` is never null, so they're skipped when
+        `dependency_extras_arr_is_none` is set.
+        """
+
+        select = f"""
+        select
+            req.requirement_id,
+            req.distribution_id,
+            req.extras,
+            req.dependency_name,
+            req.dependency_extras,
+            req.version_constraint,
+            req.dependency_extras_arr,
+            req.parsable
+        from {table_names.REQUIREMENTS} req
+        """
+
+        where = []
+        if dependency_extras_arr_is_none is not None:
+            where.append(
+                "req.dependency_extras_arr is null"
+                if dependency_extras_arr_is_none
+                else "req.dependency_extras_arr is not null"
+            )
+
+        async for record in table_scan.iter_key_range(
+            self.read_pool,
+            select=select,
+            key_column="req.requirement_id",
+            key_index=0,
+            key_range=key_range,
+            where=where,
+        ):
+            yield models.Requirement.from_row(record)
+
+        if dependency_extras_arr_is_none:
+            return
+
+        select = f"""
+        select
+            rsm.requirement_id,
+            null::uuid,
+            rsm.extras,
+            rsm.dependency_name,
+            rsm.dependency_extras,
+            rsm.version_constraint,
+            rsm.dependency_extras_arr,
+            rsm.parsable
+        from {table_names.REQUIREMENT_SET_MEMBERS} rsm
+        """
+
+        async for record in table_scan.iter_key_range(
+            self.read_pool,
+            select=select,
+            key_column="rsm.requirement_id",
+            key_index=0,
+            key_range=key_range,
+        ):
+            yield models.Requirement.from_row(record)
+
+
+    @instrumentation.named_query
+    async def backfill_compact_keys(self, key_range: table_scan.KeyRange) -> int:
+        """
+        Assigns `distribution_key` and `dependency_id` to the requirement records within
+        `key_range` that are missing them. Must be run after the distributions and
+        package names have been backfilled. Dependencies that aren't in the package
+        names table are left without a `dependency_id`. Returns the number of records
+        updated.
+        """
+
+        update = f"""
+        update {table_names.REQUIREMENTS} req set
+            distribution_key = coalesce(req.distribution_key, dist.distribution_key),
+            dependency_id = coalesce(req.dependency_id, (
+                select kpn.package_id
+                from {table_names.PACKAGE_NAMES} kpn
+                where kpn.package_name = req.dependency_name
+            ))
+        from page, {table_names.DISTRIBUTIONS} dist
+        where
+            req.requirement_id = page.key
+            and dist.distribution_id = req.distribution_id
+            and (
+                req.distribution_key is null
+                or (
+                    req.dependency_id is null
+                    and exists (
+                        select 1
+                        from {table_names.PACKAGE_NAMES} kpn
+                        where kpn.package_name = req.dependency_name
+                    )
+                )
+            )
+        returning 1
+        """
+
+        return await table_scan.update_key_range(
+            self.db_pool,
+            table_name=table_names.REQUIREMENTS,
+            key_column="requirement_id",
+            key_range=key_range,
+            update=update,
+        )
+
+
+    @instrumentation.named_query
+    async def copy_to_partitioned(self, key_range: table_scan.KeyRange) -> int:
+        """
+        Copies the requirement records within `key_range` into the partitioned
+        requirements table, skipping records that are already there. Returns the
+        number of records copied.
+
+        Copied records are locked until their page is committed. Otherwise, a
+        concurrent update or delete could be mirrored by the "mirror_to_partitioned"
+        trigger before the copy commits, and the copy would then resurrect the deleted
+        record, or keep the old version of the updated one.
+        """
+
+        insert = f"""
+        insert into {table_names.REQUIREMENTS_PARTITIONED} (
+            requirement_id,
+            distribution_id,
+            extras,
+            dependency_name,
+            dependency_extras,
+            version_constraint,
+            dependency_extras_arr,
+            parsable,
+            specifier_set,
+            distribution_key,
+            dependency_id
+        )
+        select
+            req.requirement_id,
+            req.distribution_id,
+            req.extras,
+            req.dependency_name,
+            req.dependency_extras,
+            req.version_constraint,
+            req.dependency_extras_arr,
+            req.parsable,
+            req.specifier_set,
+            req.distribution_key,
+            req.dependency_id
+        from page
+        join {table_names.REQUIREMENTS} req on req.requirement_id = page.key
+        for share of req
+        on conflict do nothing
+        returning 1
+        """
+
+        return await table_scan.update_key_range(
+            self.db_pool,
+            table_name=table_names.REQUIREMENTS,
+            key_column="requirement_id",
+            key_range=key_range,
+            update=insert,
+        )
+
+    @instrumentation.named_query
+    async def swap_partitioned(self):
+        """
+        Swaps the partitioned requirements table in place of the requirements table.
+        Should only be called once every record has been copied by
+        `copy_to_partitioned`.
+        """
+
+        async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute("select pypi_packages.swap_partitioned_requirements();")
+            await cursor.execute("commit;")
+
+    @instrumentation.named_query
+    async def vacuum_analyze_partition(self, partition_index: int):
+        """
+        Vacuums and analyzes a single partition of the (partitioned) requirements table.
+        """
+
+        async with self.db_pool.connection() as conn:
+            # Vacuum can't run inside of a transaction.
+            await conn.set_autocommit(True)
+            try:
+                await conn.execute(
+                    f"vacuum (analyze) {requirements_partition(partition_index)};"
+                )
+            finally:
+                await conn.set_autocommit(False)
+
+    @instrumentation.named_query
+    async def iter_grouped_version_constraints(
+        self,
+    ) -> AsyncIterable[tuple[str, list[str]]]:
+        """
+        Iterates over every dependency name in the requirements table and in shared
+        requirement sets, along with the distinct version constraints placed on that
+        dependency. Results are streamed from a server-side cursor, ordered by
+        dependency name using the "C" collation, which matches Python's string ordering.
+        """
+
+        async with (
+            self.read_pool.connection() as conn,
+            conn.cursor(row_factory=tuple_row, name='iter_grouped_version_constraints') as cursor,
+        ):
+            query = f"""
+            select
+                req.dependency_name                         dependency_name,
+                array_agg(distinct req.version_constraint)  version_constraints
+            from (
+                select dependency_name, version_constraint
+                from {table_names.REQUIREMENTS}
+                union all
+                select dependency_name, version_constraint
+                from {table_names.REQUIREMENT_SET_MEMBERS}
+            ) req
+            group by req.dependency_name
+            order by req.dependency_name collate "C"
+            """
+
+            await cursor.execute(query)
+            async for records in adaptive_batching.AdaptiveBatchSize.for_fetches(
+                constants.REQUIREMENTS_REPO_ITER_BATCH_SIZE
+            ).fetch(cursor):
+                for dependency_name, version_constraints in records:
+                    yield dependency_name, version_constraints
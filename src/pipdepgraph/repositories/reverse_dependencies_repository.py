@@ -0,0 +1,231 @@
+from psycopg_pool import AsyncConnectionPool
+from psycopg import AsyncCursor
+from psycopg.rows import dict_row
+
+from pipdepgraph import models, constants
+from pipdepgraph.repositories import table_names, table_scan, instrumentation
+
+
+class ReverseDependenciesRepository:
+    def __init__(self, db_pool: AsyncConnectionPool):
+        self.db_pool = db_pool
+
+    @instrumentation.named_query
+    async def get_dependents(
+        self,
+        dependency_name: str,
+        cursor: AsyncCursor | None = None,
+    ) -> list[models.ReverseDependency]:
+        """
+        Returns every package version that depends on `dependency_name`.
+        """
+
+        async def _get_dependents(cursor: AsyncCursor) -> list[models.ReverseDependency]:
+            query = f"""
+            select
+                rd.dependency_name,
+                rd.dependent_package_name,
+                rd.dependent_version_id
+            from {table_names.REVERSE_DEPENDENCIES} rd
+            where rd.dependency_name = %s
+            ;"""
+
+            await cursor.execute(query, [dependency_name], prepare=True)
+            return [models.ReverseDependency.from_dict(row) for row in await cursor.fetchall()]
+
+        if cursor:
+            return await _get_dependents(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor(row_factory=dict_row) as cursor:
+                return await _get_dependents(cursor)
+
+    @instrumentation.named_query
+    async def get_dependent_package_names(
+        self,
+        dependency_name: str,
+        cursor: AsyncCursor | None = None,
+    ) -> list[str]:
+        """
+        Returns the names of the packages that have at least one version that depends
+        on `dependency_name`.
+        """
+
+        async def _get_dependent_package_names(cursor: AsyncCursor) -> list[str]:
+            query = f"""
+            select distinct rd.dependent_package_name
+            from {table_names.REVERSE_DEPENDENCIES} rd
+            where rd.dependency_name = %s
+            ;"""
+
+            await cursor.execute(query, [dependency_name], prepare=True)
+            return [row["dependent_package_name"] for row in await cursor.fetchall()]
+
+        if cursor:
+            return await _get_dependent_package_names(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor(row_factory=dict_row) as cursor:
+                return await _get_dependent_package_names(cursor)
+
+    @instrumentation.named_query
+    async def add_reverse_dependency(
+        self,
+        *,
+        distribution_id: str,
+        dependency_name: str,
+        cursor: AsyncCursor | None = None,
+    ):
+        """
+        Records that the version of the distribution `distribution_id` depends on
+        `dependency_name`. Does nothing if that's already recorded.
+        """
+
+        async def _add_reverse_dependency(cursor: AsyncCursor):
+            query = f"""
+            insert into {table_names.REVERSE_DEPENDENCIES}
+            (dependency_name, dependent_package_name, dependent_version_id)
+            select %s, kv.package_name, kv.version_id
+            from {table_names.DISTRIBUTIONS} dist
+            join {table_names.VERSIONS} kv on {'kv.version_key = dist.version_key' if constants.JOIN_ON_COMPACT_KEYS else 'kv.version_id = dist.version_id'}
+            where dist.distribution_id = %s
+            on conflict do nothing
+            ;"""
+
+            await cursor.execute(query, [dependency_name, distribution_id], prepare=True)
+
+        if cursor:
+            await _add_reverse_dependency(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                await _add_reverse_dependency(cursor)
+                await cursor.execute("commit;")
+
+    @instrumentation.named_query
+    async def remove_reverse_dependency(
+        self,
+        *,
+        distribution_id: str,
+        dependency_name: str,
+        cursor: AsyncCursor | None = None,
+    ):
+        """
+        Removes the record that the version of the distribution `distribution_id`
+        depends on `dependency_name`, unless any of the version's distributions still
+        have a requirement on `dependency_name`.
+
+        Does nothing once the distribution itself has been deleted. Its reverse
+        dependencies are removed along with it by the
+        "reverse_dependencies_distribution_delete" trigger instead.
+        """
+
+        async def _remove_reverse_dependency(cursor: AsyncCursor):
+            query = f"""
+            delete from {table_names.REVERSE_DEPENDENCIES} rd
+            using {table_names.DISTRIBUTIONS} dist
+            where
+                dist.distribution_id = %(distribution_id)s
+                and rd.dependency_name = %(dependency_name)s
+                and rd.dependent_version_id = dist.version_id
+                and not exists (
+                    select 1
+                    from {table_names.DISTRIBUTIONS} sibling
+                    join {table_names.DISTRIBUTION_REQUIREMENTS} dr
+                        on dr.distribution_id = sibling.distribution_id
+                    where
+                        {'sibling.version_key = dist.version_key' if constants.JOIN_ON_COMPACT_KEYS else 'sibling.version_id = dist.version_id'}
+                        and dr.dependency_name = %(dependency_name)s
+                        and dr.parsable
+                )
+            ;"""
+
+            await cursor.execute(
+                query,
+                dict(distribution_id=distribution_id, dependency_name=dependency_name),
+                prepare=True,
+            )
+
+        if cursor:
+            await _remove_reverse_dependency(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                await _remove_reverse_dependency(cursor)
+                await cursor.execute("commit;")
+
+    @instrumentation.named_query
+    async def refresh_version_of_distribution(
+        self,
+        *,
+        distribution_id: str,
+        cursor: AsyncCursor | None = None,
+    ):
+        """
+        Brings the reverse dependencies of the version of the distribution
+        `distribution_id` in line with the requirements of all of that version's
+        distributions, adding and removing records as needed.
+        """
+
+        async def _refresh_version_of_distribution(cursor: AsyncCursor):
+            query = f"""
+            with version as (
+                select kv.version_id, kv.version_key, kv.package_name
+                from {table_names.DISTRIBUTIONS} dist
+                join {table_names.VERSIONS} kv on {'kv.version_key = dist.version_key' if constants.JOIN_ON_COMPACT_KEYS else 'kv.version_id = dist.version_id'}
+                where dist.distribution_id = %(distribution_id)s
+            ),
+            dependencies as (
+                select distinct dr.dependency_name
+                from version
+                join {table_names.DISTRIBUTIONS} sibling on {'sibling.version_key = version.version_key' if constants.JOIN_ON_COMPACT_KEYS else 'sibling.version_id = version.version_id'}
+                join {table_names.DISTRIBUTION_REQUIREMENTS} dr
+                    on dr.distribution_id = sibling.distribution_id
+                where dr.parsable
+            ),
+            removed as (
+                delete from {table_names.REVERSE_DEPENDENCIES} rd
+                using version
+                where
+                    rd.dependent_version_id = version.version_id
+                    and rd.dependency_name not in (select dependency_name from dependencies)
+            )
+            insert into {table_names.REVERSE_DEPENDENCIES}
+            (dependency_name, dependent_package_name, dependent_version_id)
+            select dependencies.dependency_name, version.package_name, version.version_id
+            from version, dependencies
+            on conflict do nothing
+            ;"""
+
+            await cursor.execute(query, dict(distribution_id=distribution_id), prepare=True)
+
+        if cursor:
+            await _refresh_version_of_distribution(cursor)
+        else:
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                await _refresh_version_of_distribution(cursor)
+                await cursor.execute("commit;")
+
+    @instrumentation.named_query
+    async def rebuild_key_range(self, key_range: table_scan.KeyRange) -> int:
+        """
+        Records the reverse dependencies of every distribution within `key_range`.
+        Returns the number of records added.
+        """
+
+        insert = f"""
+        insert into {table_names.REVERSE_DEPENDENCIES}
+        (dependency_name, dependent_package_name, dependent_version_id)
+        select distinct dr.dependency_name, kv.package_name, kv.version_id
+        from page
+        join {table_names.DISTRIBUTIONS} dist on dist.distribution_id = page.key
+        join {table_names.VERSIONS} kv on {'kv.version_key = dist.version_key' if constants.JOIN_ON_COMPACT_KEYS else 'kv.version_id = dist.version_id'}
+        join {table_names.DISTRIBUTION_REQUIREMENTS} dr on dr.distribution_id = dist.distribution_id
+        where dr.parsable
+        on conflict do nothing
+        returning 1
+        """
+
+        return await table_scan.update_key_range(
+            self.db_pool,
+            table_name=table_names.DISTRIBUTIONS,
+            key_column="distribution_id",
+            key_range=key_range,
+            update=insert,
+        )
@@ -2,7 +2,16 @@ PACKAGE_NAMES = "pypi_packages.package_names"
 VERSIONS = "pypi_packages.versions"
 DISTRIBUTIONS = "pypi_packages.distributions"
 REQUIREMENTS = "pypi_packages.requirements"
+REQUIREMENTS_PARTITIONED = "pypi_packages.requirements_partitioned"
 CANDIDATES = "pypi_packages.candidates"
+CONSTRAINT_CANDIDATES = "pypi_packages.constraint_candidates"
+CONSTRAINT_CANDIDATES_STAGING = "pypi_packages.constraint_candidates_staging"
+REQUIREMENT_CANDIDATES = "pypi_packages.requirement_candidates"
+VERSION_ORDERS = "pypi_packages.version_orders"
+REQUIREMENT_SETS = "pypi_packages.requirement_sets"
+REQUIREMENT_SET_MEMBERS = "pypi_packages.requirement_set_members"
+DISTRIBUTION_REQUIREMENTS = "pypi_packages.distribution_requirements"
+REVERSE_DEPENDENCIES = "pypi_packages.reverse_dependencies"
 
 CDC_EVENT_LOG = "cdc.event_log"
 CDC_OFFSETS = "cdc.offsets"
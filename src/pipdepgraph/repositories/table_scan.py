@@ -0,0 +1,234 @@
+from typing import AsyncIterable, Awaitable, Callable, Sequence
+import asyncio
+import uuid
+
+from psycopg_pool import AsyncConnectionPool
+from psycopg.rows import tuple_row
+
+from pipdepgraph import constants
+from pipdepgraph.core import logical_decoding
+
+KeyRange = tuple[uuid.UUID | None, uuid.UUID | None]
+"""
+A half-open `(lower, upper)` range of primary keys. A bound of None is unbounded.
+"""
+
+
+def uuid_key_ranges(num_shards: int = constants.SCAN_NUM_SHARDS) -> list[KeyRange]:
+    """
+    Splits the UUID keyspace into `num_shards` disjoint ranges of equal width. Keys
+    generated by `gen_random_uuid()` are spread evenly across the ranges, so each
+    range covers roughly the same number of rows.
+    """
+
+    step = (1 << 128) // num_shards
+    bounds = [None, *(uuid.UUID(int=step * i) for i in range(1, num_shards)), None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def process_key_ranges(key_ranges: list[KeyRange]) -> list[KeyRange]:
+    """
+    Returns the subset of `key_ranges` that this process is responsible for, based
+    on `SCAN_PROCESS_INDEX` and `SCAN_PROCESS_COUNT`. Running `SCAN_PROCESS_COUNT`
+    processes with distinct indexes covers every range exactly once.
+    """
+
+    return key_ranges[constants.SCAN_PROCESS_INDEX::constants.SCAN_PROCESS_COUNT]
+
+
+async def iter_key_range(
+    db_pool: AsyncConnectionPool,
+    *,
+    select: str,
+    key_column: str,
+    key_index: int,
+    key_range: KeyRange,
+    where: Sequence[str] = (),
+    params: Sequence = (),
+    batch_size: int = constants.SCAN_BATCH_SIZE,
+) -> AsyncIterable[tuple]:
+    """
+    Iterates over the rows of `select` (a "select ... from ..." clause) whose
+    `key_column` falls within `key_range`, in key order. `key_index` is the position
+    of the key column in the selected rows.
+
+    Uses keyset pagination: each page is a separate, short query that resumes after
+    the last key of the previous page using the primary key index. A connection is
+    only held while a page is being fetched, and no server-side cursor is kept open
+    between pages.
+    """
+
+    lower, upper = key_range
+    last_key = None
+
+    while True:
+        conditions = list(where)
+        page_params = list(params)
+
+        if lower is not None:
+            conditions.append(f"{key_column} >= %s")
+            page_params.append(lower)
+        if upper is not None:
+            conditions.append(f"{key_column} < %s")
+            page_params.append(upper)
+        if last_key is not None:
+            conditions.append(f"{key_column} > %s")
+            page_params.append(last_key)
+
+        query = select
+        if conditions:
+            query += " where " + " and ".join(f"({c})" for c in conditions)
+        query += f" order by {key_column} limit %s "
+        page_params.append(batch_size)
+
+        async with (
+            db_pool.connection() as conn,
+            conn.cursor(row_factory=tuple_row) as cursor,
+        ):
+            await cursor.execute(query, page_params)
+            records = await cursor.fetchall()
+
+        for record in records:
+            yield record
+
+        if len(records) < batch_size:
+            return
+
+        last_key = records[-1][key_index]
+
+
+async def merge_iters[T](
+    iterables: list[AsyncIterable[T]],
+    max_buffered: int = constants.SCAN_BATCH_SIZE,
+) -> AsyncIterable[T]:
+    """
+    Consumes each of the `iterables` concurrently, yielding their items as they
+    arrive. Items from different iterables are interleaved in no particular order.
+    """
+
+    item_queue: asyncio.Queue[tuple[bool, T | Exception | None]] = asyncio.Queue(
+        maxsize=max_buffered
+    )
+
+    async def _drain(iterable: AsyncIterable[T]):
+        try:
+            async for item in iterable:
+                await item_queue.put((False, item))
+        except Exception as ex:
+            await item_queue.put((True, ex))
+        else:
+            await item_queue.put((True, None))
+
+    tasks = [asyncio.create_task(_drain(iterable)) for iterable in iterables]
+    try:
+        num_done = 0
+        while num_done < len(tasks):
+            done, item = await item_queue.get()
+            if not done:
+                yield item
+            elif item is not None:
+                raise item
+            else:
+                num_done += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def run_sharded(
+    key_ranges: list[KeyRange],
+    worker: Callable[[KeyRange], Awaitable[None]],
+    concurrency: int = constants.SCAN_CONCURRENCY,
+) -> None:
+    """
+    Runs `worker` once per key range, with at most `concurrency` workers running
+    at a time.
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(key_range: KeyRange):
+        async with semaphore:
+            await worker(key_range)
+
+    await asyncio.gather(*(_run(key_range) for key_range in key_ranges))
+
+
+async def update_key_range(
+    db_pool: AsyncConnectionPool,
+    *,
+    table_name: str,
+    key_column: str,
+    key_range: KeyRange,
+    update: str,
+    batch_size: int = constants.SCAN_BATCH_SIZE,
+) -> int:
+    """
+    Applies `update` to every row of `table_name` whose `key_column` falls within
+    `key_range`, one keyset page at a time, committing after each page. Returns the
+    number of rows affected.
+
+    `update` is a data-modifying statement which returns one row per affected row,
+    like "update ... from page where ... returning 1", or "insert ... select ... from
+    page ... returning 1". "page" holds the keys of the current page in its "key"
+    column. Committing per
+    page keeps transactions short, so that long backfills don't hold locks or bloat
+    the table with dead tuples.
+    """
+
+    lower, upper = key_range
+    last_key = None
+    num_updated = 0
+
+    async with (
+        db_pool.connection() as conn,
+        conn.cursor(row_factory=tuple_row) as cursor,
+    ):
+        while True:
+            conditions = []
+            params = []
+
+            if lower is not None:
+                conditions.append(f"{key_column} >= %s")
+                params.append(lower)
+            if upper is not None:
+                conditions.append(f"{key_column} < %s")
+                params.append(upper)
+            if last_key is not None:
+                conditions.append(f"{key_column} > %s")
+                params.append(last_key)
+
+            query = f"""
+            with page as (
+                select {key_column} as key
+                from {table_name}
+                {"where " + " and ".join(conditions) if conditions else ""}
+                order by {key_column}
+                limit %s
+            ),
+            updated as (
+                {update}
+            )
+            select
+                (select count(*) from page),
+                (select count(*) from updated),
+                (select page.key from page order by page.key desc limit 1)
+            ;"""
+            params.append(batch_size)
+
+            # Both, whatever this process's CDC_SOURCE is, since it needn't match the
+            # publisher's.
+            await cursor.execute("set local cdc.skip_events = 'on';")
+            await cursor.execute(
+                "select pg_logical_emit_message(true, %s, 'on');",
+                [logical_decoding.SKIP_EVENTS_MESSAGE_PREFIX],
+            )
+            await cursor.execute(query, params)
+            (num_keys, page_updated, page_last_key), = await cursor.fetchall()
+            await cursor.execute("commit;")
+
+            num_updated += page_updated
+            if num_keys < batch_size:
+                return num_updated
+
+            last_key = page_last_key
@@ -1,12 +1,17 @@
 from typing import AsyncIterable
-import itertools
 
 from psycopg_pool import AsyncConnectionPool
 from psycopg import AsyncCursor
-from psycopg.rows import dict_row, DictRow
+from psycopg.rows import dict_row, tuple_row, DictRow
 
 from pipdepgraph import models, constants
-from pipdepgraph.repositories import table_names
+from pipdepgraph.repositories import (
+    table_names,
+    adaptive_batching,
+    bulk_copy,
+    table_scan,
+    instrumentation,
+)
 
 
 def format_pg_integer_array(array: tuple[int | None, ...]) -> str:
@@ -24,9 +29,18 @@ def format_pg_integer_array(array: tuple[int | None, ...]) -> str:
 
 
 class VersionsRepository:
-    def __init__(self, db_pool: AsyncConnectionPool):
+    def __init__(
+        self,
+        db_pool: AsyncConnectionPool,
+        read_pool: AsyncConnectionPool | None = None,
+    ):
         self.db_pool = db_pool
+        self.read_pool = read_pool or db_pool
+        self._insert_versions_batch_sizes = adaptive_batching.PerConnection(
+            adaptive_batching.AdaptiveBatchSize.for_writes
+        )
 
+    @instrumentation.named_query
     async def insert_versions(
         self,
         versions: list[models.Version],
@@ -42,76 +56,157 @@ class VersionsRepository:
         if not versions:
             return None
 
-        async def _insert_versions(cursor: AsyncCursor[DictRow]) -> None:
-            PARAMS_PER_INSERT = 13
-            for version_batch in itertools.batched(
-                versions, constants.POSTGRES_MAX_QUERY_PARAMS // PARAMS_PER_INSERT
-            ):
-                query = f"""
-                INSERT INTO {table_names.VERSIONS}
+        async def _copy_versions(
+            cursor: AsyncCursor[DictRow],
+            versions: list[models.Version],
+        ) -> None:
+            await bulk_copy.copy_into_temp_table(
+                cursor,
+                "versions_copy",
+                [
+                    ("package_name", "text"),
+                    ("package_version", "text"),
+                    ("date_discovered", "timestamp"),
+                    ("epoch", "bigint"),
+                    ("package_release", "bigint[]"),
+                    ("pre_0", "text"),
+                    ("pre_1", "bigint"),
+                    ("post", "bigint"),
+                    ("dev", "bigint"),
+                    ('"local"', "text"),
+                    ("is_prerelease", "boolean"),
+                    ("is_postrelease", "boolean"),
+                    ("is_devrelease", "boolean"),
+                ],
                 (
-                    package_name, package_version, date_discovered,
-                    epoch, package_release, pre_0, pre_1, post, dev, "local",
-                    is_prerelease, is_postrelease, is_devrelease
-                )
-                VALUES
-                """
+                    (
+                        version.package_name,
+                        version.package_version,
+                        version.date_discovered,
+                        version.epoch,
+                        list(version.package_release) if version.package_release is not None else None,
+                        version.pre[0] if version.pre is not None else None,
+                        version.pre[1] if version.pre is not None else None,
+                        version.post,
+                        version.dev,
+                        version.local,
+                        version.is_prerelease,
+                        version.is_postrelease,
+                        version.is_devrelease,
+                    )
+                    for version in versions
+                ),
+            )
 
-                query += ",".join(
-                    " ( %s, %s, coalesce(%s, now()), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s ) "
-                    for _ in range(len(version_batch))
-                )
+            # "distinct on" guards against the same name/version appearing twice in one
+            # batch, which "on conflict do update" would otherwise reject.
+            query = f"""
+            INSERT INTO {table_names.VERSIONS}
+            (
+                package_name, package_version, date_discovered,
+                epoch, package_release, pre_0, pre_1, post, dev, "local",
+                is_prerelease, is_postrelease, is_devrelease
+            )
+            select distinct on (package_name, package_version)
+                package_name, package_version, coalesce(date_discovered, now()),
+                epoch, package_release, pre_0, pre_1, post, dev, "local",
+                is_prerelease, is_postrelease, is_devrelease
+            from versions_copy
+            on conflict (package_name, package_version) do update set
+                epoch = EXCLUDED.epoch,
+                package_release = EXCLUDED.package_release,
+                pre_0 = EXCLUDED.pre_0,
+                pre_1 = EXCLUDED.pre_1,
+                post = EXCLUDED.post,
+                dev = EXCLUDED.dev,
+                "local" = EXCLUDED."local",
+                is_prerelease = EXCLUDED.is_prerelease,
+                is_postrelease = EXCLUDED.is_postrelease,
+                is_devrelease = EXCLUDED.is_devrelease
+            ;"""
 
-                query += """
-                on conflict (package_name, package_version) do update set
-                    epoch = EXCLUDED.epoch,
-                    package_release = EXCLUDED.package_release,
-                    pre_0 = EXCLUDED.pre_0,
-                    pre_1 = EXCLUDED.pre_1,
-                    post = EXCLUDED.post,
-                    dev = EXCLUDED.dev,
-                    "local" = EXCLUDED."local",
-                    is_prerelease = EXCLUDED.is_prerelease,
-                    is_postrelease = EXCLUDED.is_postrelease,
-                    is_devrelease = EXCLUDED.is_devrelease
-                ;"""
-
-                params: list = [None] * PARAMS_PER_INSERT * len(version_batch)
-                offset = 0
-                for version in version_batch:
-                    params[offset + 0] = version.package_name
-                    params[offset + 1] = version.package_version
-                    params[offset + 2] = version.date_discovered
-                    params[offset + 3] = version.epoch
-                    params[offset + 4] = (
-                        format_pg_integer_array(version.package_release)
-                        if version.package_release is not None
-                        else None
-                    )
-                    params[offset + 5] = version.pre[0] if version.pre is not None else None
-                    params[offset + 6] = version.pre[1] if version.pre is not None else None
-                    params[offset + 7] = version.post
-                    params[offset + 8] = version.dev
-                    params[offset + 9] = version.local
-                    params[offset + 10] = version.is_prerelease
-                    params[offset + 11] = version.is_postrelease
-                    params[offset + 12] = version.is_devrelease
+            await cursor.execute(query)
 
-                    offset += PARAMS_PER_INSERT
+        async def _insert_versions(
+            cursor: AsyncCursor[DictRow],
+            versions: list[models.Version],
+        ) -> None:
+            if bulk_copy.should_copy(versions, cursor):
+                return await _copy_versions(cursor, versions)
 
-                await cursor.execute(query, params)
+            # Jagged package_release arrays can't be bound as a 2D array, so they're
+            # bound as array literals and cast back.
+            query = f"""
+            INSERT INTO {table_names.VERSIONS}
+            (
+                package_name, package_version, date_discovered,
+                epoch, package_release, pre_0, pre_1, post, dev, "local",
+                is_prerelease, is_postrelease, is_devrelease
+            )
+            select
+                v.package_name, v.package_version, coalesce(v.date_discovered, now()),
+                v.epoch, v.package_release::bigint[], v.pre_0, v.pre_1, v.post, v.dev, v."local",
+                v.is_prerelease, v.is_postrelease, v.is_devrelease
+            from unnest(
+                %s::text[], %s::text[], %s::timestamp[],
+                %s::bigint[], %s::text[], %s::text[], %s::bigint[], %s::bigint[], %s::bigint[], %s::text[],
+                %s::boolean[], %s::boolean[], %s::boolean[]
+            ) as v(
+                package_name, package_version, date_discovered,
+                epoch, package_release, pre_0, pre_1, post, dev, "local",
+                is_prerelease, is_postrelease, is_devrelease
+            )
+            on conflict (package_name, package_version) do update set
+                epoch = EXCLUDED.epoch,
+                package_release = EXCLUDED.package_release,
+                pre_0 = EXCLUDED.pre_0,
+                pre_1 = EXCLUDED.pre_1,
+                post = EXCLUDED.post,
+                dev = EXCLUDED.dev,
+                "local" = EXCLUDED."local",
+                is_prerelease = EXCLUDED.is_prerelease,
+                is_postrelease = EXCLUDED.is_postrelease,
+                is_devrelease = EXCLUDED.is_devrelease
+            ;"""
+
+            params = (
+                [version.package_name for version in versions],
+                [version.package_version for version in versions],
+                [version.date_discovered for version in versions],
+                [version.epoch for version in versions],
+                [
+                    format_pg_integer_array(version.package_release)
+                    if version.package_release is not None
+                    else None
+                    for version in versions
+                ],
+                [version.pre[0] if version.pre is not None else None for version in versions],
+                [version.pre[1] if version.pre is not None else None for version in versions],
+                [version.post for version in versions],
+                [version.dev for version in versions],
+                [version.local for version in versions],
+                [version.is_prerelease for version in versions],
+                [version.is_postrelease for version in versions],
+                [version.is_devrelease for version in versions],
+            )
+
+            await cursor.execute(query, params, prepare=True)
 
         if cursor:
-            await _insert_versions(cursor)
+            batch_size = self._insert_versions_batch_sizes.get(cursor.connection)
+            await batch_size.write_batches(versions, cursor, _insert_versions)
         else:
             async with (
                 self.db_pool.connection() as conn,
                 conn.cursor(row_factory=dict_row) as local_cursor
             ):
-                await _insert_versions(local_cursor)
-                await local_cursor.execute("commit;")
+                batch_size = self._insert_versions_batch_sizes.get(conn)
+                await batch_size.write_batches(
+                    versions, local_cursor, _insert_versions, commit=True
+                )
 
 
+    @instrumentation.named_query
     async def update_version(
         self,
         version: models.Version,
@@ -179,6 +274,7 @@ class VersionsRepository:
                 await cursor.execute("commit;")
                 return result
 
+    @instrumentation.named_query
     async def get_versions(
         self,
         *,
@@ -199,11 +295,23 @@ class VersionsRepository:
         if not package_name:
             raise ValueError("Package name not specified. Result set will be too large.")
 
-        versions = []
-        async for v in self.iter_versions(cursor=cursor, package_name=package_name, package_version=package_version):
-            versions.append(v)
-        return versions
+        async def _get_versions(cursor: AsyncCursor) -> list[models.Version]:
+            return [
+                v
+                async for v in self.iter_versions(
+                    cursor=cursor, package_name=package_name, package_version=package_version
+                )
+            ]
+
+        if cursor:
+            return await _get_versions(cursor)
+        else:
+            # Lookups are usually followed by writes that depend on them, so they read
+            # from the primary, rather than from the read pool like `iter_versions`.
+            async with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                return await _get_versions(cursor)
 
+    @instrumentation.named_query
     async def iter_versions(
         self,
         *,
@@ -265,19 +373,131 @@ class VersionsRepository:
                 params.append(package_version)
 
             await cursor.execute(query, params)
-            records = await cursor.fetchmany(size=constants.VERSIONS_REPO_ITER_BATCH_SIZE)
-            while records:
+            async for records in adaptive_batching.AdaptiveBatchSize.for_fetches(
+                constants.VERSIONS_REPO_ITER_BATCH_SIZE
+            ).fetch(cursor):
                 for record in records:
-                    yield models.Version.from_dict(record)
-                records = await cursor.fetchmany(size=constants.VERSIONS_REPO_ITER_BATCH_SIZE)
+                    yield models.Version.from_row(record)
 
         if cursor:
-            async for record in _iter_versions(cursor):
-                yield record
+            # Rows are read positionally, so a sibling cursor is opened within the
+            # caller's transaction, rather than relying on the caller's row factory.
+            async with cursor.connection.cursor(row_factory=tuple_row) as row_cursor:
+                async for record in _iter_versions(row_cursor):
+                    yield record
         else:
             async with (
-                self.db_pool.connection() as conn,
-                conn.cursor(row_factory=dict_row) as local_cursor,
+                self.read_pool.connection() as conn,
+                conn.cursor(row_factory=tuple_row) as local_cursor,
             ):
                 async for record in _iter_versions(local_cursor):
                     yield record
+
+    @instrumentation.named_query
+    async def iter_versions_in_key_range(
+        self,
+        key_range: table_scan.KeyRange,
+    ) -> AsyncIterable[models.Version]:
+        """
+        Iterates over the version records whose `version_id` falls within `key_range`,
+        using keyset pagination. See `table_scan` for splitting a full table scan into
+        key ranges which can be scanned in parallel.
+        """
+
+        select = f"""
+        select
+            kv.version_id,
+            kv.package_name,
+            kv.package_version,
+            kv.date_discovered,
+            kv.epoch,
+            kv.package_release,
+            kv.pre_0,
+            kv.pre_1,
+            kv.post,
+            kv.dev,
+            kv."local",
+            kv.is_prerelease,
+            kv.is_postrelease,
+            kv.is_devrelease
+        from {table_names.VERSIONS} kv
+        """
+
+        async for record in table_scan.iter_key_range(
+            self.read_pool,
+            select=select,
+            key_column="kv.version_id",
+            key_index=0,
+            key_range=key_range,
+        ):
+            yield models.Version.from_row(record)
+
+    @instrumentation.named_query
+    async def backfill_compact_keys(self, key_range: table_scan.KeyRange) -> int:
+        """
+        Assigns `version_key` and `package_id` to the version records within
+        `key_range` that are missing them. Returns the number of records updated.
+        """
+
+        update = f"""
+        update {table_names.VERSIONS} kv set
+            version_key = coalesce(kv.version_key, nextval('pypi_packages.version_key_seq')),
+            package_id = coalesce(kv.package_id, kpn.package_id)
+        from page, {table_names.PACKAGE_NAMES} kpn
+        where
+            kv.version_id = page.key
+            and kpn.package_name = kv.package_name
+            and (kv.version_key is null or kv.package_id is null)
+        returning 1
+        """
+
+        return await table_scan.update_key_range(
+            self.db_pool,
+            table_name=table_names.VERSIONS,
+            key_column="version_id",
+            key_range=key_range,
+            update=update,
+        )
+
+    @instrumentation.named_query
+    async def iter_grouped_versions(
+        self,
+    ) -> AsyncIterable[tuple[str, list[models.Version]]]:
+        """
+        Iterates over every package name in the versions table, along with that
+        package's versions. Only the `version_id`, `package_name` and `package_version`
+        fields of the version records are populated. Results are streamed from a
+        server-side cursor, ordered by package name using the "C" collation, which
+        matches Python's string ordering.
+        """
+
+        async with (
+            self.read_pool.connection() as conn,
+            conn.cursor(row_factory=tuple_row, name='iter_grouped_versions') as cursor,
+        ):
+            query = f"""
+            select
+                kv.package_name                package_name,
+                array_agg(kv.version_id)       version_ids,
+                array_agg(kv.package_version)  package_versions
+            from {table_names.VERSIONS} kv
+            group by kv.package_name
+            order by kv.package_name collate "C"
+            """
+
+            await cursor.execute(query)
+            async for records in adaptive_batching.AdaptiveBatchSize.for_fetches(
+                constants.VERSIONS_REPO_ITER_BATCH_SIZE
+            ).fetch(cursor):
+                for package_name, version_ids, package_versions in records:
+                    yield package_name, [
+                        models.Version(
+                            version_id=version_id,
+                            package_name=package_name,
+                            package_version=package_version,
+                            date_discovered=None,
+                        )
+                        for version_id, package_version in zip(
+                            version_ids, package_versions
+                        )
+                    ]
@@ -1,13 +1,19 @@
+import asyncio
+import concurrent.futures
 import datetime
+import itertools
 import logging
+from typing import AsyncIterable
 
 import packaging
 import packaging.specifiers
 import packaging.version
 from psycopg_pool import AsyncConnectionPool
+from psycopg import AsyncCursor
 from psycopg.rows import dict_row
 
-from pipdepgraph import models
+from pipdepgraph import models, constants
+from pipdepgraph.core import matching
 from pipdepgraph.repositories import (
     requirements_repository,
     versions_repository,
@@ -19,7 +25,17 @@ logger = logging.getLogger(__name__)
 class CandidateCorrelationService:
     """
     The candidate correlation service matches up requirement records and
-    version records, maintaining the "candidates" table in postgres.
+    version records, maintaining the "constraint_candidates" table in postgres.
+    Candidates are stored once per distinct `(dependency_name, version_constraint)`
+    pair, rather than once per requirement.
+
+    Candidates are encoded according to `CANDIDATES_ENCODING`. With the "ranges"
+    encoding, each package's versions are assigned stable ordinals in the
+    "version_orders" table, and candidates are stored as ranges of those ordinals.
+
+    Specifier matching is pure CPU work. If an `executor` is provided (normally a
+    `ProcessPoolExecutor`), matching is batched and offloaded to it, keeping the
+    event loop free for DB I/O and spreading the work across every core.
     """
 
     def __init__(
@@ -29,11 +45,14 @@ class CandidateCorrelationService:
         vr: versions_repository.VersionsRepository,
         rr: requirements_repository.RequirementsRepository,
         cr: candidates_repository.CandidatesRepository,
+        executor: concurrent.futures.Executor | None = None,
     ):
         self.db_pool = db_pool
         self.versions_repo = vr
         self.requirements_repo = rr
         self.candidates_repo = cr
+        self.executor = executor
+        self.encode_ranges = constants.CANDIDATES_ENCODING == "ranges"
 
 
     async def process_version_record(
@@ -41,21 +60,387 @@ class CandidateCorrelationService:
         version: models.Version,
     ):
         """
-        Processes a single version record, finding requirements that the version
-        can satisfy.
+        Processes a single newly discovered version record, adding it to the
+        candidate lists of the requirements that the version can satisfy.
+
+        Rather than revisiting every requirement on the package, this parses each
+        distinct version constraint on the package once, and updates all of the
+        requirements sharing an accepting constraint in a single statement. A new
+        release of a popular package costs O(distinct constraints), not
+        O(requirements).
+
+        In the common case, where the new version is newer than every other version
+        of the package, the version is prepended to the existing candidate arrays.
+        Otherwise (backports, and the pre-release edge cases of
+        `SpecifierSet.filter`), the affected constraints are recomputed in full.
+        With the "ranges" encoding, ordinals are stable, so backports are added to
+        the existing candidates like any other version.
+        """
+
+        if not version.package_name or not version.version_id:
+            return
+
+        try:
+            new_parsed_version = packaging.version.Version(version.package_version)
+        except Exception:
+            logger.error("Error while parsing version: %s.", version.package_version, exc_info=True)
+            return
+
+        async with self.db_pool.connection() as conn, conn.cursor(
+            row_factory=dict_row
+        ) as cursor:
+            # Held until the commit below, so that `process_requirement_record` can't
+            # write candidates matched against versions read before this one.
+            await self.candidates_repo.lock_dependency(version.package_name, cursor)
+
+            version_constraints = await self.requirements_repo.get_distinct_version_constraints(
+                dependency_name=version.package_name,
+                cursor=cursor,
+            )
+
+            if not version_constraints:
+                return
+
+            logger.info(
+                "Checking %s distinct constraints on: %s==%s",
+                len(version_constraints),
+                version.package_name,
+                version.package_version,
+            )
+
+            versions = await self.order_versions(
+                version.package_name,
+                await self.versions_repo.get_versions(
+                    package_name=version.package_name,
+                    cursor=cursor,
+                ),
+                cursor=cursor,
+            )
+
+            # Events logged before the CDC triggers fired after the write include an
+            # INSERT for every upsert of an existing version, with a generated version_id
+            # that was never stored. Those aren't new versions.
+            ordinal = next(
+                (
+                    ordinal
+                    for ordinal, v in enumerate(versions)
+                    if str(v.version_id) == str(version.version_id)
+                ),
+                None,
+            )
+            if ordinal is None:
+                logger.debug(
+                    "Skipping %s==%s, version %s isn't stored.",
+                    version.package_name,
+                    version.package_version,
+                    version.version_id,
+                )
+                return
+
+            existing_parsed_versions = [
+                parsed_version
+                for v in versions
+                if str(v.version_id) != str(version.version_id)
+                and (parsed_version := _try_parse_version(v.package_version)) is not None
+            ]
+
+            is_newest_version = all(
+                new_parsed_version > v for v in existing_parsed_versions
+            )
+
+            existing_final_versions = sorted(
+                (v for v in existing_parsed_versions if not v.is_prerelease),
+                reverse=True,
+            )
+
+            prepend_constraints: list[str] = []
+            recompute_specifier_sets: dict[str, packaging.specifiers.SpecifierSet] = {}
+
+            for version_constraint in version_constraints:
+                try:
+                    req_specifier_set = packaging.specifiers.SpecifierSet(version_constraint)
+                except Exception:
+                    continue
+
+                if not req_specifier_set.contains(new_parsed_version, prereleases=True):
+                    continue
+
+                if not is_newest_version and not self.encode_ranges:
+                    recompute_specifier_sets[version_constraint] = req_specifier_set
+                    continue
+
+                has_final_candidate = any(
+                    req_specifier_set.contains(v)
+                    for v in existing_final_versions
+                )
+
+                if not new_parsed_version.is_prerelease:
+                    if has_final_candidate or req_specifier_set.prereleases:
+                        prepend_constraints.append(version_constraint)
+                    else:
+                        # Any pre-releases previously accepted by the constraint
+                        # are dropped once a final release matches it.
+                        recompute_specifier_sets[version_constraint] = req_specifier_set
+                elif req_specifier_set.contains(new_parsed_version) or not has_final_candidate:
+                    prepend_constraints.append(version_constraint)
+
+            try:
+                # Records written under the other encoding can't be updated in place,
+                # so they're recomputed, which rewrites them in the current encoding.
+                if self.encode_ranges:
+                    reencode_constraints = await self.candidates_repo.add_candidate_ordinal(
+                        dependency_name=version.package_name,
+                        version_constraints=prepend_constraints,
+                        ordinal=ordinal,
+                        cursor=cursor,
+                    )
+                else:
+                    reencode_constraints = await self.candidates_repo.prepend_candidate_version(
+                        dependency_name=version.package_name,
+                        version_constraints=prepend_constraints,
+                        version=version,
+                        cursor=cursor,
+                    )
+
+                recomputed_candidates = await self.match_constraints(
+                    version.package_name,
+                    versions,
+                    [*recompute_specifier_sets.keys(), *reencode_constraints],
+                )
+
+                await self.candidates_repo.upsert_constraint_candidates(
+                    [cc for cc in recomputed_candidates if cc is not None],
+                    cursor=cursor,
+                )
+
+                await cursor.execute("commit;")
+
+            except Exception:
+                await cursor.execute("rollback;")
+                raise
+
+            logger.info(
+                "%s==%s - Prepended to %s constraints, recomputed %s constraints.",
+                version.package_name,
+                version.package_version,
+                len(prepend_constraints),
+                len(recompute_specifier_sets),
+            )
+
+
+    async def order_versions(
+        self,
+        dependency_name: str,
+        versions: list[models.Version],
+        cursor: AsyncCursor | None = None,
+    ) -> list[models.Version]:
+        """
+        With the "ranges" encoding, returns the versions of the `dependency_name`
+        package in its version order, such that each version's index in the result is
+        its ordinal. `versions` which are missing from the version order are added to
+        it. Otherwise, returns `versions` as-is.
+        """
+
+        if not self.encode_ranges:
+            return versions
+
+        version_order = await self.candidates_repo.sync_version_order(
+            dependency_name, versions, cursor=cursor
+        )
+
+        return [
+            models.Version(
+                version_id=version_id,
+                package_name=dependency_name,
+                package_version=package_version,
+                date_discovered=None,
+            )
+            for version_id, package_version in zip(
+                version_order.version_ids, version_order.package_versions
+            )
+        ]
+
+
+    async def match_constraints(
+        self,
+        dependency_name: str,
+        versions: list[models.Version],
+        version_constraints: list[str],
+    ) -> list[models.ConstraintCandidate | None]:
+        """
+        Matches each of the `version_constraints` against the `versions` of the
+        `dependency_name` package, returning one result per constraint, in order. Results
+        are `None` for constraints that can't be parsed.
 
-        TODO: This method is probably way too slow for popular packages. Recheck
-        this once we're not redoing the entire reqs table. It might be better to
-        use iter_requirements on the package name and pump those requirements into
-        RabbitMQ.
+        Without an executor, matching runs inline. With one, the constraints are
+        split into batches of `CANDIDATE_CORRELATION_MATCH_BATCH_SIZE`, and the
+        batches are matched concurrently. Workers return compact index arrays, which
+        are only expanded into version strings and IDs here.
+
+        With the "ranges" encoding, `versions` must be ordered by `order_versions`,
+        and results are encoded as ranges of ordinals instead of arrays.
+        """
+
+        if not version_constraints:
+            return []
+
+        package_versions = [version.package_version for version in versions]
+
+        if self.executor is None:
+            index_arrays = matching.match_version_constraints(
+                package_versions, version_constraints
+            )
+        else:
+            loop = asyncio.get_running_loop()
+            batch_results = await asyncio.gather(*(
+                loop.run_in_executor(
+                    self.executor,
+                    matching.match_version_constraints,
+                    package_versions,
+                    list(version_constraint_batch),
+                )
+                for version_constraint_batch in itertools.batched(
+                    version_constraints,
+                    constants.CANDIDATE_CORRELATION_MATCH_BATCH_SIZE,
+                )
+            ))
+            index_arrays = list(itertools.chain.from_iterable(batch_results))
+
+        if self.encode_ranges:
+            return [
+                (
+                    None
+                    if indexes is None
+                    else models.ConstraintCandidate(
+                        dependency_name=dependency_name,
+                        version_constraint=version_constraint,
+                        candidate_versions=None,
+                        candidate_version_ids=None,
+                        candidate_ranges=matching.indexes_to_ranges(indexes),
+                    )
+                )
+                for version_constraint, indexes in zip(version_constraints, index_arrays)
+            ]
+
+        return [
+            (
+                None
+                if indexes is None
+                else models.ConstraintCandidate(
+                    dependency_name=dependency_name,
+                    version_constraint=version_constraint,
+                    candidate_versions=[versions[i].package_version for i in indexes],
+                    candidate_version_ids=[versions[i].version_id for i in indexes],
+                )
+            )
+            for version_constraint, indexes in zip(version_constraints, index_arrays)
+        ]
+
+
+    async def iter_rebuilt_constraint_candidates(
+        self,
+    ) -> AsyncIterable[models.ConstraintCandidate]:
+        """
+        Recomputes the shared candidate record of every distinct
+        `(dependency_name, version_constraint)` pair in the requirements table.
+
+        Constraints (grouped by dependency) and versions (grouped by package) are
+        streamed out of postgres in the same order and merge-joined, so neither side
+        is ever held in memory in full. Up to `CANDIDATE_REBUILD_MAX_PENDING_PACKAGES`
+        packages are matched concurrently, so that every worker of the executor stays
+        busy. Results are yielded in completion order.
+        """
+
+        grouped_versions = aiter(self.versions_repo.iter_grouped_versions())
+        current_package_name: str | None = None
+        current_versions: list[models.Version] = []
+        versions_exhausted = False
+
+        async def _versions_for(dependency_name: str) -> list[models.Version]:
+            nonlocal current_package_name, current_versions, versions_exhausted
+
+            while not versions_exhausted and (
+                current_package_name is None or current_package_name < dependency_name
+            ):
+                try:
+                    current_package_name, current_versions = await anext(grouped_versions)
+                except StopAsyncIteration:
+                    versions_exhausted = True
+
+            return await self.order_versions(
+                dependency_name,
+                current_versions if current_package_name == dependency_name else [],
+            )
+
+        pending: set[asyncio.Task[list[models.ConstraintCandidate | None]]] = set()
+
+        try:
+            async for dependency_name, version_constraints in self.requirements_repo.iter_grouped_version_constraints():
+                if not dependency_name or str.isspace(dependency_name):
+                    continue
+
+                versions = await _versions_for(dependency_name)
+                pending.add(asyncio.create_task(
+                    self.match_constraints(dependency_name, versions, version_constraints)
+                ))
+
+                if len(pending) < constants.CANDIDATE_REBUILD_MAX_PENDING_PACKAGES:
+                    continue
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for constraint_candidate in task.result():
+                        if constraint_candidate is not None:
+                            yield constraint_candidate
+
+            for task in asyncio.as_completed(pending):
+                for constraint_candidate in await task:
+                    if constraint_candidate is not None:
+                        yield constraint_candidate
+            pending = set()
+
+        finally:
+            for task in pending:
+                task.cancel()
+            await grouped_versions.aclose()
+
+
+    async def rebuild_constraint_candidates(self) -> int:
+        """
+        Rebuilds the "constraint_candidates" table from scratch. Results are loaded
+        into a staging table with COPY, and then swapped in place of the live table
+        in a single transaction. Returns the number of records written.
+
+        Changes made to the live table while the rebuild is running would be lost in
+        the swap, so `process_version_record` and `process_requirement_record` wait on
+        `lock_for_rebuild` until it's done. Their RabbitMQ messages stay unacked in the
+        meantime, and are redelivered if the broker's consumer timeout is hit first.
         """
 
         async with self.db_pool.connection() as conn, conn.cursor(
             row_factory=dict_row
         ) as cursor:
-            logger.info(f"Searching for requirements that depend on: {version.package_name}=={version.package_version}")
-            async for reverse_candidate in self.requirements_repo.iter_requirements(dependency_name=version.package_name):
-                ...
+            try:
+                logger.info("Waiting for candidate correlation to pause.")
+                await self.candidates_repo.lock_for_rebuild(cursor)
+
+                logger.info("Creating staging table.")
+                await self.candidates_repo.create_constraint_candidates_staging(cursor)
+
+                logger.info("Loading staging table.")
+                num_records = await self.candidates_repo.copy_constraint_candidates(
+                    self.iter_rebuilt_constraint_candidates(),
+                    cursor=cursor,
+                )
+
+                logger.info("Loaded %s records. Swapping staging table.", num_records)
+                await self.candidates_repo.swap_constraint_candidates_staging(cursor)
+                await cursor.execute("commit;")
+                return num_records
+
+            except Exception:
+                await cursor.execute("rollback;")
+                raise
 
 
     async def process_requirement_record(
@@ -75,38 +460,50 @@ class CandidateCorrelationService:
         if not requirement.dependency_name or str.isspace(requirement.dependency_name):
             return
 
-        try:
-            req_specifier_set = packaging.specifiers.SpecifierSet(requirement.version_constraint)
-        except Exception:
-            logger.error("Error while parsing specifier set: %s", requirement.version_constraint, exc_info=True)
-            return
+        # Requirements sharing a (dependency_name, version_constraint) pair share a
+        # single candidate record. It's recomputed in full, under the same lock
+        # `process_version_record` takes, so that a version added while the versions
+        # are being matched can't be missed, and so that republishing a requirement
+        # repairs its candidate record.
+        async with self.db_pool.connection() as conn, conn.cursor(
+            row_factory=dict_row
+        ) as cursor:
+            try:
+                await self.candidates_repo.lock_dependency(requirement.dependency_name, cursor)
 
-        versions = await self.versions_repo.get_versions(package_name=requirement.dependency_name)
-        package_version_to_version_model_map = {
-            version.package_version: version
-            for version in versions
-        }
+                versions = await self.order_versions(
+                    requirement.dependency_name,
+                    await self.versions_repo.get_versions(
+                        package_name=requirement.dependency_name,
+                        cursor=cursor,
+                    ),
+                    cursor=cursor,
+                )
 
-        parsed_version_to_package_version_map = {}
-        for version in versions:
-            try:
-                parsed_version = packaging.version.Version(version.package_version)
-                parsed_version_to_package_version_map[parsed_version] = version.package_version
-            except:
-                logger.error("Error while parsing version: %s.", version.package_version, exc_info=True)
-                pass
+                constraint_candidate, = await self.match_constraints(
+                    requirement.dependency_name, versions, [requirement.version_constraint]
+                )
 
-        try:
-            sorted_parsed_candidate_versions = sorted(req_specifier_set.filter(parsed_version_to_package_version_map.keys()), reverse=True)
-        except Exception:
-            logger.error("Error while filter-sorting requirements.", exc_info=True)
-            return
+                if constraint_candidate is None:
+                    logger.error("Error while parsing specifier set: %s", requirement.version_constraint)
+                    await cursor.execute("rollback;")
+                    return
+
+                await self.candidates_repo.upsert_constraint_candidates(
+                    [constraint_candidate],
+                    cursor=cursor,
+                )
+
+                await cursor.execute("commit;")
+
+            except Exception:
+                await cursor.execute("rollback;")
+                raise
 
-        candidate_versions_text = [parsed_version_to_package_version_map[v] for v in sorted_parsed_candidate_versions]
-        candidate_version_ids = [package_version_to_version_model_map[v].version_id for v in candidate_versions_text]
 
-        await self.candidates_repo.insert_candidate(models.Candidate(
-            requirement_id=requirement.requirement_id,
-            candidate_versions=candidate_versions_text,
-            candidate_version_ids=candidate_version_ids,
-        ))
+def _try_parse_version(package_version: str) -> packaging.version.Version | None:
+    try:
+        return packaging.version.Version(package_version)
+    except Exception:
+        logger.error("Error while parsing version: %s.", package_version, exc_info=True)
+        return None
@@ -6,10 +6,12 @@ from psycopg.rows import dict_row
 
 from psycopg_pool import AsyncConnectionPool
 from pipdepgraph import models, pypi_api, constants
+from pipdepgraph.core import common
 from pipdepgraph.repositories import (
     distributions_repository,
     package_names_repository,
     requirements_repository,
+    reverse_dependencies_repository,
 )
 
 from pipdepgraph.services import rabbitmq_publish_service
@@ -25,7 +27,9 @@ class DistributionProcessingService:
     - Deletes all requirement records linked to the distribution in postgres.
     - Fetches the distribution's `.metadata` file from the PyPI API (if it's a wheel).
     - Parses the metadata file, extracting the package's requirements (best effort).
-    - Persists the package's requirements to postgres.
+    - Persists the package's requirements to postgres. Depending on `REQUIREMENTS_STORAGE`,
+      either as requirement rows, or as a shared requirement set which is only inserted
+      if no other distribution has the exact same requirements.
     - (optional) Propagates newly discovered package names back to postgres/rabbitmq.
     - Marks the distribution as "processed" in postgres.
     """
@@ -39,10 +43,12 @@ class DistributionProcessingService:
         pypi: pypi_api.PypiApi,
         db_pool: AsyncConnectionPool,
         rmq_pub: rabbitmq_publish_service.RabbitMqPublishService = None,
+        rdr: reverse_dependencies_repository.ReverseDependenciesRepository = None,
     ):
         self.package_names_repo = pnr
         self.distributions_repo = dr
         self.requirements_repo = rr
+        self.reverse_dependencies_repo = rdr
         self.pypi = pypi
 
         self.db_pool = db_pool
@@ -57,6 +63,10 @@ class DistributionProcessingService:
         if isinstance(requirement, str):
             requirement = packaging.requirements.Requirement(requirement)
 
+        # Extras are a set, whose order varies between processes. Requirement sets are
+        # identified by a hash of their contents, so they're sorted.
+        dependency_extras = sorted(requirement.extras)
+
         return models.Requirement(
             requirement_id=None,
             distribution_id=distribution_id,
@@ -65,12 +75,12 @@ class DistributionProcessingService:
                 if requirement.marker
                 else ""
             ),
-            dependency_extras=",".join(requirement.extras),
+            dependency_extras=",".join(dependency_extras),
             dependency_name=packaging.utils.canonicalize_name(
                 requirement.name, validate=True
             ),
             version_constraint=str(requirement.specifier),
-            dependency_extras_arr=list(requirement.extras),
+            dependency_extras_arr=dependency_extras,
             parsable=True,
         )
 
@@ -119,95 +129,122 @@ class DistributionProcessingService:
         ) as cursor:
             requirements: list[models.Requirement] = []
             try:
-                logger.debug(
-                    f"{distribution.distribution_id} - Deleting existing requirements."
-                )
+                # The delete, inserts, update and commit are sent as a pipeline, and only
+                # wait on the server when results are needed, or on commit.
+                async with common.pipeline(conn):
+                    logger.debug(
+                        f"{distribution.distribution_id} - Deleting existing requirements."
+                    )
 
-                await self.requirements_repo.delete_requirements(
-                    distribution_id=distribution.distribution_id,
-                    cursor=cursor,
-                )
+                    await self.requirements_repo.delete_requirements(
+                        distribution_id=distribution.distribution_id,
+                        cursor=cursor,
+                    )
 
-                try:
-                    if metadata.requires_dist:
-                        for requirement in metadata.requires_dist:
-                            requirements.append(DistributionProcessingService.convert_requirement(
-                                distribution_id=distribution.distribution_id,
-                                requirement=requirement,
-                            ))
+                    try:
+                        if metadata.requires_dist:
+                            for requirement in metadata.requires_dist:
+                                requirements.append(DistributionProcessingService.convert_requirement(
+                                    distribution_id=distribution.distribution_id,
+                                    requirement=requirement,
+                                ))
 
-                except Exception as ex:
-                    logger.warning("Error while iterating through metadata.requires_dist", exc_info=True)
-                    raw_req_dist = metadata._raw["requires_dist"]
-                    for req_idx in range(len(raw_req_dist)):
-                        try:
-                            requirement_text = raw_req_dist[req_idx]
+                    except Exception as ex:
+                        logger.warning("Error while iterating through metadata.requires_dist", exc_info=True)
+                        raw_req_dist = metadata._raw["requires_dist"]
+                        for req_idx in range(len(raw_req_dist)):
+                            try:
+                                requirement_text = raw_req_dist[req_idx]
 
-                            # Some metadata files have blank "RequiresDist:" lines.
-                            if not requirement_text or str.isspace(requirement_text):
-                                continue
+                                # Some metadata files have blank "RequiresDist:" lines.
+                                if not requirement_text or str.isspace(requirement_text):
+                                    continue
 
-                            requirements.append(DistributionProcessingService.convert_requirement(
-                                distribution_id=distribution.distribution_id,
-                                requirement=requirement_text,
-                            ))
-
-                        except Exception as ex:
-                            logger.warning("Unable to parse requirement: %s", requirement_text)
-                            requirements.append(
-                                models.Requirement(
-                                    requirement_id=None,
+                                requirements.append(DistributionProcessingService.convert_requirement(
                                     distribution_id=distribution.distribution_id,
-                                    dependency_name=requirement_text,
-                                    parsable=False,
-                                    # TODO: Can any of these be refined?
-                                    extras="",
-                                    dependency_extras="",
-                                    version_constraint="",
-                                    dependency_extras_arr=[],
+                                    requirement=requirement_text,
+                                ))
+
+                            except Exception as ex:
+                                logger.warning("Unable to parse requirement: %s", requirement_text)
+                                requirements.append(
+                                    models.Requirement(
+                                        requirement_id=None,
+                                        distribution_id=distribution.distribution_id,
+                                        dependency_name=requirement_text,
+                                        parsable=False,
+                                        # TODO: Can any of these be refined?
+                                        extras="",
+                                        dependency_extras="",
+                                        version_constraint="",
+                                        dependency_extras_arr=[],
+                                    )
                                 )
-                            )
 
-                logger.info(
-                    f"{distribution.distribution_id} - Found {len(requirements)} requirements."
-                )
+                    logger.info(
+                        f"{distribution.distribution_id} - Found {len(requirements)} requirements."
+                    )
 
-                await self.requirements_repo.insert_requirements(
-                    requirements,
-                    cursor=cursor,
-                )
+                    if constants.REQUIREMENTS_STORAGE == "sets":
+                        requirement_set_hash = (
+                            await self.requirements_repo.insert_requirement_set(
+                                requirements,
+                                cursor=cursor,
+                            )
+                            if requirements
+                            else None
+                        )
 
-                if discover_package_names:
-                    distinct_package_names = list(
-                        {dd.dependency_name for dd in requirements}
-                    )
+                        await self.distributions_repo.set_requirement_set(
+                            distribution_id=distribution.distribution_id,
+                            requirement_set_hash=requirement_set_hash,
+                            cursor=cursor,
+                        )
 
-                    logger.debug(
-                        f"{distribution.distribution_id} - Propagating {len(distinct_package_names)} package names back to Postgres."
-                    )
+                        # Linking a distribution to an existing set doesn't produce any
+                        # CDC events, so reverse dependencies are maintained here instead.
+                        if self.reverse_dependencies_repo is not None:
+                            await self.reverse_dependencies_repo.refresh_version_of_distribution(
+                                distribution_id=distribution.distribution_id,
+                                cursor=cursor,
+                            )
+                    else:
+                        await self.requirements_repo.insert_requirements(
+                            requirements,
+                            cursor=cursor,
+                        )
 
-                    result = await self.package_names_repo.insert_package_names(
-                        distinct_package_names,
-                        return_inserted=(self.rabbitmq_publish_service is not None),
-                        cursor=cursor,
-                    )
+                    if discover_package_names:
+                        distinct_package_names = list(
+                            {dd.dependency_name for dd in requirements}
+                        )
 
-                    if self.rabbitmq_publish_service is not None and result:
                         logger.debug(
-                            f"{distribution.distribution_id} - Propagating {len(result)} package names to RabbitMQ."
+                            f"{distribution.distribution_id} - Propagating {len(distinct_package_names)} package names back to Postgres."
                         )
-                        self.rabbitmq_publish_service.publish_package_names(result)
 
-                logger.debug(
-                    f"{distribution.distribution_id} - Marking processed."
-                )
-                distribution.metadata_file_size = metadata_file_size
-                distribution.processed = True
-                await self.distributions_repo.update_distributions(
-                    [distribution], cursor=cursor
-                )
+                        result = await self.package_names_repo.insert_package_names(
+                            distinct_package_names,
+                            return_inserted=(self.rabbitmq_publish_service is not None),
+                            cursor=cursor,
+                        )
+
+                        if self.rabbitmq_publish_service is not None and result:
+                            logger.debug(
+                                f"{distribution.distribution_id} - Propagating {len(result)} package names to RabbitMQ."
+                            )
+                            self.rabbitmq_publish_service.publish_package_names(result)
+
+                    logger.debug(
+                        f"{distribution.distribution_id} - Marking processed."
+                    )
+                    distribution.metadata_file_size = metadata_file_size
+                    distribution.processed = True
+                    await self.distributions_repo.update_distributions(
+                        [distribution], cursor=cursor
+                    )
 
-                await cursor.execute("commit;")
+                    await conn.commit()
 
             except Exception as ex:
                 logger.error(
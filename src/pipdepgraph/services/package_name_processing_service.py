@@ -7,7 +7,7 @@ from psycopg_pool import AsyncConnectionPool
 from psycopg.rows import dict_row
 
 from pipdepgraph import models, pypi_api, constants
-from pipdepgraph.core import parsing
+from pipdepgraph.core import common, parsing
 from pipdepgraph.repositories import (
     distributions_repository,
     package_names_repository,
@@ -150,60 +150,63 @@ class PackageNameProcessingService:
             row_factory=dict_row
         ) as cursor:
             try:
-                logger.debug(f"{package_name} - Saving version information.")
-                await self.versions_repo.insert_versions(
-                    versions, cursor=cursor
-                )
-
-                logger.debug(f"{package_name} - Building version_id map.")
-                version_id_map = {
-                    version.package_version: version.version_id
-                    async for version in self.versions_repo.iter_versions(
-                        package_name=package_name.package_name,
-                        cursor=cursor,
-                    )
-                }
-
-                distributions: list[models.Distribution] = [
-                    models.Distribution(
-                        distribution_id=None,
-                        version_id=version_id_map[version],
-                        metadata_file_size=None,
-                        processed=False,
-                        python_version=distribution.python_version,
-                        package_filename=distribution.package_filename,
-                        package_type=distribution.package_type,
-                        package_url=distribution.package_url,
-                        requires_python=distribution.requires_python,
-                        upload_time=distribution.upload_time,
-                        yanked=distribution.yanked,
-                    )
-                    for version, distributions in package_vers_dists_result.versions.items()
-                    for distribution in distributions
-                ]
-
-                logger.debug(f"{package_name} - Saving distribution information.")
-                result = (
-                    await self.distributions_repo.insert_distributions(
-                        distributions,
-                        return_inserted=(self.rabbitmq_publish_service is not None),
-                        cursor=cursor,
+                # Statements are sent as a pipeline, and only wait on the server when
+                # results are needed (the version ID map), or on commit.
+                async with common.pipeline(conn):
+                    logger.debug(f"{package_name} - Saving version information.")
+                    await self.versions_repo.insert_versions(
+                        versions, cursor=cursor
                     )
-                )
 
-                if self.rabbitmq_publish_service is not None and result:
-                    logger.debug(
-                        f"{package_name} - Publishing new distributions to RabbitMQ."
+                    logger.debug(f"{package_name} - Building version_id map.")
+                    version_id_map = {
+                        version.package_version: version.version_id
+                        async for version in self.versions_repo.iter_versions(
+                            package_name=package_name.package_name,
+                            cursor=cursor,
+                        )
+                    }
+
+                    distributions: list[models.Distribution] = [
+                        models.Distribution(
+                            distribution_id=None,
+                            version_id=version_id_map[version],
+                            metadata_file_size=None,
+                            processed=False,
+                            python_version=distribution.python_version,
+                            package_filename=distribution.package_filename,
+                            package_type=distribution.package_type,
+                            package_url=distribution.package_url,
+                            requires_python=distribution.requires_python,
+                            upload_time=distribution.upload_time,
+                            yanked=distribution.yanked,
+                        )
+                        for version, distributions in package_vers_dists_result.versions.items()
+                        for distribution in distributions
+                    ]
+
+                    logger.debug(f"{package_name} - Saving distribution information.")
+                    result = (
+                        await self.distributions_repo.insert_distributions(
+                            distributions,
+                            return_inserted=(self.rabbitmq_publish_service is not None),
+                            cursor=cursor,
+                        )
                     )
-                    self.rabbitmq_publish_service.publish_distributions(result)
 
-                logger.debug(f"{package_name} - Marking package checked.")
-                package_name.date_last_checked = now
-                await self.package_names_repo.update_package_names(
-                    [package_name], cursor=cursor
-                )
+                    if self.rabbitmq_publish_service is not None and result:
+                        logger.debug(
+                            f"{package_name} - Publishing new distributions to RabbitMQ."
+                        )
+                        self.rabbitmq_publish_service.publish_distributions(result)
+
+                    logger.debug(f"{package_name} - Marking package checked.")
+                    package_name.date_last_checked = now
+                    await self.package_names_repo.update_package_names(
+                        [package_name], cursor=cursor
+                    )
 
-                await cursor.execute("commit;")
+                    await conn.commit()
 
             except Exception as ex:
                 logger.error(
@@ -8,6 +8,7 @@ import pika.channel
 import pika.connection
 
 from pipdepgraph import models, constants
+from pipdepgraph.core import rabbitmq
 
 
 class RabbitMqPublishService:
@@ -114,7 +115,7 @@ class RabbitMqPublishService:
         def _publish(channel: pika.channel.Channel):
             channel.basic_publish(
                 exchange=constants.RABBITMQ_EXCHANGE,
-                routing_key=f"cdc.{event.schema}.{event.table}.{event.event_id}",
+                routing_key=_cdc_event_log_entry_routing_key(event),
                 body=event.to_json(),
             )
 
@@ -123,3 +124,34 @@ class RabbitMqPublishService:
             return
         with self.rmq_conn_factory() as connection, connection.channel() as channel:
             _publish(channel)
+
+    async def publish_cdc_event_log_entries_confirmed(
+        self,
+        events: list[models.EventLogEntry],
+        publisher: rabbitmq.ConfirmedPublisher,
+    ):
+        """
+        Publishes `events` as persistent messages, encoded as `CDC_MESSAGE_ENCODING`, and
+        waits until the broker has confirmed all of them. Raises if any of them weren't
+        confirmed.
+        """
+
+        for event in events:
+            body, content_type = rabbitmq.encode_message_body(
+                event.to_dict(), constants.CDC_MESSAGE_ENCODING
+            )
+            publisher.publish(
+                exchange=constants.RABBITMQ_EXCHANGE,
+                routing_key=_cdc_event_log_entry_routing_key(event),
+                body=body,
+                properties=pika.BasicProperties(
+                    content_type=content_type,
+                    delivery_mode=pika.DeliveryMode.Persistent,
+                ),
+            )
+
+        await publisher.wait_for_confirms()
+
+
+def _cdc_event_log_entry_routing_key(event: models.EventLogEntry) -> str:
+    return f"cdc.{event.schema}.{event.table}.{event.event_id}"